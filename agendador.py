@@ -0,0 +1,119 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import registo
+
+
+class Job:
+    """
+    Tarefa periódica do agendador.
+    As execuções são marcadas em instantes absolutos (início + k * período),
+    pelo que a duração de cada execução não se acumula como deriva; o jitter
+    é aplicado a cada execução sem alterar essa grelha.
+    """
+
+    def __init__(self, name, period, func, jitter, start):
+        self.name = name
+        self.period = period
+        self.func = func
+        self.jitter = jitter
+        self.anchor = start
+        self.runs = 0
+        self.skipped = 0
+        self.running = False
+        self.cancelled = False
+
+    def next_time(self):
+        return self.anchor + self.runs * self.period + random.uniform(0, self.jitter * self.period)
+
+
+class Scheduler:
+    """
+    Agendador baseado num heap: cada tarefa corre no seu próprio período,
+    numa pool de threads, para que uma medição lenta (iperf) não atrase as
+    restantes. Se uma tarefa ainda estiver a correr quando chega a execução
+    seguinte, essa execução é saltada em vez de se sobrepor.
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agendador")
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, name, period, func, jitter=0.1, initial_delay=0.0):
+        """
+        Agenda `func()` a cada `period` segundos, substituindo uma tarefa com o mesmo nome.
+        """
+        if period <= 0:
+            raise ValueError(f"Período inválido para '{name}': {period}")
+        with self.condition:
+            self._cancel(name)
+            job = Job(name, period, func, jitter, time.monotonic() + initial_delay)
+            self.jobs[name] = job
+            heapq.heappush(self.heap, (job.next_time(), next(self.counter), job))
+            self.condition.notify()
+        return job
+
+    def cancel(self, name):
+        with self.condition:
+            self._cancel(name)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.executor.shutdown(wait=False)
+
+    def _cancel(self, name):
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancelled = True  # Removida do heap de forma preguiçosa
+
+    def _run(self):
+        with self.condition:
+            while not self.stopped:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                due, _, job = self.heap[0]
+                if job.cancelled:
+                    heapq.heappop(self.heap)
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+
+                heapq.heappop(self.heap)
+                job.runs += 1
+                # Correção de deriva: se a execução já vai atrasada mais de um
+                # período, avança a grelha em vez de executar em rajada
+                late = int((time.monotonic() - job.anchor) / job.period) + 1 - job.runs
+                if late > 0:
+                    job.runs += late
+                    job.skipped += late
+
+                if job.running:
+                    job.skipped += 1
+                else:
+                    job.running = True
+                    self.executor.submit(self._execute, job)
+                heapq.heappush(self.heap, (job.next_time(), next(self.counter), job))
+
+    def _execute(self, job):
+        try:
+            job.func()
+        except Exception as e:
+            registo.error("Agendador", "Erro na tarefa '%s': %s", job.name, e)
+        finally:
+            job.running = False
@@ -1,8 +1,56 @@
+import argparse
 import socket
 import time
-from threading import Thread
+import itertools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from threading import Event, Lock, Thread
 import mensagens
+import instrumentacao
+import registo
 import metricas 
+from fiabilidade import ReliableSender
+from lotes import ReportBatcher
+from alertas import AlertChannel
+from agendador import Scheduler
+from regras import DEFAULT_OPERATORS, OPERATORS
+from amostragem import DeviceSampler
+
+AGENT_ID = 0  # ID deste agente
+SESSION = 0  # Nonce de sessão gerado em cada registo
+SEQUENCES = itertools.count(1)  # Sequências das mensagens enviadas pelo agente
+
+# Modo de envio em lote (--batch-reports): os ciclos de recolha são acumulados
+# em blocos REPORT_BATCH (codificados em delta) em vez de um REPORT por tarefa
+REPORT_BATCHING = False
+BATCHER = ReportBatcher()
+ALERTS = None  # Canal TCP persistente para ALERTFLOW, aberto após o registo
+
+# Os coletores de rede de cada ciclo (ping, iperf) correm em paralelo
+COLLECTORS = ThreadPoolExecutor(max_workers=4, thread_name_prefix="coletor")
+COLLECTOR_MARGIN = 5  # Segundos de tolerância além da duração esperada de cada coletor
+
+# Cada métrica é recolhida no seu próprio período (frequency da configuração)
+SCHEDULER = Scheduler()
+
+# CPU, RAM e interfaces são amostrados em segundo plano (iniciado após o registo)
+SAMPLER = DeviceSampler()
+DEFAULT_FREQUENCY = 10  # Segundos, quando a tarefa não indica frequência
+
+STATS_PORT = 9201  # Endpoint local das métricas internas (formato Prometheus)
+
+
+def next_sequence():
+    """
+    Devolve um número de sequência novo para uma mensagem do agente.
+    """
+    return next(SEQUENCES) % mensagens.SEQUENCE_MODULO
+
+def send_datagram(sock, message, address):
+    """
+    Envio direto (sem esperar ACK), contabilizado por tipo de mensagem.
+    """
+    sock.sendto(message, address)
+    instrumentacao.MESSAGES_SENT.inc(type=mensagens.message_type_name(message))
 
 def initialize_agent():
     """
@@ -15,258 +63,450 @@ def initialize_agent():
     return server_ip, udp_port, tcp_port, agent_id
 
 
-def send_with_ack(sock, message, destination, max_attempts=3):
+def send_and_wait(sock, sender, message, destination):
     """
-    Envia uma mensagem e aguarda o ACK.
-    Fecha a socket após falha em todas as tentativas.
+    Envia uma mensagem pela camada de fiabilidade e aguarda o ACK,
+    lendo o socket diretamente. Usado apenas antes de o receptor UDP arrancar.
     """
-    attempt = 0
-    sequence = mensagens.decode_message(message).get("sequence", None)
-
-    sock.settimeout(3)  # Define timeout enquanto aguarda o ACK
-    while attempt < max_attempts:
+    entry = sender.send(message, destination)
+    while not entry.done.is_set():
+        sock.settimeout(sender.next_timeout())
         try:
-            sock.sendto(message, destination)
-            print(f"[UDP] Mensagem enviada para {destination} (Tentativa {attempt + 1})")
-
-            response, _ = sock.recvfrom(1024)
+            response, address = sock.recvfrom(mensagens.RECV_BUFFER)
             decoded = mensagens.decode_message(response)
-            print(f"[DEBUG] Resposta decodificada: {decoded}")
-
-            if decoded["type"] == "ACK" and decoded["sequence"] == sequence:
-                print("[UDP] ACK recebido. Comunicação confirmada.")
-                return True  # ACK recebido com sucesso
+            instrumentacao.MESSAGES_RECEIVED.inc(type=decoded["type"])
+            registo.debug("UDP", "Resposta decodificada: %s", decoded)
+            if decoded["type"] == "ACK":
+                sender.handle_ack(address, decoded["sequence"])
         except socket.timeout:
-            print(f"[UDP] Timeout aguardando ACK (Tentativa {attempt + 1}).")
-        attempt += 1
-        time.sleep(3)
+            pass
+        sender.poll()
 
-    print("[UDP] Número máximo de tentativas atingido. Fechando socket.")
-    sock.close()
-    return False  # Falha ao receber o ACK
+    if entry.acked:
+        registo.info("UDP", "ACK recebido. Comunicação confirmada.")
+    return entry.acked
 
 
-def register_agent(sock, server_ip, udp_port, agent_id):
+def register_agent(sock, sender, server_ip, udp_port, agent_id):
     """
     Envia uma mensagem ATIVA ao servidor e aguarda o ACK.
+    Cada registo abre uma sessão nova, identificada por um nonce.
     """
-    sequence = 1
-    message = mensagens.create_ativa_message(sequence, agent_id)
-    print(f"[DEBUG] Mensagem ATIVA criada: {message}")
-
-    return send_with_ack(sock, message, (server_ip, udp_port))
-
-def send_tcp_message(server_ip, tcp_port, message, max_attempts=3):
-    """
-    Envia uma mensagem via TCP para o servidor e espera por uma resposta.
-    Inclui lógica para reconexão em caso de falhas.
-    """
-    for attempt in range(max_attempts):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_sock:
-                tcp_sock.settimeout(3)  # Timeout de 3 segundos
-                tcp_sock.connect((server_ip, tcp_port))
-                print(f"[TCP] Conectado ao servidor TCP em {server_ip}:{tcp_port} (Tentativa {attempt + 1})")
-
-                # Enviar a mensagem
-                tcp_sock.sendall(message)
-                print(f"[TCP] Mensagem enviada: {mensagens.decode_message(message)}")
+    global AGENT_ID, SESSION
+    AGENT_ID = agent_id
+    SESSION = mensagens.new_session()
 
-                # Receber a resposta
-                ack = tcp_sock.recv(1024)
-                decoded_response = mensagens.decode_message(ack)
-                print(f"[TCP] Resposta do servidor: {decoded_response}")
+    sequence = next_sequence()
+    message = mensagens.create_ativa_message(sequence, AGENT_ID, SESSION)
+    registo.debug("UDP", "Mensagem ATIVA criada: %s", message)
 
-                return decoded_response  # Sucesso
-        except (socket.timeout, Exception) as e:
-            print(f"[TCP] Erro na comunicação TCP (Tentativa {attempt + 1}): {e}")
-            time.sleep(3)  # Esperar antes de tentar novamente
+    return send_and_wait(sock, sender, message, (server_ip, udp_port))
 
-    print("[TCP] Falha após todas as tentativas de conexão.")
-    return None
-
-def send_alertflow_metric(sock, server_address, result, alert_condition, tcp_port, sequence):
+def send_alertflow_metric(sender, server_address, result, alert_condition, tcp_port, sequence):
     """
-    Envia um alertflow ao servidor.
+    Envia um alertflow ao servidor pelo canal TCP persistente.
     """
     if isinstance(result, (int, float)):
         result = {"value": result}  # Transformar em dicionário se for um número
 
     result["alert_condition"] = alert_condition  # Adicionar a condição de alerta
-    alert_message = mensagens.create_alert_message_metric(result,sequence)
+    alert_message = mensagens.create_alert_message_metric(result, sequence, AGENT_ID, SESSION)
 
-    # Enviar o alertflow via TCP
-    response = send_tcp_message(server_address[0], tcp_port, alert_message)  # Corrigido para usar server_address[0]
-    if response:
-        print(f"[ALERTFLOW - TCP] Alertflow enviado e resposta recebida: {response}")
+    # O ACK é tratado de forma assíncrona pelo canal
+    if ALERTS.send(alert_message):
+        registo.info("ALERTFLOW - TCP", "Alertflow %d colocado em fila", sequence)
     else:
-        print("[ALERTFLOW - TCP] Falha ao enviar alertflow.")
+        registo.error("ALERTFLOW - TCP", "Falha ao enviar alertflow.")
+
 
+def send_alertflow(sender, server_address, report, tcp_port, sequence):
+    """
+    Envia um alertflow ao servidor pelo canal TCP persistente.
+    """
+    alert_message = mensagens.create_alert_message(report, sequence, AGENT_ID, SESSION)
+    if ALERTS.send(alert_message):
+        registo.info("ALERTFLOW - TCP", "Alertflow %d colocado em fila", sequence)
+    else:
+        registo.error("ALERTFLOW - TCP", "Falha ao enviar alertflow.")
 
-def send_alertflow(sock, server_address, report, tcp_port, sequence):
+def collect_cycle(metrics, link_metrics):
+    """
+    Executa em paralelo os coletores de rede da tarefa e junta-os às
+    métricas do dispositivo já amostradas num único registo de ciclo.
+    Um coletor que ultrapasse o seu prazo fica de fora deste ciclo.
+    """
+    jobs = {}
+    if "latency" in link_metrics:
+        ping = link_metrics["latency"]["ping"]
+        jobs["ping"] = (COLLECTORS.submit(metricas.ping_and_store, ping["destination"], ping["count"]),
+                        ping["count"] + COLLECTOR_MARGIN)
+    if "bandwidth" in link_metrics:
+        iperf = link_metrics["bandwidth"]["iperf"]
+        jobs["iperf"] = (COLLECTORS.submit(metricas.iperf_and_store, iperf.get("server"),
+                                           iperf.get("port"), iperf.get("duration")),
+                         (iperf.get("duration") or 10) + COLLECTOR_MARGIN)
+
+    # As métricas do dispositivo vêm da amostragem em segundo plano, sem bloquear
+    result = {}
+    if metrics.get("cpu_usage") == True:
+        cpu = SAMPLER.cpu()
+        if cpu is not None:  # Ainda sem duas leituras para calcular o uso
+            result["cpu"] = cpu
+    if metrics.get("ram_usage") == True:
+        result["ram"] = SAMPLER.ram()
+    if metrics.get("interface_stats"):
+        result["interfaces"] = SAMPLER.interface_stats(metrics["interface_stats"])
+
+    start = time.monotonic()
+    for name, (future, timeout) in jobs.items():
+        try:
+            value = future.result(timeout=max(0, start + timeout - time.monotonic()))
+        except FutureTimeout:
+            registo.warning("TASK", "Coletor '%s' excedeu o prazo de %s s", name, timeout)
+            continue
+        # Um teste iperf falhado não é uma medição de 0 Mbps; fica de fora do ciclo
+        if isinstance(value, dict) and value.get("error"):
+            registo.warning("TASK", "Coletor '%s' falhou: %s", name, value["error"])
+            continue
+        result[name] = value
+    return result
+
+
+def local_threshold(condition):
     """
-    Envia um alertflow ao servidor.
+    (limiar, operador) de uma condição avaliada no agente, ou None.
+    As condições com janela ou agregado ficam para o servidor, que as
+    avalia sobre as séries recebidas (regras.RuleEngine).
     """
-    alert_message = mensagens.create_alert_message(report, sequence)
-    response = send_tcp_message(server_address[0], tcp_port, alert_message)
-    if response: 
-        print(f"[ALERTFLOW - TCP] Alertflow enviado com sucesso: {response}")
+    if isinstance(condition, dict):
+        if condition.get("window") or condition.get("aggregate"):
+            return None
+        threshold, operator = condition.get("threshold"), condition.get("operator")
     else:
-        print("[ALERTFLOW - TCP] Falha ao enviar alertflow.")
+        threshold, operator = condition, None
+    if not isinstance(threshold, (int, float)) or isinstance(threshold, bool):
+        return None
+    return threshold, operator
+
 
-def process_task(sock, server_address, task, alertflow_count, tcp_port):
+def check_alerts(sender, server_address, result, alert_conditions, tcp_port):
     """
-    Processa a tarefa recebida e realiza as metricas.
-    Envia um relatório final ou alertflow ao servidor.
+    Avalia as condições de alerta sobre um ciclo recolhido e envia um
+    alertflow por cada condição violada. Devolve o nº de alertflows enviados.
+    Aceita limiares simples ({"latency": 1}) e a forma {"threshold": ...,
+    "operator": ...}; métricas sem valor neste ciclo são ignoradas.
     """
-    sequence = task.get("sequence")
+    alertflow_count = 0
+    values = mensagens.report_metrics(result)
+    for metric, condition in (alert_conditions or {}).items():
+        rule = local_threshold(condition)
+        if rule is None or metric not in values:
+            continue
+        threshold, operator = rule
+        compare = OPERATORS.get(operator or DEFAULT_OPERATORS.get(metric, ">"))
+        if compare is not None and compare(values[metric], threshold):
+            send_alertflow_metric(sender, server_address, values[metric], threshold, tcp_port, next_sequence())
+            alertflow_count += 1
+    return alertflow_count
+
 
-    task_id = task.get("sequence")
-    metrics = task.get("metrics")
-    link_metrics = task.get("link_metrics")
-    alert_conditions = task.get("alert_conditions")
+def add_alertflows(task_state, count):
+    """
+    Soma alertflows ao contador do agente; ao terceiro, o agente termina.
+    """
+    with task_state["lock"]:
+        task_state["alertflow_count"] += count
+        if task_state["alertflow_count"] >= 3 and not task_state["stop"].is_set():
+            registo.error("TASK", "Terceiro Alertflow : Terminar agente")
+            task_state["stop"].set()
 
 
-    results = []
+def run_collection(sender, server_address, task, tcp_port, task_state, metrics, link_metrics):
+    """
+    Execução agendada de um grupo de métricas da tarefa: recolhe, avalia os
+    alertas e guarda o resultado para o próximo relatório.
+    """
     try:
-        for attempt in range(1, 4):  # Loop de tentativas
-            result = {}
-
-            # Executar métricas (ping, iperf, etc.)
-            if "latency" in link_metrics:
-                print(f"[TASK] Realizando ping ({attempt}/3)...")
-                result["ping"] = metricas.ping_and_store(
-                    link_metrics["latency"]["ping"]["destination"],
-                    link_metrics["latency"]["ping"]["count"]
-                )
-                if int(result["ping"].get('avg_time', 'N/A')) > alert_conditions["latency"] :
-                    send_alertflow_metric(sock, server_address, result["ping"].get('avg_time', 'N/A'), alert_conditions["latency"], tcp_port, sequence)
-                    alertflow_count = alertflow_count + 1
-
-            if "bandwidth" in link_metrics:
-                print(f"[TASK] Realizando iperf ({attempt}/3)...")
-                result["iperf"] = metricas.iperf_and_store(
-                    link_metrics["bandwidth"]["iperf"].get("server"),
-                    link_metrics["bandwidth"]["iperf"].get("port"),
-                    link_metrics["bandwidth"]["iperf"].get("duration")
-                )
-                if int(result["iperf"].get('bandwidth_mbps', 'N/A')) < alert_conditions["bandwidth"] : 
-                    send_alertflow_metric(sock, server_address, result["iperf"].get('bandwidth_mbps', 'N/A'), alert_conditions["bandwidth"], tcp_port,sequence )
-                    alertflow_count = alertflow_count + 1
-
-            if metrics.get("cpu_usage") == True:
-                print(f"[TASK] Monitorando CPU ({attempt}/3)...")
-                result["cpu"] = metricas.collect_cpu_usage()
-                if int(result["cpu"]) > alert_conditions["cpu_usage"] :
-                    send_alertflow_metric(sock, server_address,result["cpu"],alert_conditions["cpu_usage"], tcp_port,sequence)
-                    alertflow_count = alertflow_count + 1
-
-            if metrics.get("ram_usage") == True:
-                print(f"[TASK] Monitorando RAM ({attempt}/3)...")
-                result["ram"] = metricas.get_ram_usage()
-                if int(result["ram"].get('percent', 'N/A')) > alert_conditions["ram_usage"] :
-                    send_alertflow_metric(sock, server_address, result["ram"].get('percent', 'N/A'),alert_conditions["ram_usage"], tcp_port,sequence)
-                    alertflow_count = alertflow_count + 1
-
-            results.append(result)  # Adiciona o resultado desta tentativa à lista de resultados
-            time.sleep(5)
-
-        # Criar o relatório final após as tentativas
-    
+        result = collect_cycle(metrics, link_metrics)
+        alertflow_count = check_alerts(sender, server_address, result, task.get("alert_conditions"), tcp_port)
+    except Exception as e:
+        registo.error("TASK", "Falha na recolha da tarefa %s: %s", task.get("task_id"), e)
+        with task_state["lock"]:
+            task_state["progress"][task_key(task)]["errors"].append(str(e))
+        return
+
+    with task_state["lock"]:
+        task_state["progress"][task_key(task)]["results"].append(result)
+    add_alertflows(task_state, alertflow_count)
+
+    if REPORT_BATCHING:
+        for batch in BATCHER.add(mensagens.report_metrics(result)):
+            send_report_batch(sender, server_address, batch)
+
+
+def send_task_report(sender, server_address, task, tcp_port, task_state):
+    """
+    Execução agendada, na frequência da tarefa: envia um relatório com os
+    resultados recolhidos desde o anterior, ou um alertflow se houve falhas.
+    """
+    with task_state["lock"]:
+        progress = task_state["progress"][task_key(task)]
+        results, progress["results"] = progress["results"], []
+        errors, progress["errors"] = progress["errors"], []
+
+    task_id = task.get("task_id") or task.get("sequence")
+    if errors:
+        registo.error("TASK", "Falha na tarefa %s: %s", task_id, errors[-1])
+        report = {"task_id": task_id, "results": results, "status": "failed", "error": errors[-1]}
+        send_alertflow(sender, server_address, report, tcp_port, next_sequence())
+        add_alertflows(task_state, 1)
+    elif results and not REPORT_BATCHING:
         report = {"task_id": task_id, "results": results, "status": "success"}
+        send_report(sender, server_address, report, next_sequence())
+
+    # Envia o bloco em curso se já atingiu a idade máxima
+    if REPORT_BATCHING:
+        for batch in BATCHER.poll():
+            send_report_batch(sender, server_address, batch)
+
+
+def task_key(task):
+    """
+    Identificador de uma tarefa no agente (um agente pode ter várias).
+    """
+    return task.get("task_id") or "tarefa"
+
+
+def schedule_task(sender, server_address, task, tcp_port, task_state):
+    """
+    Substitui as execuções agendadas da tarefa pelas da TASK recebida: cada
+    métrica corre na frequência indicada na configuração (a da sonda
+    ping/iperf, ou a da tarefa) e o relatório é enviado na frequência da
+    tarefa. As restantes tarefas do agente não são afetadas; uma TASK sem
+    métricas remove a tarefa.
+    """
+    key = task_key(task)
+    with task_state["lock"]:
+        for name in task_state["jobs"].pop(key, []):
+            SCHEDULER.cancel(name)
+        task_state["progress"][key] = {"results": [], "errors": []}
+        jobs = task_state["jobs"][key] = []
+
+    frequency = task.get("frequency") or DEFAULT_FREQUENCY
+    metrics = task.get("metrics") or {}
+    link_metrics = task.get("link_metrics") or {}
+
+    def add(name, period, func, *args, initial_delay=0, jitter=0.1):
+        name = f"{key}:{name}"
+        SCHEDULER.add(name, period, lambda: func(sender, server_address, task, tcp_port, task_state, *args),
+                      jitter=jitter, initial_delay=initial_delay)
+        jobs.append(name)
+        registo.info("TASK", "'%s' agendado a cada %s s", name, period)
+
+    if metrics.get("cpu_usage") == True or metrics.get("ram_usage") == True or metrics.get("interface_stats"):
+        add("device", metrics.get("frequency", frequency), run_collection, metrics, {})
+    if "latency" in link_metrics:
+        period = link_metrics["latency"]["ping"].get("frequency", frequency)
+        add("latency", period, run_collection, {}, {"latency": link_metrics["latency"]})
+    if "bandwidth" in link_metrics:
+        iperf = link_metrics["bandwidth"]["iperf"]
+        period = iperf.get("frequency", frequency)
+        if "offset" in iperf:
+            # Janela atribuída pelo servidor: o teste começa no desfasamento
+            # indicado (relógio de parede), sem jitter, para não sobrepor
+            # os testes de outros agentes no mesmo servidor iperf3
+            delay = (iperf["offset"] - time.time()) % period
+            add("bandwidth", period, run_collection, {}, {"bandwidth": link_metrics["bandwidth"]},
+                initial_delay=delay, jitter=0)
+        else:
+            add("bandwidth", period, run_collection, {}, {"bandwidth": link_metrics["bandwidth"]})
+    if not jobs:
+        registo.info("TASK", "Tarefa '%s' removida", key)
+        return
+    # O primeiro relatório sai ao fim de um período, já com as recolhas feitas
+    add("report", frequency, send_task_report, initial_delay=frequency)
+
+def send_report(sender, server_address, report,sequence):
+    """
+    Envia o relatório final ao servidor; a retransmissão fica a cargo da
+    camada de fiabilidade, sem bloquear a recolha de métricas.
+    """
+    try:
+        # Um REPORT leva no máximo MAX_REPORT_RESULTS resultados; o resto segue em REPORTs seguintes
+        for index, part in enumerate(mensagens.split_report(report)):
+            message = mensagens.create_serialized_report_message(sequence if index == 0 else next_sequence(),
+                                                                 part, AGENT_ID, SESSION)
+            # Relatórios maiores que um datagrama seguem fragmentados
+            for datagram in mensagens.split_message(message, next_sequence, AGENT_ID, SESSION):
+                sender.send(datagram, server_address)
     except Exception as e:
-        print(f"[TASK] Falha na tarefa {task_id}: {e}")
-        report = {"task_id": task_id, "results": results, "status": "failed", "error": str(e)}
+        registo.error("REPORT", "Erro ao enviar o relatório: %s", e)
 
-    # Avaliar as condições de alerta
-    if report["status"] == "failed":
-        send_alertflow(sock, server_address, report, tcp_port,sequence)
-        alertflow_count += 1
-    else:
-       send_report(sock, server_address, report, sequence)
-        
-    return alertflow_count
- 
-def send_report(sock, server_address, report,sequence):
+
+def send_report_batch(sender, server_address, batch):
     """
-    Envia o relatório final ao servidor.
+    Envia um bloco de séries temporais (vários ciclos de recolha) ao servidor.
     """
     try:
-        report_message_final = mensagens.create_serialized_report_message(sequence, report)
-        sock.sendto(report_message_final, server_address)
+        message = mensagens.create_report_batch_message(next_sequence(), batch, AGENT_ID, SESSION)
+        registo.debug("REPORT", "Bloco enviado: %d amostras em %d bytes", batch.samples(), len(message))
+        for datagram in mensagens.split_message(message, next_sequence, AGENT_ID, SESSION):
+            sender.send(datagram, server_address)
     except Exception as e:
-        print(f"[REPORT] Erro ao enviar o relatório: {e}")
+        registo.error("REPORT", "Erro ao enviar o bloco de relatórios: %s", e)
 
 
 
 
-def udp_receiver(sock, server_address, tcp_port):
+def handle_server_message(sock, sender, task_state, reassembler, decoded, address, ack=True):
     """
-    Recebe mensagens do servidor via UDP e processa as tarefas de maneira sequencial,
-    executando continuamente até que outra mensagem seja recebida.
+    Trata uma mensagem do servidor já descodificada.
+    Mensagens reconstruídas a partir de fragmentos já foram confirmadas
+    fragmento a fragmento (ack=False).
     """
-    print(f"[UDP] Cliente ouvindo na porta UDP {sock.getsockname()[1]}")
-
-    current_task = None  # Para armazenar a tarefa atual
-    alertflow_count = 0
-
+    if decoded["type"] == "TASK" and decoded["session"] != SESSION:
+        registo.warning("UDP", "Tarefa de uma sessão anterior ignorada: %d", decoded["session"])
+    elif decoded["type"] == "TASK":
+        # Enviar ACK para o servidor
+        if ack:
+            ack_message = mensagens.create_ack_message(decoded["sequence"], AGENT_ID, SESSION)
+            send_datagram(sock, ack_message, address)
+            registo.debug("UDP", "ACK enviado para o servidor em %s", address)
+
+        # Retransmissão de uma TASK já aplicada (o ACK anterior perdeu-se):
+        # reagendá-la descartaria os resultados já recolhidos
+        key = task_key(decoded)
+        with task_state["lock"]:
+            if task_state["applied"].get(key) == decoded:
+                registo.debug("UDP", "Tarefa %s duplicada ignorada (sequência %d)", key, decoded["sequence"])
+                return
+            task_state["applied"][key] = decoded
+            # Fica pendente até o worker a agendar (a mais recente de cada task_id)
+            task_state["pending"][key] = decoded
+        task_state["updated"].set()
+    elif decoded["type"] == "FRAGMENT":
+        # Cada fragmento é confirmado; só os perdidos são retransmitidos
+        ack_message = mensagens.create_ack_message(decoded["sequence"], AGENT_ID, SESSION)
+        send_datagram(sock, ack_message, address)
+
+        message = reassembler.add(address, decoded)
+        if message is not None:
+            handle_server_message(sock, sender, task_state, reassembler,
+                                  mensagens.decode_message(message), address, ack=False)
+    elif decoded["type"] == "ACK":
+        sender.handle_ack(address, decoded["sequence"])
+
+
+def udp_receiver(sock, sender, task_state):
+    """
+    Recebe mensagens do servidor via UDP: confirma as tarefas recebidas,
+    entrega os ACKs à camada de fiabilidade e dispara as retransmissões.
+    """
+    registo.info("UDP", "Cliente ouvindo na porta UDP %d", sock.getsockname()[1])
+    reassembler = mensagens.Reassembler()
+    # Buffer de receção reutilizado: o datagrama é descodificado no sítio
+    buffer = bytearray(mensagens.RECV_BUFFER)
+    view = memoryview(buffer)
 
-    while True:
+    while not task_state["stop"].is_set():
         try:
-            # Verificar se há uma mensagem nova
-            sock.settimeout(1)  # Timeout para evitar bloqueio permanente
+            # Timeout curto quando há mensagens por confirmar
+            sock.settimeout(sender.next_timeout() or 1)
             try:
-                message, address = sock.recvfrom(1024)
-                decoded = mensagens.decode_message(message)
-                print(f"[UDP] Mensagem decodificada recebida do servidor: {decoded}")
-
-                if decoded["type"] == "TASK":
-                    # Enviar ACK para o servidor
-                    ack_message = mensagens.create_ack_message(decoded["sequence"])
-                    sock.sendto(ack_message, address)
-                    print(f"[UDP] ACK enviado para o servidor em {address}")
-
-                    # Atualizar a tarefa atual
-                    current_task = decoded
+                nbytes, address = sock.recvfrom_into(buffer)
+                decoded = mensagens.decode_message(view[:nbytes])
+                instrumentacao.MESSAGES_RECEIVED.inc(type=decoded["type"])
+                registo.debug("UDP", "Mensagem decodificada recebida do servidor: %s", decoded)
+                handle_server_message(sock, sender, task_state, reassembler, decoded, address)
 
             except socket.timeout:
                 pass  # Continuar caso não haja novas mensagens
-         
-            # Continuar processando a tarefa atual, se existir
-            if current_task and alertflow_count<3 :
-                alertflow_count += process_task(sock, server_address, current_task, 0, tcp_port)
-                if alertflow_count >= 3 :
-                    print("Terceiro Alertflow : Terminar agente")
-                    sock.close()
-                    break
-                time.sleep(10)
 
+            sender.poll()
+
+        except OSError as e:
+            if task_state["stop"].is_set():
+                break
+            registo.error("UDP", "Erro ao processar mensagem: %s", e)
         except Exception as e:
-            print(f"[UDP] Erro ao processar mensagem: {e}")
+            registo.error("UDP", "Erro ao processar mensagem: %s", e)
+
 
+def task_worker(sock, sender, server_address, tcp_port, task_state):
+    """
+    Reagenda as métricas sempre que chegam tarefas novas ou alteradas, até o agente terminar.
+    """
+    while not task_state["stop"].is_set():
+        if not task_state["updated"].wait(1):
+            continue
+        task_state["updated"].clear()
+        with task_state["lock"]:
+            pending, task_state["pending"] = task_state["pending"], {}
+
+        for task in pending.values():
+            try:
+                schedule_task(sender, server_address, task, tcp_port, task_state)
+            except Exception as e:
+                registo.error("TASK", "Erro ao processar tarefa %s: %s", task_key(task), e)
+
+    SCHEDULER.stop()
+    SAMPLER.stop()
+    sock.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Agente NMS: recolha de métricas, relatórios e alertas.")
+    parser.add_argument("--batch-reports", action="store_true",
+                        help="enviar os ciclos de recolha em blocos REPORT_BATCH em vez de um REPORT por tarefa")
+    parser.add_argument("--batch-max-age", type=float, default=60.0,
+                        help="idade máxima (s) de um bloco REPORT_BATCH antes de ser enviado")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_arguments()
+    REPORT_BATCHING = args.batch_reports
+    BATCHER = ReportBatcher(max_age=args.batch_max_age)
     server_ip, udp_port, tcp_port, agent_id = initialize_agent()
 
     # Criar uma única socket para todo o ciclo de vida do agente
     agent_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     agent_socket.bind(('', 33333))  # Porta fixa para o agente
 
+    # Camada de fiabilidade partilhada pelo registo e pelos relatórios
+    sender = ReliableSender(agent_socket)
+
     # Registrar o agente
-    if register_agent(agent_socket, server_ip, udp_port, agent_id):
+    if register_agent(agent_socket, sender, server_ip, udp_port, agent_id):
         # O valor de server_address é o IP e porta do servidor
         server_address = (server_ip, udp_port)
+        ALERTS = AlertChannel(server_ip, tcp_port)
+        SAMPLER.start()
+        instrumentacao.PENDING.track(lambda: len(sender.pending), queue="udp_unacked")
+        instrumentacao.PENDING.track(ALERTS.queue.qsize, queue="alert_queue")
+        instrumentacao.PENDING.track(lambda: len(ALERTS.unacked), queue="alert_unacked")
+        instrumentacao.start_http_server(STATS_PORT)
+        task_state = {"pending": {}, "updated": Event(), "stop": Event(), "lock": Lock(),
+                      "jobs": {}, "progress": {}, "applied": {}, "alertflow_count": 0}
 
         # Iniciar o receptor UDP somente se o registro foi bem-sucedido
-        udp_receiver_thread = Thread(target=udp_receiver, args=(agent_socket, server_address, tcp_port), daemon=True)
+        udp_receiver_thread = Thread(target=udp_receiver, args=(agent_socket, sender, task_state), daemon=True)
         udp_receiver_thread.start()
 
+        # A recolha de métricas corre numa thread própria para não atrasar os ACKs
+        task_worker_thread = Thread(target=task_worker, args=(agent_socket, sender, server_address, tcp_port, task_state), daemon=True)
+        task_worker_thread.start()
+
         try:
-            while True:
+            while not task_state["stop"].is_set():
                 time.sleep(1)
         except KeyboardInterrupt:
             print("\n[Agente] Encerrado.")
+            task_state["stop"].set()
             agent_socket.close()
+        ALERTS.close()
+    else:
+        registo.error("UDP", "Registo falhou. Fechando socket.")
+        agent_socket.close()
 
 
@@ -0,0 +1,196 @@
+import threading
+from collections import OrderedDict
+
+# Níveis de agregação: nome -> (largura do intervalo em ms, nº de intervalos mantidos em memória sem armazenamento)
+ROLLUP_TIERS = {
+    "1m": (60_000, 1440),     # 1 dia de intervalos de um minuto
+    "1h": (3_600_000, 2160),  # 90 dias de intervalos de uma hora
+}
+
+# Campos guardados por intervalo
+ROLLUP_FIELDS = ("min", "max", "avg", "count")
+
+
+class Rollups:
+    """
+    Agregados por intervalo (min/max/avg/count) de cada métrica de cada agente,
+    atualizados incrementalmente à medida que as amostras chegam.
+    Um intervalo fica aberto em memória até haver outro `grace` intervalos
+    mais recente; nessa altura é fechado e, se houver armazenamento, gravado
+    como as séries "<métrica>@<nível>:<campo>" e retirado da memória. Sem
+    armazenamento, os `retention` intervalos mais recentes ficam em memória.
+
+    Uma amostra atrasada que cai num intervalo já fechado reescreve-o: o
+    agregado gravado é lido, atualizado e gravado de novo (a última linha
+    de cada intervalo prevalece). Sem armazenamento, se o intervalo já saiu
+    da memória, a amostra é rejeitada e contada em `rejected`.
+    """
+
+    def __init__(self, tiers=ROLLUP_TIERS, store=None, grace=1):
+        self.tiers = tiers
+        self.store = store
+        self.grace = grace
+        self.buckets = {}  # (agent_id, métrica, nível) -> OrderedDict início -> [min, max, soma, n]
+        self.closed = {}  # (agent_id, métrica, nível) -> início a partir do qual os intervalos estão abertos
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def add(self, agent_id, metric, timestamp, value):
+        """
+        Acrescenta uma amostra (timestamp em ms) a todos os níveis.
+        """
+        with self.lock:
+            for tier, (width, retention) in self.tiers.items():
+                self._add(agent_id, metric, tier, width, retention, int(timestamp), float(value))
+
+    def add_series(self, agent_id, series):
+        """
+        Acrescenta séries {métrica: [(timestamp_ms, valor), ...]}.
+        """
+        with self.lock:
+            for metric, samples in series.items():
+                for tier, (width, retention) in self.tiers.items():
+                    for timestamp, value in samples:
+                        self._add(agent_id, metric, tier, width, retention, int(timestamp), float(value))
+
+    def query(self, agent_id, metric, tier, start=None, end=None):
+        """
+        Devolve os agregados do nível `tier` com start <= início < end (ms),
+        por ordem cronológica: [{"start", "min", "max", "avg", "count"}].
+        Os intervalos fechados são lidos do armazenamento.
+        """
+        start = -2 ** 63 if start is None else int(start)
+        end = 2 ** 63 - 1 if end is None else int(end)
+        rows = {}
+
+        if self.store is not None:
+            for bucket_start, (low, high, avg, count) in self._stored(agent_id, metric, tier, start, end).items():
+                rows[bucket_start] = {"start": bucket_start, "min": low, "max": high, "avg": avg, "count": count}
+
+        with self.lock:
+            buckets = self.buckets.get((str(agent_id), metric, tier), {})
+            for bucket_start, (low, high, total, count) in buckets.items():
+                if start <= bucket_start < end:
+                    rows[bucket_start] = {"start": bucket_start, "min": low, "max": high,
+                                          "avg": total / count, "count": count}
+
+        return [rows[key] for key in sorted(rows)]
+
+    def flush(self):
+        """
+        Fecha e grava no armazenamento todos os intervalos abertos.
+        """
+        if self.store is None:
+            return
+        with self.lock:
+            for key, buckets in self.buckets.items():
+                if buckets:
+                    width = self.tiers[key[2]][0]
+                    self._close_old(key, buckets, next(reversed(buckets)) + width)
+
+    def _add(self, agent_id, metric, tier, width, retention, timestamp, value):
+        key = (str(agent_id), metric, tier)
+        bucket_start = timestamp - timestamp % width
+        buckets = self.buckets.get(key)
+        if buckets is None:
+            buckets = self.buckets[key] = OrderedDict()
+            if self.store is not None:
+                self._resume(key, width, retention, bucket_start)
+        bucket = buckets.get(bucket_start)
+        if bucket is None:
+            if bucket_start < self.closed.get(key, -2 ** 63):
+                self._late(key, bucket_start, value)
+                return
+            buckets[bucket_start] = [value, value, value, 1]
+            if len(buckets) > 1 and bucket_start < next(reversed(buckets)):
+                # Amostra atrasada que abriu um intervalo ainda aberto: repõe a ordem
+                for existing in sorted(buckets):
+                    buckets.move_to_end(existing)
+            self._close_old(key, buckets, bucket_start - self.grace * width)
+            while len(buckets) > retention:
+                old_start, old_bucket = buckets.popitem(last=False)
+                if self.store is not None:
+                    self._persist(key, old_start, old_bucket)
+                self.closed[key] = max(self.closed.get(key, -2 ** 63), old_start + width)
+            return
+
+        _update(bucket, value)
+
+    def _close_old(self, key, buckets, limit):
+        """
+        Fecha os intervalos com início < limit; com armazenamento, são
+        gravados e saem da memória, pelo que só se percorrem os fechados.
+        """
+        if limit <= self.closed.get(key, -2 ** 63):
+            return
+        self.closed[key] = limit
+        if self.store is None:
+            return
+        while buckets:
+            bucket_start = next(iter(buckets))
+            if bucket_start >= limit:
+                break
+            self._persist(key, bucket_start, buckets.pop(bucket_start))
+
+    def _resume(self, key, width, retention, bucket_start):
+        """
+        Primeira amostra da série neste processo: o watermark é retomado do
+        último intervalo gravado (por exemplo no flush antes de um reinício),
+        para que as amostras nesse intervalo ou em anteriores sejam fundidas
+        com o agregado gravado em vez de o substituírem.
+        """
+        agent_id, metric, tier = key
+        timestamps, _ = self.store.scan(agent_id, rollup_name(metric, tier, "count"), bucket_start - retention * width)
+        if timestamps:
+            self.closed[key] = max(timestamps) + width
+
+    def _late(self, key, bucket_start, value):
+        if self.store is None:
+            bucket = self.buckets[key].get(bucket_start)
+            if bucket is None:
+                self.rejected += 1  # Intervalo já fora da memória e sem armazenamento
+            else:
+                _update(bucket, value)
+            return
+
+        stored = self._stored(key[0], key[1], key[2], bucket_start, bucket_start + 1).get(bucket_start)
+        if stored is None:
+            bucket = [value, value, value, 1]
+        else:
+            low, high, avg, count = stored
+            bucket = [low, high, avg * count, count]
+            _update(bucket, value)
+        self._persist(key, bucket_start, bucket)
+
+    def _stored(self, agent_id, metric, tier, start, end):
+        """
+        Agregados gravados {início: (min, max, avg, count)}; quando um
+        intervalo foi reescrito, vale a última linha.
+        """
+        columns = [self.store.scan(agent_id, rollup_name(metric, tier, field), start, end)
+                   for field in ROLLUP_FIELDS]
+        timestamps = columns[0][0]
+        return {bucket_start: tuple(columns[j][1][i] for j in range(3)) + (int(columns[3][1][i]),)
+                for i, bucket_start in enumerate(timestamps)}
+
+    def _persist(self, key, bucket_start, bucket):
+        agent_id, metric, tier = key
+        low, high, total, count = bucket
+        for field, value in zip(ROLLUP_FIELDS, (low, high, total / count, count)):
+            self.store.append(agent_id, rollup_name(metric, tier, field), bucket_start, value)
+
+
+def _update(bucket, value):
+    if value < bucket[0]:
+        bucket[0] = value
+    if value > bucket[1]:
+        bucket[1] = value
+    bucket[2] += value
+    bucket[3] += 1
+
+
+def rollup_name(metric, tier, field):
+    """
+    Nome da série, no armazenamento, de um campo agregado.
+    """
+    return f"{metric}@{tier}:{field}"
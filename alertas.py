@@ -0,0 +1,146 @@
+import queue
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import mensagens
+import registo
+from instrumentacao import ALERT_CONNECT, ALERT_CONNECTIONS, ALERT_LATENCY, MESSAGES_RECEIVED, MESSAGES_SENT
+
+
+class AlertChannel:
+    """
+    Canal TCP persistente para mensagens ALERTFLOW.
+    As mensagens são enviadas com prefixo de comprimento, em pipeline (sem
+    esperar pelo ACK da anterior); as não confirmadas são reenviadas depois
+    de uma reconexão automática com backoff exponencial.
+    """
+
+    def __init__(self, server_ip, tcp_port, connect_timeout=3.0, max_backoff=30.0, max_queue=1024):
+        self.server_address = (server_ip, tcp_port)
+        self.connect_timeout = connect_timeout
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue(max_queue)
+        self.unacked = OrderedDict()  # sequência -> mensagem, por ordem de envio
+        self.sent_at = {}  # sequência -> instante da primeira escrita (latência até ao ACK)
+        self.sock = None
+        self.reader = None
+        self.buffer = bytearray(65536)  # Buffer de receção dos ACKs, reutilizado
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def send(self, message):
+        """
+        Coloca um ALERTFLOW na fila de envio; não bloqueia.
+        Devolve False se a fila estiver cheia e o alerta for descartado.
+        """
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            registo.warning("ALERTFLOW - TCP", "Fila de alertas cheia; alerta descartado.")
+            return False
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join(timeout=1)
+        self._disconnect()
+
+    def _run(self):
+        backoff = 0.5
+        while not self.stopped.is_set():
+            if self.sock is None:
+                if not self._connect():
+                    self.stopped.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                backoff = 0.5
+
+            try:
+                self._send_queued()
+                self._read_acks()
+            except (OSError, ValueError) as e:
+                registo.warning("TCP", "Ligação de alertas perdida: %s", e)
+                self._disconnect()
+
+    def _connect(self):
+        start = time.monotonic()
+        try:
+            sock = socket.create_connection(self.server_address, timeout=self.connect_timeout)
+        except OSError as e:
+            registo.error("TCP", "Erro ao ligar a %s:%s: %s", self.server_address[0], self.server_address[1], e)
+            ALERT_CONNECTIONS.inc(result="error")
+            return False
+        ALERT_CONNECT.observe(time.monotonic() - start)
+        self.sock = sock
+        self.reader = mensagens.FrameReader()
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(self.connect_timeout)
+            # Reenvia, por ordem, o que ficou por confirmar na ligação anterior
+            if self.unacked:
+                registo.info("TCP", "Reenviando %d alertas não confirmados", len(self.unacked))
+                sock.sendall(b"".join(mensagens.frame_message(m) for m in self.unacked.values()))
+                MESSAGES_SENT.inc(len(self.unacked), type="ALERTFLOW")
+        except OSError as e:
+            # Os alertas continuam por confirmar e são reenviados na ligação seguinte
+            registo.error("TCP", "Erro ao preparar a ligação a %s:%s: %s", self.server_address[0], self.server_address[1], e)
+            ALERT_CONNECTIONS.inc(result="error")
+            self._disconnect()
+            return False
+        ALERT_CONNECTIONS.inc(result="ok")
+        registo.info("TCP", "Canal de alertas ligado a %s:%s", self.server_address[0], self.server_address[1])
+        return True
+
+    def _disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+    def _send_queued(self):
+        try:
+            message = self.queue.get(timeout=0.05)
+        except queue.Empty:
+            return
+
+        # Junta tudo o que estiver em fila numa única escrita
+        batch = [message]
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        now = time.monotonic()
+        for message in batch:
+            sequence = mensagens.decode_header(message)[1]
+            self.unacked[sequence] = message
+            self.sent_at[sequence] = now
+        while len(self.unacked) > self.queue.maxsize:
+            sequence, _ = self.unacked.popitem(last=False)
+            self.sent_at.pop(sequence, None)
+            registo.warning("ALERTFLOW - TCP", "Alerta %d descartado sem confirmação.", sequence)
+        self.sock.sendall(b"".join(mensagens.frame_message(m) for m in batch))
+        MESSAGES_SENT.inc(len(batch), type="ALERTFLOW")
+
+    def _read_acks(self):
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return
+        nbytes = self.sock.recv_into(self.buffer)
+        if not nbytes:
+            raise ConnectionError("servidor fechou a ligação")
+
+        for message in self.reader.feed(memoryview(self.buffer)[:nbytes]):
+            decoded = mensagens.decode_message(message)
+            MESSAGES_RECEIVED.inc(type=decoded["type"])
+            if decoded["type"] == "ACK" and self.unacked.pop(decoded["sequence"], None) is not None:
+                ALERT_LATENCY.observe(time.monotonic() - self.sent_at.pop(decoded["sequence"]))
+                registo.debug("ALERTFLOW - TCP", "Alertflow confirmado: sequência %d", decoded["sequence"])
@@ -0,0 +1,219 @@
+import threading
+import time
+from array import array
+
+import psutil
+
+import registo
+from instrumentacao import COLLECTOR_DURATION
+
+SAMPLE_INTERVAL = 1.0  # Segundos entre amostras
+RING_CAPACITY = 300  # Amostras mantidas por série (5 minutos a 1 Hz)
+
+# Colunas de /proc/net/dev usadas (índices após o nome da interface)
+NET_DEV_FIELDS = {"rx_bytes": 0, "rx_packets": 1, "rx_errors": 2, "rx_drop": 3,
+                  "tx_bytes": 8, "tx_packets": 9, "tx_errors": 10, "tx_drop": 11}
+
+
+class RingBuffer:
+    """
+    Buffer circular de tamanho fixo sobre um array (sem alocações por amostra).
+    """
+
+    def __init__(self, capacity=RING_CAPACITY, typecode="d"):
+        self.data = array(typecode, bytes(array(typecode).itemsize * capacity))
+        self.capacity = capacity
+        self.start = 0
+        self.count = 0
+
+    def push(self, value):
+        self.data[(self.start + self.count) % self.capacity] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def last(self, default=None):
+        if not self.count:
+            return default
+        return self.data[(self.start + self.count - 1) % self.capacity]
+
+    def values(self, n=None):
+        """
+        As últimas `n` amostras (todas, por omissão), por ordem cronológica.
+        """
+        n = self.count if n is None else min(n, self.count)
+        first = self.start + self.count - n
+        return [self.data[(first + i) % self.capacity] for i in range(n)]
+
+    def __len__(self):
+        return self.count
+
+
+def read_cpu_times():
+    """
+    Tempos acumulados do CPU (ocupado, total), em jiffies, de /proc/stat.
+    """
+    with open("/proc/stat") as f:
+        fields = [int(value) for value in f.readline().split()[1:]]
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+    total = sum(fields[:8])  # Exclui guest/guest_nice, já contados em user/nice
+    return total - idle, total
+
+
+def read_net_dev():
+    """
+    Contadores de cada interface de /proc/net/dev: {interface: {campo: valor}}.
+    """
+    counters = {}
+    with open("/proc/net/dev") as f:
+        for line in f.readlines()[2:]:
+            name, _, data = line.partition(":")
+            values = data.split()
+            counters[name.strip()] = {field: int(values[i]) for field, i in NET_DEV_FIELDS.items()}
+    return counters
+
+
+class DeviceSampler:
+    """
+    Amostragem em segundo plano das métricas do dispositivo: CPU (por
+    diferença dos tempos acumulados, sem bloquear), RAM e contadores das
+    interfaces de rede. Cada série é guardada num buffer circular, pelo que
+    os ciclos de recolha obtêm a última amostra ou as taxas de imediato.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, capacity=RING_CAPACITY):
+        self.interval = interval
+        self.capacity = capacity
+        self.cpu_ring = RingBuffer(capacity)
+        self.ram_ring = RingBuffer(capacity)
+        self.memory = None  # Última leitura completa da RAM
+        self.interfaces = {}  # interface -> {"counters": {...}, "rx_bps": RingBuffer, ...}
+        self.previous_cpu = None
+        self.previous_time = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.sample()  # Primeira leitura: ponto de partida das diferenças
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        next_sample = time.monotonic()
+        while True:
+            # Prazos absolutos: a duração da leitura não se acumula como deriva
+            next_sample += self.interval
+            if self.stopped.wait(max(0.0, next_sample - time.monotonic())):
+                return
+            try:
+                self.sample()
+            except Exception as e:
+                registo.error("Amostragem", "Erro ao ler métricas do dispositivo: %s", e)
+
+    def sample(self):
+        """
+        Lê uma amostra de todas as séries.
+        """
+        now = time.monotonic()
+        with COLLECTOR_DURATION.time(collector="device"):
+            cpu = self._cpu_percent()
+            memory = psutil.virtual_memory()
+            try:
+                counters = read_net_dev()
+            except OSError:
+                counters = {}
+
+        with self.lock:
+            elapsed = now - self.previous_time if self.previous_time is not None else None
+            if cpu is not None:
+                self.cpu_ring.push(cpu)
+            self.ram_ring.push(memory.percent)
+            self.memory = memory
+            for name, values in counters.items():
+                self._sample_interface(name, values, elapsed)
+            self.previous_time = now
+
+    def _cpu_percent(self):
+        try:
+            busy, total = read_cpu_times()
+        except (OSError, ValueError, IndexError):
+            return psutil.cpu_percent(interval=None)  # Sem /proc: diferença calculada pelo psutil
+        previous, self.previous_cpu = self.previous_cpu, (busy, total)
+        if previous is None or total == previous[1]:
+            return None
+        return 100.0 * (busy - previous[0]) / (total - previous[1])
+
+    def _sample_interface(self, name, counters, elapsed):
+        state = self.interfaces.get(name)
+        if state is None:
+            state = self.interfaces[name] = {"counters": counters,
+                                             **{rate: RingBuffer(self.capacity)
+                                                for rate in ("rx_bps", "tx_bps", "rx_pps", "tx_pps")}}
+            return
+        previous, state["counters"] = state["counters"], counters
+        if not elapsed:
+            return
+        # Contadores que diminuíram (reinício da interface) contam a partir de zero
+        delta = {field: value - previous[field] if value >= previous[field] else value
+                 for field, value in counters.items()}
+        state["rx_bps"].push(8 * delta["rx_bytes"] / elapsed)
+        state["tx_bps"].push(8 * delta["tx_bytes"] / elapsed)
+        state["rx_pps"].push(delta["rx_packets"] / elapsed)
+        state["tx_pps"].push(delta["tx_packets"] / elapsed)
+
+    def cpu(self, samples=1):
+        """
+        Uso do CPU (%): a última amostra ou a média das últimas `samples`.
+        O uso é a diferença entre duas leituras dos tempos do CPU; até haver
+        a segunda (um intervalo após o arranque) devolve None, e a métrica
+        fica de fora do ciclo em vez de ser reportada como 0%.
+        """
+        with self.lock:
+            values = self.cpu_ring.values(samples)
+        return sum(values) / len(values) if values else None
+
+    def ram(self):
+        """
+        Última leitura da RAM, no formato de metricas.get_ram_usage.
+        """
+        with self.lock:
+            memory = self.memory
+        if memory is None:
+            return {"total": 0, "available": 0, "used": 0, "percent": 0}
+        return {
+            "total": memory.total / (1024 ** 3),
+            "available": memory.available / (1024 ** 3),
+            "used": memory.used / (1024 ** 3),
+            "percent": memory.percent
+        }
+
+    def interface_stats(self, names=None):
+        """
+        Taxas mais recentes (bits/s e pacotes/s) e contadores de erros e
+        descartes das interfaces pedidas (todas, por omissão).
+        Interfaces inexistentes são ignoradas.
+        """
+        stats = {}
+        with self.lock:
+            for name in names if names else list(self.interfaces):
+                state = self.interfaces.get(name)
+                if state is None:
+                    continue
+                counters = state["counters"]
+                stats[name] = {
+                    "rx_bps": state["rx_bps"].last(0.0),
+                    "tx_bps": state["tx_bps"].last(0.0),
+                    "rx_pps": state["rx_pps"].last(0.0),
+                    "tx_pps": state["tx_pps"].last(0.0),
+                    "rx_errors": counters["rx_errors"],
+                    "tx_errors": counters["tx_errors"],
+                    "rx_drop": counters["rx_drop"],
+                    "tx_drop": counters["tx_drop"],
+                }
+        return stats
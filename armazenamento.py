@@ -0,0 +1,223 @@
+import bisect
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+# Cabeçalho de cada segmento: magic, capacidade, nº de amostras, flags
+SEGMENT_HEADER = struct.Struct("<4sIII")
+SEGMENT_MAGIC = b"CCTS"
+SEGMENT_HEADER_SIZE = 16
+SEGMENT_SUFFIX = ".seg"
+FLAG_UNSORTED = 0x01  # Houve amostras fora de ordem; a pesquisa é linear
+
+
+class Segment:
+    """
+    Segmento de uma série: ficheiro de tamanho fixo, mapeado em memória,
+    com duas colunas contíguas — timestamps (int64, ms) e valores (float64).
+    Só se acrescentam amostras no fim; o nº de amostras no cabeçalho é
+    atualizado depois de cada escrita.
+    """
+
+    def __init__(self, path, capacity=None, writable=False):
+        self.path = path
+        exists = os.path.exists(path)
+        if not exists:
+            if not writable or capacity is None:
+                raise FileNotFoundError(path)
+            with open(path, "wb") as f:
+                f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, capacity, 0, 0).ljust(SEGMENT_HEADER_SIZE, b"\0"))
+                f.truncate(SEGMENT_HEADER_SIZE + 16 * capacity)
+
+        with open(path, "r+b" if writable else "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+        magic, self.capacity, self.count, self.flags = SEGMENT_HEADER.unpack_from(self.map)
+        if magic != SEGMENT_MAGIC:
+            self.map.close()
+            raise ValueError(f"Segmento inválido: {path}")
+
+        view = memoryview(self.map)
+        values_offset = SEGMENT_HEADER_SIZE + 8 * self.capacity
+        self.timestamps = view[SEGMENT_HEADER_SIZE:values_offset].cast("q")
+        self.values = view[values_offset:values_offset + 8 * self.capacity].cast("d")
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def last_timestamp(self):
+        return self.timestamps[self.count - 1] if self.count else None
+
+    def append(self, timestamp, value):
+        if self.count and timestamp < self.timestamps[self.count - 1]:
+            self.flags |= FLAG_UNSORTED
+        self.timestamps[self.count] = timestamp
+        self.values[self.count] = value
+        self.count += 1
+        SEGMENT_HEADER.pack_into(self.map, 0, SEGMENT_MAGIC, self.capacity, self.count, self.flags)
+
+    def scan(self, start, end, timestamps, values):
+        """
+        Acrescenta a `timestamps`/`values` as amostras com start <= ts < end.
+        """
+        count = self.count
+        if count == 0:
+            return
+        if self.flags & FLAG_UNSORTED:
+            for i in range(count):
+                if start <= self.timestamps[i] < end:
+                    timestamps.append(self.timestamps[i])
+                    values.append(self.values[i])
+            return
+
+        column = self.timestamps[:count]
+        lo = bisect.bisect_left(column, start)
+        hi = bisect.bisect_left(column, end, lo)
+        if lo < hi:
+            # Cópia direta das fatias das colunas, sem converter amostra a amostra
+            timestamps.frombytes(column[lo:hi].tobytes())
+            values.frombytes(self.values[lo:hi].tobytes())
+
+    def close(self):
+        self.timestamps.release()
+        self.values.release()
+        self.map.flush()
+        self.map.close()
+
+
+class Series:
+    """
+    Série temporal de uma métrica de um agente: diretório com segmentos
+    numerados; só o último está aberto para escrita.
+    """
+
+    def __init__(self, directory, capacity):
+        self.directory = directory
+        self.capacity = capacity
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.active = None
+        # Timestamp mínimo e máximo de cada segmento fechado, para saltar segmentos na pesquisa
+        self.bounds = {}
+
+    def path(self, number):
+        return os.path.join(self.directory, f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def append(self, timestamp, value):
+        if self.active is None:
+            if not self.segments:
+                self.segments.append(0)
+            self.active = Segment(self.path(self.segments[-1]), self.capacity, writable=True)
+        if self.active.full():
+            self.active.close()
+            self.segments.append(self.segments[-1] + 1)
+            self.active = Segment(self.path(self.segments[-1]), self.capacity, writable=True)
+        self.active.append(timestamp, value)
+
+    def scan(self, start, end):
+        timestamps, values = array("q"), array("d")
+        for number in self.segments:
+            if self.active is not None and number == self.segments[-1]:
+                self.active.scan(start, end, timestamps, values)
+                continue
+
+            bounds = self.bounds.get(number)
+            if bounds is not None and (bounds[1] < start or bounds[0] >= end):
+                continue
+            segment = Segment(self.path(number))
+            try:
+                if segment.count and not segment.flags & FLAG_UNSORTED:
+                    self.bounds[number] = (segment.timestamps[0], segment.timestamps[segment.count - 1])
+                segment.scan(start, end, timestamps, values)
+            finally:
+                segment.close()
+        return timestamps, values
+
+    def close(self):
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+
+class SeriesStore:
+    """
+    Armazenamento embutido de séries temporais, em colunas por agente e por
+    métrica: <root>/<agent_id>/<métrica>/<segmento>.seg.
+    Os segmentos são append-only e mapeados em memória; as pesquisas por
+    intervalo usam pesquisa binária sobre a coluna de timestamps.
+    Para limitar descritores abertos, só as `max_open` séries usadas mais
+    recentemente mantêm o segmento ativo mapeado.
+    """
+
+    def __init__(self, root="dados", segment_capacity=65536, max_open=1024):
+        self.root = root
+        self.segment_capacity = segment_capacity
+        self.max_open = max_open
+        self.series = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def append(self, agent_id, metric, timestamp, value):
+        """
+        Acrescenta uma amostra (timestamp em ms).
+        """
+        with self.lock:
+            self._series(agent_id, metric).append(int(timestamp), float(value))
+
+    def append_many(self, agent_id, metric, samples):
+        """
+        Acrescenta uma sequência de amostras (timestamp_ms, valor).
+        """
+        with self.lock:
+            series = self._series(agent_id, metric)
+            for timestamp, value in samples:
+                series.append(int(timestamp), float(value))
+
+    def scan(self, agent_id, metric, start=None, end=None):
+        """
+        Devolve (timestamps, valores) como arrays, para start <= ts < end (ms).
+        """
+        start = -2 ** 63 if start is None else int(start)
+        end = 2 ** 63 - 1 if end is None else int(end)
+        with self.lock:
+            if not os.path.isdir(self._directory(agent_id, metric)):
+                return array("q"), array("d")
+            return self._series(agent_id, metric).scan(start, end)
+
+    def agents(self):
+        return sorted(os.listdir(self.root))
+
+    def metrics(self, agent_id):
+        directory = os.path.join(self.root, _safe_name(agent_id))
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def close(self):
+        with self.lock:
+            for series in self.series.values():
+                series.close()
+            self.series.clear()
+
+    def _directory(self, agent_id, metric):
+        return os.path.join(self.root, _safe_name(agent_id), _safe_name(metric))
+
+    def _series(self, agent_id, metric):
+        key = (str(agent_id), metric)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series(self._directory(agent_id, metric), self.segment_capacity)
+            while len(self.series) > self.max_open:
+                _, oldest = self.series.popitem(last=False)
+                oldest.close()
+        else:
+            self.series.move_to_end(key)
+        return series
+
+
+def _safe_name(name):
+    return re.sub(r"[^A-Za-z0-9_.:@-]", "_", str(name))
@@ -0,0 +1,558 @@
+import argparse
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import mensagens
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Relatório enviado pelos agentes simulados (o mesmo conteúdo de um ciclo típico do agente)
+SAMPLE_REPORT = {
+    "task_id": "benchmark",
+    "status": "success",
+    "results": [{
+        "cpu": 12.5,
+        "ram": {"total": 7.6, "available": 5.1, "used": 2.5, "percent": 33.0},
+        "ping": {"packet_loss": 0.0, "min_time": 0.41, "avg_time": 0.52, "max_time": 0.71,
+                 "mdev_time": 0.08, "times": [0.41, 0.48, 0.52, 0.71]},
+    }],
+}
+
+# Séries do servidor incluídas nos resultados (contadores e filas)
+SERVER_METRICS = ("cc_messages_received_total", "cc_messages_sent_total", "cc_duplicates_total",
+                  "cc_retransmissions_total", "cc_send_failures_total", "cc_queue_depth",
+                  "cc_shard_forwarded_total")
+
+
+def percentiles(values, points=PERCENTILES):
+    """
+    Percentis (em milissegundos) de uma lista de latências em segundos.
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {f"p{point:g}": round(1000 * values[min(len(values) - 1, int(len(values) * point / 100))], 3)
+              for point in points}
+    result["max"] = round(1000 * values[-1], 3)
+    return result
+
+
+class Phase:
+    """
+    Contagens e latências de uma fase do teste (registo, relatórios ou alertas).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.sent = 0
+        self.acked = 0
+        self.retransmissions = 0
+        self.dropped = 0
+        self.latencies = []
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        return {
+            "sent": self.sent,
+            "acked": self.acked,
+            "dropped": self.dropped,
+            "retransmissions": self.retransmissions,
+            "elapsed": round(elapsed, 3),
+            "per_second": round(self.acked / elapsed, 1) if elapsed > 0 else 0.0,
+            "ack_latency_ms": percentiles(self.latencies),
+        }
+
+
+class SimulatedAgent:
+    """
+    Agente simulado: um socket UDP próprio (como um agente real) e as
+    mensagens enviadas que aguardam ACK, por número de sequência.
+    """
+
+    def __init__(self, agent_id):
+        self.agent_id = agent_id
+        self.session = mensagens.new_session()
+        self.sequence = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setblocking(False)
+        self.pending = {}  # sequência -> [fase, mensagem, primeiro envio, último envio, tentativas]
+        self.registered = False
+        self.tasks = set()  # Sequências das TASK recebidas (as retransmissões não contam)
+
+    def next_sequence(self):
+        self.sequence = mensagens.next_sequence(self.sequence)
+        return self.sequence
+
+
+class Fleet:
+    """
+    Frota de agentes simulados num único processo, com um ciclo de eventos
+    não bloqueante: envia ATIVA e REPORT por UDP, confirma as TASK do
+    servidor, retransmite o que não for confirmado a tempo e mede a
+    latência de cada ACK.
+    """
+
+    def __init__(self, count, server_address, rto=1.0, max_attempts=3, first_id=1):
+        self.server_address = server_address
+        self.rto = rto
+        self.max_attempts = max_attempts
+        self.agents = [SimulatedAgent(first_id + i) for i in range(count)]
+        self.selector = selectors.DefaultSelector()
+        for agent in self.agents:
+            self.selector.register(agent.sock, selectors.EVENT_READ, agent)
+        self.registration = Phase("registration")
+        self.reports = Phase("reports")
+        self.report_payload = mensagens.encode_report(SAMPLE_REPORT)
+        self.tasks_received = 0
+        self.next_scan = 0.0
+
+    def close(self):
+        for agent in self.agents:
+            self.selector.unregister(agent.sock)
+            agent.sock.close()
+        self.selector.close()
+
+    def register(self, timeout):
+        """
+        Regista todos os agentes de uma vez (o pior caso: a frota a arrancar em simultâneo).
+        """
+        phase = self.registration
+        phase.started = time.monotonic()
+        for agent in self.agents:
+            sequence = agent.next_sequence()
+            self._send(agent, phase, sequence, mensagens.create_ativa_message(sequence, agent.agent_id, agent.session))
+        self._drain(time.monotonic() + timeout)
+        phase.finished = time.monotonic()
+        return sum(agent.registered for agent in self.agents)
+
+    def report(self, duration, interval, burst, grace):
+        """
+        Durante `duration` segundos, cada agente registado envia `burst`
+        REPORT de `interval` em `interval` segundos. Os agentes ficam
+        espalhados uniformemente ao longo do intervalo, como uma frota
+        real que arrancou em instantes diferentes.
+        """
+        agents = [agent for agent in self.agents if agent.registered]
+        phase = self.reports
+        if not agents:
+            return
+        phase.started = time.monotonic()
+        end = phase.started + duration
+        step = interval / len(agents)
+        due = phase.started
+        index = 0
+        while due < end:
+            now = time.monotonic()
+            while due <= now and due < end:
+                agent = agents[index]
+                for _ in range(burst):
+                    sequence = agent.next_sequence()
+                    header = mensagens.pack_header(mensagens.MESSAGE_TYPES["REPORT"], sequence,
+                                                   agent.agent_id, agent.session)
+                    self._send(agent, phase, sequence, header + self.report_payload)
+                index = (index + 1) % len(agents)
+                due += step
+            self._poll(min(due, end) - time.monotonic())
+        self._drain(time.monotonic() + grace)
+        phase.finished = time.monotonic()
+
+    def _send(self, agent, phase, sequence, message):
+        now = time.monotonic()
+        agent.pending[sequence] = [phase, message, now, now, 1]
+        phase.sent += 1
+        self._transmit(agent, message)
+
+    def _transmit(self, agent, message):
+        try:
+            agent.sock.sendto(message, self.server_address)
+        except (BlockingIOError, InterruptedError):
+            pass  # Buffer de envio cheio: conta como perdido e é retransmitido
+        except OSError:
+            pass
+
+    def _drain(self, deadline):
+        """
+        Processa respostas e retransmissões até não haver nada por confirmar ou até `deadline`.
+        """
+        while any(agent.pending for agent in self.agents) and time.monotonic() < deadline:
+            self._poll(min(0.05, deadline - time.monotonic()))
+        for agent in self.agents:
+            for phase, *_ in agent.pending.values():
+                phase.dropped += 1
+            agent.pending.clear()
+
+    def _poll(self, timeout):
+        for key, _ in self.selector.select(max(0.0, timeout)):
+            self._receive(key.data)
+        self._retransmit()
+
+    def _receive(self, agent):
+        while True:
+            try:
+                data, _ = agent.sock.recvfrom(mensagens.RECV_BUFFER)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if len(data) < mensagens.HEADER.size or data[0] != mensagens.PROTOCOL_VERSION:
+                continue
+            _, message_type, sequence, _, _ = mensagens.HEADER.unpack_from(data)
+
+            if message_type == mensagens.MESSAGE_TYPES["ACK"]:
+                entry = agent.pending.pop(sequence, None)
+                if entry is None:
+                    continue  # ACK de uma retransmissão já confirmada
+                phase = entry[0]
+                phase.acked += 1
+                # Como no agente real, só se mede a latência de mensagens não retransmitidas
+                if entry[4] == 1:
+                    phase.latencies.append(time.monotonic() - entry[2])
+                if phase is self.registration:
+                    agent.registered = True
+            elif message_type == mensagens.MESSAGE_TYPES["TASK"]:
+                self._transmit(agent, mensagens.create_ack_message(sequence, agent.agent_id, agent.session))
+                if sequence not in agent.tasks:
+                    agent.tasks.add(sequence)
+                    self.tasks_received += 1
+
+    def _retransmit(self):
+        now = time.monotonic()
+        # Percorrer todos os agentes a cada evento custaria O(agentes) por datagrama
+        if now < self.next_scan:
+            return
+        self.next_scan = now + self.rto / 20
+        for agent in self.agents:
+            if not agent.pending:
+                continue
+            for sequence, entry in list(agent.pending.items()):
+                phase, message, _, last_sent, attempts = entry
+                if now - last_sent < self.rto * 2 ** (attempts - 1):
+                    continue
+                if attempts >= self.max_attempts:
+                    del agent.pending[sequence]
+                    phase.dropped += 1
+                    continue
+                entry[3] = now
+                entry[4] += 1
+                phase.retransmissions += 1
+                self._transmit(agent, message)
+
+
+def alert_phase(server_address, agents, alerts_per_agent, timeout):
+    """
+    Cada agente abre o canal TCP de alertas e escreve de uma vez
+    `alerts_per_agent` ALERTFLOW; mede o estabelecimento das ligações e a
+    latência entre a escrita de cada alerta e o respetivo ACK.
+    """
+    phase = Phase("alerts")
+    selector = selectors.DefaultSelector()
+    connect_times = []
+    connections = []
+    phase.started = time.monotonic()
+
+    for agent in agents:
+        start = time.monotonic()
+        try:
+            sock = socket.create_connection(server_address, timeout=timeout)
+        except OSError:
+            phase.dropped += alerts_per_agent
+            continue
+        connect_times.append(time.monotonic() - start)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+
+        state = {"sock": sock, "reader": mensagens.FrameReader(), "output": bytearray(), "pending": {}}
+        now = time.monotonic()
+        for _ in range(alerts_per_agent):
+            sequence = agent.next_sequence()
+            alert = {"task_id": "benchmark", "metric": "cpu_usage", "value": 97.0, "threshold": 80}
+            state["output"] += mensagens.frame_message(
+                mensagens.create_alert_message(alert, sequence, agent.agent_id, agent.session))
+            state["pending"][sequence] = now
+            phase.sent += 1
+        connections.append(state)
+        selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, state)
+
+    deadline = time.monotonic() + timeout
+    open_connections = len(connections)
+    while open_connections and time.monotonic() < deadline:
+        for key, mask in selector.select(min(0.1, max(0.0, deadline - time.monotonic()))):
+            state = key.data
+            try:
+                if mask & selectors.EVENT_WRITE and state["output"]:
+                    sent = state["sock"].send(state["output"])
+                    del state["output"][:sent]
+                    if not state["output"]:
+                        selector.modify(state["sock"], selectors.EVENT_READ, state)
+                if mask & selectors.EVENT_READ:
+                    data = state["sock"].recv(65536)
+                    if not data:
+                        raise ConnectionError("ligação fechada pelo servidor")
+                    now = time.monotonic()
+                    for message in state["reader"].feed(data):
+                        _, message_type, sequence, _, _ = mensagens.HEADER.unpack_from(message)
+                        sent_at = state["pending"].pop(sequence, None)
+                        if message_type == mensagens.MESSAGE_TYPES["ACK"] and sent_at is not None:
+                            phase.acked += 1
+                            phase.latencies.append(now - sent_at)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except (OSError, ValueError):
+                selector.unregister(state["sock"])
+                state["sock"].close()
+                state["closed"] = True
+                open_connections -= 1
+                continue
+            if not state["pending"]:
+                selector.unregister(state["sock"])
+                state["sock"].close()
+                state["closed"] = True
+                open_connections -= 1
+    phase.finished = time.monotonic()
+
+    for state in connections:
+        phase.dropped += len(state["pending"])
+        if not state.get("closed"):
+            selector.unregister(state["sock"])
+            state["sock"].close()
+    selector.close()
+
+    summary = phase.summary()
+    summary["connections"] = len(connections)
+    summary["connect_ms"] = percentiles(connect_times)
+    return summary
+
+
+def write_tasks(path, count, first_id=1, frequency=10):
+    """
+    Ficheiro de tarefas com uma entrada por agente simulado, para que o
+    servidor lhes envie TASK no registo.
+    """
+    devices = [{
+        "device_id": str(first_id + i),
+        "device_metrics": {"cpu_usage": True, "ram_usage": True, "interface_stats": []},
+        "link_metrics": {},
+        "alertflow_conditions": {"cpu_usage": 95, "ram_usage": 95},
+    } for i in range(count)]
+    with open(path, "w") as f:
+        json.dump({"tasks": [{"task_id": "benchmark", "frequency": frequency, "devices": devices}]}, f)
+
+
+def server_log_path(output):
+    """
+    Registo do servidor arrancado, ao lado do ficheiro dos resultados
+    (o diretório de trabalho é apagado no fim da execução).
+    """
+    return os.path.splitext(output)[0] + ".servidor.log"
+
+
+def start_server(args, workdir):
+    """
+    Arranca server.py num subprocesso, com as tarefas dos agentes simulados
+    e um diretório de dados temporário, e espera que o /metrics responda.
+    """
+    tasks = os.path.join(workdir, "tarefas.json")
+    write_tasks(tasks, args.agents)
+    log_path = server_log_path(args.output)
+    env = dict(os.environ, CC_LOG_LEVEL=args.server_log_level)
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+             "--udp-port", str(args.udp_port), "--tcp-port", str(args.tcp_port), "--tasks", tasks,
+             "--data", os.path.join(workdir, "dados"), "--stats-port", str(args.stats_port),
+             "--workers", str(args.workers)],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+        )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"o servidor terminou ao arrancar (ver {log_path})")
+        if scrape_server(args.host, args.stats_port, args.workers) is not None:
+            time.sleep(0.2)  # O socket UDP abre depois do /metrics
+            return process
+        time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError(f"o servidor não ficou disponível (ver {log_path})")
+
+
+def stop_server(process, timeout=60):
+    """
+    Ctrl+C no servidor e espera pelo fecho (que grava os agregados); se
+    demorar mais do que `timeout`, termina o grupo de processos inteiro,
+    para não deixar workers com as portas ocupadas.
+    """
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def scrape_server(host, port, workers=1):
+    """
+    Séries relevantes do /metrics do servidor: {"nome{etiquetas}": valor},
+    somadas pelos workers (um endpoint cada, em portas consecutivas), ou
+    None se algum ainda não responder.
+    """
+    values = {}
+    for worker_port in range(port, port + workers):
+        try:
+            with urllib.request.urlopen(f"http://{host}:{worker_port}/metrics", timeout=2) as response:
+                text = response.read().decode("utf-8")
+        except OSError:
+            return None
+        for line in text.splitlines():
+            if line.startswith(SERVER_METRICS):
+                name, _, value = line.rpartition(" ")
+                values[name] = values.get(name, 0.0) + float(value)
+    return values
+
+
+def raise_file_limit(needed):
+    """
+    Sobe o limite de descritores abertos (um socket por agente e por canal de alertas).
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard) if hard != resource.RLIM_INFINITY else needed, hard))
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline, results, tolerance):
+    """
+    Compara com uma execução anterior; devolve as regressões acima de `tolerance` (fração).
+    """
+    regressions = []
+    for phase in ("registration", "reports", "alerts"):
+        old, new = baseline.get(phase) or {}, results.get(phase) or {}
+        if old.get("per_second") and new.get("per_second", 0) < old["per_second"] * (1 - tolerance):
+            regressions.append(f"{phase}.per_second: {old['per_second']} -> {new.get('per_second')}")
+        old_p99 = (old.get("ack_latency_ms") or {}).get("p99")
+        new_p99 = (new.get("ack_latency_ms") or {}).get("p99")
+        if old_p99 and new_p99 and new_p99 > old_p99 * (1 + tolerance):
+            regressions.append(f"{phase}.ack_latency_ms.p99: {old_p99} -> {new_p99}")
+        if new.get("dropped", 0) > old.get("dropped", 0):
+            regressions.append(f"{phase}.dropped: {old.get('dropped', 0)} -> {new['dropped']}")
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Simula uma frota de agentes contra o servidor e grava os resultados em JSON.")
+    parser.add_argument("--agents", type=int, default=1000, help="agentes simulados")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos da fase de relatórios")
+    parser.add_argument("--interval", type=float, default=1.0, help="segundos entre rajadas de cada agente")
+    parser.add_argument("--burst", type=int, default=1, help="REPORT por agente em cada rajada")
+    parser.add_argument("--alert-agents", type=int, default=100, help="agentes que abrem o canal de alertas")
+    parser.add_argument("--alerts", type=int, default=10, help="ALERTFLOW enviados por cada um desses agentes")
+    parser.add_argument("--rto", type=float, default=1.0, help="segundos até à primeira retransmissão")
+    parser.add_argument("--timeout", type=float, default=15.0, help="segundos máximos de espera por fase")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--udp-port", type=int, default=33433)
+    parser.add_argument("--tcp-port", type=int, default=44544)
+    parser.add_argument("--stats-port", type=int, default=9290)
+    parser.add_argument("--workers", type=int, default=1, help="workers do servidor (server.py --workers)")
+    parser.add_argument("--external", action="store_true",
+                        help="usar um servidor já em execução em vez de arrancar server.py")
+    parser.add_argument("--server-log-level", default="warning", help="CC_LOG_LEVEL do servidor arrancado")
+    parser.add_argument("--output", default="benchmark.json", help="ficheiro dos resultados")
+    parser.add_argument("--baseline", help="resultados anteriores para comparar (regressões saem com código 1)")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="variação aceite face à baseline")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    raise_file_limit(args.agents + args.alert_agents + 64)
+    # Tarefas e dados do servidor arrancado; apagados no fim, mesmo em caso de erro
+    with tempfile.TemporaryDirectory(prefix="cc-benchmark-") as workdir:
+        results = run(args, workdir)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[Benchmark] Resultados gravados em '{args.output}'")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        load = ("agents", "duration", "interval", "burst", "alert_agents", "alerts")
+        if any(baseline.get("parameters", {}).get(name) != results["parameters"][name] for name in load):
+            print("[Benchmark] Aviso: a baseline foi obtida com outra carga; a comparação pode não ser válida")
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"[Benchmark] Regressão: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+def run(args, workdir):
+    """
+    Executa as três fases (registo, relatórios, alertas) e devolve os resultados.
+    """
+    process = None if args.external else start_server(args, workdir)
+    server_before = scrape_server(args.host, args.stats_port, args.workers) or {}
+    fleet = Fleet(args.agents, (args.host, args.udp_port), rto=args.rto)
+    cpu_start = time.process_time()
+
+    try:
+        registered = fleet.register(args.timeout)
+        print(f"[Benchmark] {registered}/{args.agents} agentes registados "
+              f"({fleet.registration.summary()['per_second']}/s)")
+
+        fleet.report(args.duration, args.interval, args.burst, args.timeout)
+        print(f"[Benchmark] {fleet.reports.acked}/{fleet.reports.sent} relatórios confirmados "
+              f"({fleet.reports.summary()['per_second']}/s)")
+
+        alert_agents = [agent for agent in fleet.agents if agent.registered][:args.alert_agents]
+        alerts = alert_phase((args.host, args.tcp_port), alert_agents, args.alerts, args.timeout)
+        print(f"[Benchmark] {alerts['acked']}/{alerts['sent']} alertas confirmados ({alerts['per_second']}/s)")
+
+        server_after = scrape_server(args.host, args.stats_port, args.workers) or {}
+    finally:
+        fleet.close()
+        if process is not None:
+            stop_server(process)
+
+    registration = fleet.registration.summary()
+    registration["registered"] = registered
+    registration["tasks_received"] = fleet.tasks_received
+    results = {
+        "version": version(),
+        "timestamp": time.time(),
+        "parameters": vars(args),
+        "registration": registration,
+        "reports": fleet.reports.summary(),
+        "alerts": alerts,
+        # Diferença dos contadores do servidor durante o teste (as filas são o valor final)
+        "server": {name: value - (0 if name.startswith("cc_queue_depth") else server_before.get(name, 0))
+                   for name, value in server_after.items()},
+        "client_cpu_seconds": round(time.process_time() - cpu_start, 3),
+        "server_log": None if args.external else server_log_path(args.output),
+    }
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+
+import registo
+from parserJSON import carregar_configuracao
+
+RELOAD_INTERVAL = 2.0  # Segundos entre verificações do ficheiro de tarefas
+
+
+class TaskCatalogue:
+    """
+    Catálogo das tarefas do ficheiro JSON, indexado por device_id e, dentro
+    de cada dispositivo, por task_id (um dispositivo pode ter várias tarefas).
+    O ficheiro é vigiado; quando muda, é recarregado e só as tarefas que
+    mudaram são comunicadas, por `on_change({device_id: {task_id, ...}})`.
+    """
+
+    def __init__(self, path, on_change=None, interval=RELOAD_INTERVAL):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.index = {}  # device_id -> {task_id: entrada do dispositivo}
+        self.signature = None  # (mtime, tamanho) do ficheiro carregado
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def load(self):
+        """
+        (Re)carrega o ficheiro e devolve as tarefas alteradas, acrescentadas
+        ou removidas: {device_id: {task_id, ...}}. Se o ficheiro for
+        inválido, mantém o catálogo atual.
+        """
+        try:
+            signature = self._stat()
+        except OSError as e:
+            registo.error("Catálogo", "Não foi possível ler '%s': %s", self.path, e)
+            return {}
+        devices = carregar_configuracao(self.path)
+        if devices is None:
+            return {}
+
+        index = {}
+        for device in devices:
+            index.setdefault(device["device_id"], {})[device.get("task_id")] = device
+
+        with self.lock:
+            changed = _diff(self.index, index)
+            self.index = index
+            self.signature = signature
+        return changed
+
+    def tasks(self, device_id):
+        """
+        Tarefas do dispositivo: {task_id: entrada}.
+        """
+        with self.lock:
+            return dict(self.index.get(str(device_id), {}))
+
+    def task(self, device_id, task_id):
+        with self.lock:
+            return self.index.get(str(device_id), {}).get(task_id)
+
+    def devices(self):
+        """
+        Todas as entradas de dispositivo (de todas as tarefas).
+        """
+        with self.lock:
+            return [device for tasks in self.index.values() for device in tasks.values()]
+
+    def watch(self):
+        """
+        Inicia a verificação periódica do ficheiro numa thread própria.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _watch(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if self._stat() == self.signature:
+                    continue
+            except OSError:
+                continue
+            changed = self.load()
+            if changed:
+                registo.info("Catálogo", "Tarefas alteradas: %d em %d dispositivos",
+                             sum(len(t) for t in changed.values()), len(changed))
+                if self.on_change:
+                    try:
+                        self.on_change(changed)
+                    except Exception as e:
+                        registo.error("Catálogo", "Erro ao aplicar alterações: %s", e)
+
+
+def _diff(old, new):
+    changed = {}
+    for device_id in old.keys() | new.keys():
+        old_tasks, new_tasks = old.get(device_id, {}), new.get(device_id, {})
+        for task_id in old_tasks.keys() | new_tasks.keys():
+            if _canonical(old_tasks.get(task_id)) != _canonical(new_tasks.get(task_id)):
+                changed.setdefault(device_id, set()).add(task_id)
+    return changed
+
+
+def _canonical(entry):
+    return None if entry is None else json.dumps(entry, sort_keys=True)
@@ -0,0 +1,341 @@
+import threading
+import time
+from collections import deque
+
+import mensagens
+import registo
+from instrumentacao import ACK_RTT, MESSAGES_SENT, QUEUE_DROPS, RETRANSMISSIONS, SEND_FAILURES
+
+
+class TimerWheel:
+    """
+    Roda de temporizadores (hashed timing wheel).
+    Cada entrada fica num slot calculado a partir do seu prazo; avançar a roda
+    custa O(slots percorridos + entradas expiradas), independentemente do
+    número de temporizadores ativos.
+    """
+
+    def __init__(self, tick=0.05, slots=512):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current_tick = int(time.monotonic() / tick)
+        self.count = 0
+
+    def schedule(self, delay, key, now=None):
+        """
+        Agenda `key` para expirar daqui a `delay` segundos.
+        """
+        now = time.monotonic() if now is None else now
+        deadline = max(int((now + delay) / self.tick), self.current_tick + 1)
+        self.slots[deadline % len(self.slots)].append((deadline, key))
+        self.count += 1
+
+    def advance(self, now=None):
+        """
+        Avança a roda até `now` e devolve as chaves cujo prazo expirou.
+        """
+        now = time.monotonic() if now is None else now
+        target = int(now / self.tick)
+        expired = []
+        if self.count == 0:
+            self.current_tick = target
+            return expired
+
+        # Nunca é preciso percorrer mais do que uma volta completa
+        start = max(self.current_tick + 1, target - len(self.slots) + 1)
+        for tick in range(start, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            remaining = []
+            for deadline, key in slot:
+                if deadline <= target:
+                    expired.append(key)
+                else:
+                    remaining.append((deadline, key))
+            self.count -= len(slot) - len(remaining)
+            self.slots[tick % len(self.slots)] = remaining
+        self.current_tick = max(self.current_tick, target)
+        return expired
+
+    def __len__(self):
+        return self.count
+
+
+class RttEstimator:
+    """
+    Estimativa do RTT de um peer ao estilo do RFC 6298 (SRTT/RTTVAR),
+    com backoff exponencial do RTO em caso de timeout.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial_rto=1.0, min_rto=0.02, max_rto=30.0):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.rto = initial_rto
+
+    def sample(self, rtt):
+        """
+        Atualiza SRTT, RTTVAR e RTO com uma nova medição de RTT.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(max(self.srtt + self.K * self.rttvar, self.min_rto), self.max_rto)
+
+    def backoff(self):
+        """
+        Duplica o RTO após um timeout (até max_rto).
+        """
+        self.rto = min(self.rto * 2, self.max_rto)
+        return self.rto
+
+
+class PeerState:
+    """
+    Estado de envio de um peer: estimador de RTT, mensagens em voo e
+    mensagens à espera de espaço na janela.
+    """
+
+    def __init__(self, initial_rto):
+        self.rtt = RttEstimator(initial_rto)
+        self.in_flight = 0
+        self.queue = deque()
+
+
+class PendingMessage:
+    """
+    Mensagem enviada que ainda aguarda ACK.
+    """
+
+    def __init__(self, key, message, destination, callback=None):
+        self.key = key
+        self.message = message
+        self.destination = destination
+        self.callback = callback
+        self.attempts = 0
+        self.sent_at = None
+        self.rto = None
+        self.acked = False
+        self.done = threading.Event()
+
+
+class ReliableSender:
+    """
+    Camada de fiabilidade sobre UDP.
+    Mantém uma tabela de mensagens por confirmar indexada por (peer, sequence);
+    os ACKs são entregues por `handle_ack` a partir do ciclo de receção e as
+    retransmissões são disparadas pela roda de temporizadores em `poll`.
+    Nenhuma operação bloqueia à espera da rede.
+
+    O timeout de cada peer adapta-se ao RTT medido (com backoff exponencial)
+    e cada peer tem no máximo `window` mensagens por confirmar; as restantes
+    ficam em fila até haver espaço na janela. A fila de cada peer guarda no
+    máximo `max_queue` mensagens: acima disso a mais antiga é abandonada
+    (callback com False), como se tivesse esgotado as tentativas.
+    """
+
+    def __init__(self, sock, max_attempts=6, window=8, initial_rto=1.0, tick=0.01, max_queue=1024):
+        self.sock = sock
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_queue = max_queue
+        self.initial_rto = initial_rto
+        self.wheel = TimerWheel(tick)
+        self.pending = {}
+        self.peers = {}
+        self.lock = threading.Lock()
+
+    def send(self, message, destination, sequence=None, callback=None):
+        """
+        Envia `message` (ou coloca-a em fila se a janela do peer estiver cheia)
+        e regista-a como pendente.
+        `callback(acked)` é chamado quando chega o ACK ou se esgotam as tentativas.
+        """
+        if sequence is None:
+            # Só o cabeçalho: o corpo (por exemplo uma TASK em cache) não é descodificado
+            header = mensagens.decode_header(message)
+            if header is None:
+                raise ValueError("Mensagem sem cabeçalho válido")
+            sequence = header[1]
+        key = (destination, sequence)
+        entry = PendingMessage(key, message, destination, callback)
+        dropped = None
+        with self.lock:
+            peer = self._peer(destination)
+            if peer.in_flight < self.window:
+                self._start(peer, entry)
+            else:
+                if len(peer.queue) >= self.max_queue:
+                    dropped = peer.queue.popleft()
+                peer.queue.append(entry)
+        if dropped is not None:
+            QUEUE_DROPS.inc()
+            registo.warning("UDP", "Fila de envio para %s cheia; mensagem mais antiga descartada.", destination)
+            self._finish(dropped, False)
+        return entry
+
+    def handle_ack(self, peer, sequence):
+        """
+        Marca como confirmada a mensagem (peer, sequence). Devolve True se
+        o ACK correspondia a uma mensagem pendente.
+        """
+        with self.lock:
+            entry = self.pending.pop((peer, sequence), None)
+            if entry is None:
+                return False
+            state = self.peers[entry.destination]
+            # Algoritmo de Karn: só mensagens não retransmitidas dão amostras de RTT
+            if entry.attempts == 1:
+                rtt = time.monotonic() - entry.sent_at
+                state.rtt.sample(rtt)
+                ACK_RTT.observe(rtt)
+            self._release(state)
+        self._finish(entry, True)
+        return True
+
+    def poll(self, now=None):
+        """
+        Retransmite as mensagens cujo temporizador expirou e descarta as que
+        esgotaram as tentativas.
+        """
+        failed = []
+        with self.lock:
+            for key, entry, attempt in self.wheel.advance(now):
+                if self.pending.get(key) is not entry or entry.attempts != attempt:
+                    continue  # Já confirmada ou reenviada; temporizador obsoleto
+                state = self.peers[entry.destination]
+                if entry.attempts >= self.max_attempts:
+                    del self.pending[key]
+                    failed.append(entry)
+                    self._release(state)
+                    continue
+                registo.warning("UDP", "Timeout aguardando ACK de %s (Tentativa %d).", entry.destination, entry.attempts)
+                RETRANSMISSIONS.inc()
+                # Um backoff por evento de timeout: as restantes mensagens da mesma
+                # janela foram enviadas com um RTO que já foi duplicado
+                if entry.rto >= state.rtt.rto:
+                    state.rtt.backoff()
+                entry.rto = min(entry.rto * 2, state.rtt.max_rto)
+                self._transmit(entry, now)
+
+        for entry in failed:
+            SEND_FAILURES.inc()
+            registo.warning("UDP", "Número máximo de tentativas atingido para %s.", entry.destination)
+            self._finish(entry, False)
+
+    def next_timeout(self):
+        """
+        Tempo máximo que o ciclo de receção deve bloquear antes de voltar a
+        chamar `poll`; None quando não há mensagens pendentes.
+        """
+        return self.wheel.tick if self.pending else None
+
+    def rto(self, destination):
+        """
+        RTO atual estimado para o peer.
+        """
+        with self.lock:
+            return self._peer(destination).rtt.rto
+
+    def _peer(self, destination):
+        state = self.peers.get(destination)
+        if state is None:
+            state = self.peers[destination] = PeerState(self.initial_rto)
+        return state
+
+    def _start(self, state, entry):
+        previous = self.pending.get(entry.key)
+        if previous is not None:
+            # Mesma (peer, sequence) reenviada: a mensagem antiga deixa de contar
+            state.in_flight -= 1
+            previous.done.set()
+        self.pending[entry.key] = entry
+        state.in_flight += 1
+        entry.rto = state.rtt.rto
+        self._transmit(entry)
+
+    def _release(self, state):
+        state.in_flight -= 1
+        while state.queue and state.in_flight < self.window:
+            self._start(state, state.queue.popleft())
+
+    def _transmit(self, entry, now=None):
+        entry.attempts += 1
+        entry.sent_at = time.monotonic()
+        try:
+            self.sock.sendto(entry.message, entry.destination)
+            MESSAGES_SENT.inc(type=mensagens.message_type_name(entry.message))
+        except OSError as e:
+            registo.error("UDP", "Erro ao enviar para %s: %s", entry.destination, e)
+        self.wheel.schedule(entry.rto, (entry.key, entry, entry.attempts), now)
+
+    def _finish(self, entry, acked):
+        entry.acked = acked
+        entry.done.set()
+        if entry.callback:
+            try:
+                entry.callback(acked)
+            except Exception as e:
+                registo.error("UDP", "Erro no callback de %s: %s", entry.destination, e)
+
+
+class DuplicateFilter:
+    """
+    Deteção de duplicados por (agent_id, session): guarda a maior sequência
+    vista e um bitmap das `window` sequências anteriores, como nas janelas
+    anti-replay. Uma nova sessão do agente começa com uma janela limpa.
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.state = {}
+        self.lock = threading.Lock()
+
+    def seen(self, agent_id, session, sequence):
+        """
+        Regista `sequence` e devolve True se já tinha sido recebida.
+        """
+        with self.lock:
+            key = (agent_id, session)
+            state = self.state.get(key)
+            if state is None:
+                self.state[key] = [sequence, 1]
+                return False
+
+            highest, bitmap = state
+            # Diferença com wrap-around em 32 bits
+            delta = (sequence - highest) % mensagens.SEQUENCE_MODULO
+            if 0 < delta < mensagens.SEQUENCE_MODULO // 2:
+                # Um salto maior do que a janela descarta o bitmap inteiro, sem
+                # deslocamentos gigantes (delta pode chegar a 2^31)
+                if delta >= self.window:
+                    bitmap = 1
+                else:
+                    bitmap = ((bitmap << delta) | 1) & ((1 << self.window) - 1)
+                state[0], state[1] = sequence, bitmap
+                return False
+
+            offset = (highest - sequence) % mensagens.SEQUENCE_MODULO
+            if offset >= self.window:
+                return True  # Demasiado antiga para distinguir; tratada como duplicado
+            if bitmap & (1 << offset):
+                return True
+            state[1] = bitmap | (1 << offset)
+            return False
+
+    def forget(self, agent_id, session=None):
+        """
+        Descarta o estado de um agente (todas as sessões ou apenas uma).
+        """
+        with self.lock:
+            for key in [k for k in self.state if k[0] == agent_id and session in (None, k[1])]:
+                del self.state[key]
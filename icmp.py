@@ -0,0 +1,184 @@
+import itertools
+import math
+import os
+import selectors
+import socket
+import struct
+import time
+
+import registo
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_HEADER = struct.Struct("!BBHHH")  # tipo, código, checksum, identificador, sequência
+PAYLOAD = bytes(range(56))  # 56 bytes de dados, como o comando ping
+RECV_BUFFER = 2048
+SOCKET_BUFFER = 1 << 20  # Buffer de receção do socket, para rajadas de respostas de muitos destinos
+
+# Identificadores dos sockets raw; nos sockets datagram o kernel impõe o seu
+IDENTIFIERS = itertools.count(os.getpid())
+
+
+def open_socket():
+    """
+    Abre um socket ICMP. Usa um socket datagram (ping sem privilégios,
+    net.ipv4.ping_group_range) quando disponível e, senão, um socket raw.
+    Devolve (socket, raw). Levanta OSError se nenhum for permitido.
+    """
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except OSError:
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+
+
+def checksum(data):
+    """
+    Checksum da Internet (RFC 1071).
+    """
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo(identifier, sequence, payload=PAYLOAD):
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum(header + payload), identifier, sequence) + payload
+
+
+def parse_reply(packet, raw):
+    """
+    Devolve (identificador, sequência) de um echo reply, ou None.
+    Nos sockets raw o pacote inclui o cabeçalho IP.
+    """
+    if raw:
+        if not packet:
+            return None
+        packet = packet[(packet[0] & 0x0F) * 4:]
+    if len(packet) < ICMP_HEADER.size:
+        return None
+    kind, _, _, identifier, sequence = ICMP_HEADER.unpack_from(packet)
+    if kind != ICMP_ECHO_REPLY:
+        return None
+    return identifier, sequence
+
+
+def summarize(sent, times):
+    """
+    Estatísticas no formato de metricas.ping_and_store (tempos em ms).
+    Devolve None se não houve nenhuma resposta, tal como o ping falha.
+    """
+    if not times:
+        return None
+    average = sum(times) / len(times)
+    variance = max(0.0, sum(t * t for t in times) / len(times) - average * average)
+    return {
+        "times": [round(t, 3) for t in times],
+        "packet_loss": 100.0 * (sent - len(times)) / sent,
+        "min_time": round(min(times), 3),
+        "avg_time": round(average, 3),
+        "max_time": round(max(times), 3),
+        "mdev_time": round(math.sqrt(variance), 3),
+    }
+
+
+def _resolve(destination):
+    try:
+        return socket.gethostbyname(destination)
+    except OSError as e:
+        registo.warning("ICMP", "Não foi possível resolver %s: %s", destination, e)
+        return None
+
+
+def probe(destinations, count=4, interval=1.0, timeout=1.0):
+    """
+    Envia `count` echo requests a cada destino, em rondas de `interval`
+    segundos, todos pelo mesmo socket; as respostas são associadas ao pedido
+    pela sequência (e pelo identificador, nos sockets raw).
+    Espera até `timeout` segundos após a última ronda pelas respostas em falta.
+    Devolve {destino: estatísticas ou None}.
+    Levanta OSError se não for possível abrir um socket ICMP.
+    """
+    addresses = {destination: _resolve(destination) for destination in destinations}
+    times = {destination: [] for destination in destinations}
+    sent = dict.fromkeys(destinations, 0)
+
+    sock, raw = open_socket()
+    sock.setblocking(False)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+    except OSError:
+        pass
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    identifier = next(IDENTIFIERS) & 0xFFFF
+    sequences = itertools.count()
+    pending = {}  # sequência -> (destino, ip, instante de envio)
+
+    try:
+        rounds = 0
+        next_round = time.monotonic()
+        deadline = None
+        while True:
+            now = time.monotonic()
+            if rounds < count and now >= next_round:
+                for destination, address in addresses.items():
+                    if address is None:
+                        continue
+                    sequence = next(sequences) & 0xFFFF
+                    sent[destination] += 1
+                    pending[sequence] = (destination, address, time.monotonic())
+                    try:
+                        sock.sendto(build_echo(identifier, sequence), (address, 0))
+                    except OSError as e:
+                        # Conta como pacote perdido (ex.: buffer de envio cheio)
+                        registo.error("ICMP", "Erro ao enviar para %s: %s", destination, e)
+                rounds += 1
+                next_round += interval
+                if rounds == count:
+                    deadline = time.monotonic() + timeout
+
+            if deadline is not None and (not pending or time.monotonic() >= deadline):
+                break
+
+            wake = next_round if rounds < count else deadline
+            if selector.select(max(0.0, wake - time.monotonic())):
+                _drain(sock, raw, identifier, pending, times)
+    finally:
+        selector.close()
+        sock.close()
+
+    return {destination: summarize(sent[destination], times[destination]) if sent[destination] else None
+            for destination in destinations}
+
+
+def _drain(sock, raw, identifier, pending, times):
+    buffer = bytearray(RECV_BUFFER)
+    view = memoryview(buffer)
+    while True:
+        try:
+            nbytes, (address, _) = sock.recvfrom_into(buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        received = time.monotonic()
+        reply = parse_reply(view[:nbytes], raw)
+        if reply is None:
+            continue
+        reply_identifier, sequence = reply
+        # Nos sockets datagram o kernel já entrega só as respostas deste socket
+        if raw and reply_identifier != identifier:
+            continue
+        request = pending.get(sequence)
+        if request is None or request[1] != address:
+            continue
+        del pending[sequence]
+        times[request[0]].append((received - request[2]) * 1000)
+
+
+def ping(destination, count=4, interval=1.0, timeout=1.0):
+    """
+    Estatísticas de ping de um único destino (None se não houve respostas).
+    """
+    return probe([destination], count, interval, timeout)[destination]
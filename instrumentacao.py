@@ -0,0 +1,253 @@
+import bisect
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import registo
+
+# Limites (em segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    """
+    Métrica com etiquetas; cada combinação de valores das etiquetas é uma série.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        if not self.labelnames:
+            self.series[()] = 0  # Contador sem etiquetas é exposto desde o início
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.series.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [f"{self.name}{self._labels(key)} {_number(value)}" for key, value in self.series.items()]
+
+
+class Gauge(Metric):
+    """
+    Valor instantâneo; definido com `set` ou lido de uma função no momento
+    da recolha (`track`), por exemplo o tamanho de uma fila.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.callbacks = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[self._key(labels)] = value
+
+    def track(self, function, **labels):
+        with self.lock:
+            self.callbacks[self._key(labels)] = function
+
+    def _samples(self):
+        values = dict(self.series)
+        for key, function in self.callbacks.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f"{self.name}{self._labels(key)} {_number(value)}" for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Contagens por intervalo (o último é +Inf), soma e nº de observações
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        """
+        Context manager que observa a duração do bloco.
+        """
+        return _Timer(self, labels)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else _number(bound)
+                lines.append(f"{self.name}_bucket{self._labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def timed(histogram, **labels):
+    """
+    Decorador que observa a duração de cada chamada da função.
+    """
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorator
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, help, labelnames=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        Todas as métricas no formato de texto do Prometheus.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Métricas do protocolo, partilhadas pelo servidor e pelo agente
+MESSAGES_RECEIVED = REGISTRY.counter("cc_messages_received_total", "Mensagens recebidas, por tipo", ("type",))
+MESSAGES_SENT = REGISTRY.counter("cc_messages_sent_total", "Mensagens enviadas (incluindo retransmissões), por tipo", ("type",))
+ACK_RTT = REGISTRY.histogram("cc_ack_rtt_seconds", "Tempo até ao ACK das mensagens UDP não retransmitidas")
+RETRANSMISSIONS = REGISTRY.counter("cc_retransmissions_total", "Retransmissões por timeout do ACK")
+SEND_FAILURES = REGISTRY.counter("cc_send_failures_total", "Mensagens abandonadas após esgotar as tentativas")
+QUEUE_DROPS = REGISTRY.counter("cc_send_queue_dropped_total", "Mensagens descartadas por a fila de envio do peer estar cheia")
+DUPLICATES = REGISTRY.counter("cc_duplicates_total", "Mensagens recebidas em duplicado, por tipo", ("type",))
+PENDING = REGISTRY.gauge("cc_queue_depth", "Profundidade das filas internas", ("queue",))
+ALERT_CONNECT = REGISTRY.histogram("cc_alert_connect_seconds", "Tempo de estabelecimento do canal TCP de alertas")
+ALERT_LATENCY = REGISTRY.histogram("cc_alert_ack_seconds", "Tempo entre a escrita de um ALERTFLOW e o respetivo ACK")
+ALERT_CONNECTIONS = REGISTRY.counter("cc_alert_connections_total", "Ligações do canal de alertas, por resultado", ("result",))
+FORWARDED = REGISTRY.counter("cc_shard_forwarded_total", "Datagramas reencaminhados para o worker do agente, por resultado",
+                            ("result",))
+COLLECTOR_DURATION = REGISTRY.histogram("cc_collector_duration_seconds", "Duração de cada coletor de métricas",
+                                        ("collector",), buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 20, 30, 60))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sem uma linha no terminal por cada recolha
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """
+    Expõe as métricas em http://host:port/metrics numa thread própria.
+    Devolve o servidor, ou None se a porta não estiver disponível.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        registo.error("Métricas", "Não foi possível abrir o endpoint em %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    registo.info("Métricas", "Disponíveis em http://%s:%s/metrics", host, port)
+    return server
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,140 @@
+import subprocess
+import threading
+
+import registo
+
+DEFAULT_PORTS = range(5201, 5209)  # Uma instância de iperf3 -s por porta
+SLOT_MARGIN = 2  # Segundos de folga entre testes consecutivos na mesma porta
+
+
+class Slot:
+    """
+    Janela atribuída a um agente para o teste de largura de banda: a porta
+    do iperf3 e o desfasamento (em segundos, relativo ao relógio de parede
+    módulo o período) em que o teste deve começar.
+    """
+
+    def __init__(self, port, offset, length, period):
+        self.port = port
+        self.offset = offset
+        self.length = length
+        self.period = period
+
+    def overlaps(self, offset, length, period):
+        if period != self.period:
+            return True  # Períodos diferentes acabam sempre por coincidir
+        # Intervalos circulares [offset, offset + length) módulo o período
+        start = (offset - self.offset) % period
+        return start < self.length or start + length > period
+
+
+class IperfPool:
+    """
+    Conjunto de servidores iperf3, um por porta, e distribuição dos testes
+    dos agentes por essas portas. Cada instância do iperf3 só serve um
+    cliente de cada vez; os agentes que partilham uma porta recebem
+    desfasamentos diferentes para que os testes não se sobreponham.
+    """
+
+    def __init__(self, ports=DEFAULT_PORTS, margin=SLOT_MARGIN):
+        self.ports = list(ports)
+        self.margin = margin
+        self.processes = {}  # porta -> Popen
+        self.slots = {}  # (device_id, task_id) -> Slot
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Arranca (ou volta a arrancar) as instâncias do iperf3 que não estão a
+        correr. Devolve True se todas as portas ficarem com um servidor.
+        """
+        with self.lock:
+            running = [port for port in self.ports if self._ensure(port)]
+        if running:
+            registo.info("Servidor", "Servidores iperf iniciados em %d de %d portas (%d-%d).",
+                         len(running), len(self.ports), self.ports[0], self.ports[-1])
+        return len(running) == len(self.ports)
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        self.processes.clear()
+
+    def assign(self, agent_id, duration, period):
+        """
+        Reserva (ou devolve a já reservada) uma janela de teste para o agente.
+        """
+        length = duration + self.margin
+        with self.lock:
+            slot = self.slots.get(agent_id)
+            if slot is not None and slot.length == length and slot.period == period and self._ensure(slot.port):
+                return slot
+            self.slots.pop(agent_id, None)
+
+            # Só portas com um iperf3 a correr (reiniciado se tinha terminado)
+            ports = [port for port in self.ports if self._ensure(port)]
+            if not ports:
+                registo.error("Servidor", "Nenhum servidor iperf disponível; o teste do agente vai falhar.")
+                ports = self.ports
+            slot = self._first_fit(length, period, ports)
+            self.slots[agent_id] = slot
+            return slot
+
+    def release(self, agent_id):
+        with self.lock:
+            self.slots.pop(agent_id, None)
+
+    def _ensure(self, port):
+        """
+        Garante que há um iperf3 a servir a porta, arrancando-o se ainda não
+        existe ou se terminou. Devolve False se não for possível.
+        """
+        process = self.processes.get(port)
+        if process is not None:
+            if process.poll() is None:
+                return True
+            registo.warning("Servidor", "Servidor iperf na porta %d terminou (código %s); a reiniciar.",
+                            port, process.returncode)
+        try:
+            self.processes[port] = subprocess.Popen(
+                ["iperf3", "-s", "-p", str(port)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError as e:
+            self.processes.pop(port, None)
+            registo.error("Servidor", "Não foi possível iniciar o servidor iperf na porta %d: %s", port, e)
+            return False
+        return True
+
+    def _first_fit(self, length, period, ports):
+        by_port = {port: [] for port in ports}
+        for slot in self.slots.values():
+            if slot.port in by_port:
+                by_port[slot.port].append(slot)
+
+        # Primeiro desfasamento livre em alguma porta, por ordem de porta
+        for port, taken in by_port.items():
+            for offset in sorted({0} | {(s.offset + s.length) % period for s in taken if s.period == period}):
+                if offset + length <= period and not any(s.overlaps(offset, length, period) for s in taken):
+                    return Slot(port, offset, length, period)
+
+        # Sem janelas livres: partilha a porta menos ocupada
+        port = min(by_port, key=lambda p: sum(s.length / s.period for s in by_port[p]))
+        registo.warning("Servidor", "Sem janelas iperf livres; testes sobrepostos na porta %d.", port)
+        return Slot(port, 0, length, period)
+
+    def link_metrics(self, agent_id, link_metrics, default_period):
+        """
+        Cópia das link_metrics do agente com a porta e o desfasamento do
+        teste de largura de banda preenchidos a partir da janela reservada.
+        """
+        if "bandwidth" not in link_metrics:
+            self.release(agent_id)
+            return link_metrics
+        iperf = dict(link_metrics["bandwidth"]["iperf"])
+        slot = self.assign(agent_id, iperf.get("duration") or 10, iperf.get("frequency") or default_period)
+        iperf["port"] = slot.port
+        iperf["offset"] = slot.offset
+        return {**link_metrics, "bandwidth": {**link_metrics["bandwidth"], "iperf": iperf}}
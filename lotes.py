@@ -0,0 +1,79 @@
+import threading
+import time
+
+import mensagens
+
+
+class ReportBatcher:
+    """
+    Acumula vários ciclos de recolha num único bloco REPORT_BATCH.
+    O bloco é fechado quando a amostra seguinte o faria exceder `max_bytes`
+    (um datagrama) ou quando a amostra mais antiga tem mais de `max_age` segundos.
+    Pode ser partilhado pelas threads do agendador.
+    """
+
+    # Margem por amostra nova: dois varints de até 10 bytes cada
+    SAMPLE_MARGIN = 20
+
+    def __init__(self, max_bytes=mensagens.MAX_DATAGRAM - mensagens.HEADER.size, max_age=60.0):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.builder = None
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def add(self, metrics, timestamp=None):
+        """
+        Acrescenta um ciclo ({métrica: valor}). Devolve a lista de blocos
+        fechados (ReportBatchBuilder) prontos a enviar.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        timestamp_ms = int(timestamp * 1000)
+        ready = []
+        with self.lock:
+            self._add(metrics, timestamp_ms, ready)
+        return ready
+
+    def _add(self, metrics, timestamp_ms, ready):
+        if self.builder is not None:
+            # Estimativa do pior caso, incluindo séries novas
+            extra = sum(self.SAMPLE_MARGIN + (0 if name in self.builder.series else
+                                              mensagens.SERIES_HEADER.size + len(name.encode("utf-8")))
+                        for name in metrics)
+            if self.builder.size() + extra > self.max_bytes:
+                ready.append(self._close())
+
+        if metrics:
+            if self.builder is None:
+                self.builder = mensagens.ReportBatchBuilder(timestamp_ms)
+                self.opened_at = time.monotonic()
+            for name, value in metrics.items():
+                self.builder.add(name, timestamp_ms, value)
+
+        ready.extend(self._poll(time.monotonic()))
+
+    def poll(self, now=None):
+        """
+        Fecha o bloco atual se já excedeu a idade máxima.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return self._poll(now)
+
+    def _poll(self, now):
+        if self.builder is not None and now - self.opened_at >= self.max_age:
+            return [self._close()]
+        return []
+
+    def flush(self):
+        """
+        Fecha o bloco atual, independentemente do tamanho e da idade.
+        """
+        with self.lock:
+            return [self._close()] if self.builder is not None else []
+
+    def _close(self):
+        builder = self.builder
+        self.builder = None
+        self.opened_at = None
+        return builder
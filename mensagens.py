@@ -1,90 +1,224 @@
+import math
+import os
 import struct
+import time
 import json  # Importação necessária para serialização JSON
 
+import registo
+
+# Versão do formato das mensagens; mensagens de outra versão são rejeitadas
+PROTOCOL_VERSION = 2
+
+# Cabeçalho comum: versão, tipo, sequência (32 bits), agent_id (32 bits), sessão (32 bits)
+HEADER = struct.Struct("!BBIII")
+SEQUENCE_MODULO = 2 ** 32
+
 # Define os tipos de mensagem
 MESSAGE_TYPES = {
     "ATIVA": 0x01,  # Registro
     "ACK": 0x02,    # Confirmação
     "TASK": 0x03,   # Tarefas e métricas
     "REPORT": 0x04, # Relatórios
-    "ALERTFLOW": 0x05 # Alertas
+    "ALERTFLOW": 0x05, # Alertas
+    "FRAGMENT": 0x06, # Fragmento de uma mensagem maior que um datagrama
+    "REPORT_BATCH": 0x07  # Séries temporais de vários ciclos de recolha
 }
+MESSAGE_TYPE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+
+# Tamanho máximo de um datagrama enviado (cabe numa MTU Ethernet com cabeçalhos IP/UDP)
+MAX_DATAGRAM = 1400
+# Tamanho do buffer de receção (maior datagrama UDP possível)
+RECV_BUFFER = 65535
+
+# Fragmentos: id da mensagem original, índice do fragmento, nº total de fragmentos
+FRAGMENT_HEADER = struct.Struct("!IHH")
+FRAGMENT_PAYLOAD = MAX_DATAGRAM - HEADER.size - FRAGMENT_HEADER.size
+MAX_FRAGMENTS = 64
+
+# Formato binário do REPORT: estado, nº de tentativas, comprimento do task_id (+ task_id)
+REPORT_HEADER = struct.Struct("!BBB")
+MAX_REPORT_RESULTS = 255  # Limite do nº de tentativas (um byte); relatórios maiores são divididos
+REPORT_STATUS = {"success": 0, "failed": 1}
+REPORT_STATUS_NAMES = {code: name for name, code in REPORT_STATUS.items()}
+
+# Cada tentativa começa por um byte de flags que indica as métricas presentes
+RESULT_FLAGS = struct.Struct("!B")
+FLAG_PING = 0x01
+FLAG_IPERF = 0x02
+FLAG_CPU = 0x04
+FLAG_RAM = 0x08
+FLAG_INTERFACES = 0x10
+
+PING_STATS = struct.Struct("!fffffH")  # perda, min, avg, max, mdev, nº de tempos (+ tempos em float32)
+IPERF_STATS = struct.Struct("!ff")  # largura de banda (Mbps), transferência (MB)
+CPU_STATS = struct.Struct("!f")  # percentagem
+RAM_STATS = struct.Struct("!ffff")  # total, disponível, usado (GB), percentagem
+# Interfaces: nº de interfaces; cada uma com comprimento do nome (+ nome) e estatísticas
+INTERFACE_COUNT = struct.Struct("!B")
+INTERFACE_STATS = struct.Struct("!ffffIIII")  # rx/tx bits/s, rx/tx pacotes/s, erros rx/tx, descartes rx/tx
+INTERFACE_FIELDS = ("rx_bps", "tx_bps", "rx_pps", "tx_pps", "rx_errors", "tx_errors", "rx_drop", "tx_drop")
+ERROR_LENGTH = struct.Struct("!H")
 
-def create_ativa_message(sequence, agent_id):
+# Bloco de séries temporais: timestamp base (ms) e nº de séries;
+# cada série: comprimento do nome (+ nome) e nº de amostras, seguidos de
+# pares (delta de timestamp, delta de valor) em varints zigzag
+BATCH_HEADER = struct.Struct("!QB")
+SERIES_HEADER = struct.Struct("!BH")
+VALUE_SCALE = 1000  # Valores em vírgula fixa com 3 casas decimais
+
+# Canal TCP: cada mensagem é precedida do seu comprimento (32 bits)
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME = 1024 * 1024
+
+def new_session():
+    """
+    Gera um nonce de sessão (32 bits, diferente de zero) para um novo registo do agente.
+    """
+    return int.from_bytes(os.urandom(4), "big") or 1
+
+
+def next_sequence(sequence):
     """
-    Cria uma mensagem ATIVA com apenas o agent_id.
+    Devolve o número de sequência seguinte, com wrap-around em 32 bits.
+    """
+    return (sequence + 1) % SEQUENCE_MODULO
+
+
+def pack_header(message_type, sequence, agent_id=0, session=0):
+    """
+    Empacota o cabeçalho comum a todas as mensagens.
+    """
+    return HEADER.pack(PROTOCOL_VERSION, message_type, sequence % SEQUENCE_MODULO, agent_id, session)
+
+
+def message_type_name(message):
+    """
+    Nome do tipo de uma mensagem codificada, sem a descodificar.
+    """
+    if len(message) < HEADER.size or message[0] != PROTOCOL_VERSION:
+        return "UNKNOWN"
+    return MESSAGE_TYPE_NAMES.get(message[1], "UNKNOWN")
+
+
+def create_ativa_message(sequence, agent_id, session):
+    """
+    Cria uma mensagem ATIVA com o agent_id e o nonce de sessão do registo.
     """
     message_type = MESSAGE_TYPES["ATIVA"]
-    return struct.pack("!BBB", message_type, sequence, agent_id)
+    return pack_header(message_type, sequence, agent_id, session)
 
 
 # Função para criar uma mensagem ACK
-def create_ack_message(sequence):
+def create_ack_message(sequence, agent_id=0, session=0):
     message_type = MESSAGE_TYPES["ACK"]
-    return struct.pack("!BB", message_type, sequence)
+    return pack_header(message_type, sequence, agent_id, session)
 
 # Função para criar uma mensagem TASK
-def create_task_message(sequence, metrics, link_metrics, alert_conditions):
+def create_task_message(sequence, metrics, link_metrics, alert_conditions, agent_id=0, session=0,
+                        task_id=None, frequency=None):
     """
     Cria uma mensagem de tarefa (TASK) em binário.
     """
-    message_type = MESSAGE_TYPES["TASK"]
+    payload = encode_task_payload(metrics, link_metrics, alert_conditions, task_id, frequency)
+    return create_task_message_from_payload(sequence, payload, agent_id, session)
 
+
+def encode_task_payload(metrics, link_metrics, alert_conditions, task_id=None, frequency=None):
+    """
+    Corpo de uma TASK (sem cabeçalho), para poder ser serializado uma vez e reutilizado.
+    """
     # Serializar métricas como JSON string
-    metrics_json = json.dumps({
+    return json.dumps({
+        "task_id": task_id,
+        "frequency": frequency,
         "metrics": metrics,
         "link_metrics": link_metrics,
         "alert_conditions": alert_conditions
     }).encode('utf-8')
 
-    # Construir mensagem binária
-    return struct.pack("!BB", message_type, sequence) + metrics_json
+
+def create_task_message_from_payload(sequence, payload, agent_id=0, session=0):
+    """
+    Junta o cabeçalho de uma TASK a um corpo já serializado.
+    """
+    return pack_header(MESSAGE_TYPES["TASK"], sequence, agent_id, session) + payload
+
+def decode_header(data):
+    """
+    Lê só o cabeçalho: (tipo, sequência, agent_id, sessão), ou None se a
+    mensagem for curta demais ou de outra versão do protocolo.
+    """
+    if len(data) < HEADER.size or data[0] != PROTOCOL_VERSION:
+        return None
+    return HEADER.unpack_from(data)[1:]
+
 
 # Função para decodificar mensagens
 def decode_message(data):
     """
     Decodifica mensagens recebidas.
+    `data` pode ser bytes ou uma memoryview sobre um buffer de receção
+    reutilizado: os campos são lidos no sítio com unpack_from e o resultado
+    não guarda referências ao buffer, exceto o "chunk" dos FRAGMENT (uma
+    vista, válida só até à próxima receção; o Reassembler copia-o).
     """
-    message_type = data[0]
+    header = decode_header(data)
+    if header is None:
+        return {"type": "UNKNOWN", "raw_data": bytes(data)}
+
+    message_type, sequence, agent_id, session = header
+    header = {"sequence": sequence, "agent_id": agent_id, "session": session}
 
     if message_type == MESSAGE_TYPES["ATIVA"]:
-        # Decodificar a mensagem ATIVA que contém a porta
-        _, sequence, agent_id = struct.unpack("!BBB", data)
-        return {"type": "ATIVA", "sequence": sequence, "agent_id": agent_id}
+        return {"type": "ATIVA", **header}
     elif message_type == MESSAGE_TYPES["ACK"]:
-        _, sequence = struct.unpack("!BB", data)
-        return {"type": "ACK", "sequence": sequence}
+        return {"type": "ACK", **header}
     elif message_type == MESSAGE_TYPES["TASK"]:
-        sequence = data[1]
-        payload = json.loads(data[2:].decode('utf-8'))
-        return {"type": "TASK", "sequence": sequence, **payload}
+        payload = _json_object(data)
+        return {"type": "TASK", **header, **payload}
     elif message_type == MESSAGE_TYPES["REPORT"]:
-        sequence = data[1]  # Obtém o número de sequência
-        report_content = data[2:].decode('utf-8')  # Decodifica o restante da mensagem como string UTF-8
-        return {"type": "REPORT", "sequence": sequence, "report": report_content}
+        return {"type": "REPORT", **header, "report": decode_report(data, HEADER.size)}
     elif message_type == MESSAGE_TYPES["ALERTFLOW"]:
-        sequence = data[1]
-        alert_content = json.loads(data[2:].decode('utf-8'))
-        return {"type": "ALERTFLOW", "sequence": sequence, **alert_content}
+        alert_content = _json_object(data)
+        return {"type": "ALERTFLOW", **header, **alert_content}
+    elif message_type == MESSAGE_TYPES["REPORT_BATCH"]:
+        return {"type": "REPORT_BATCH", **header, "series": decode_report_batch(data, HEADER.size)}
+    elif message_type == MESSAGE_TYPES["FRAGMENT"]:
+        message_id, index, count = FRAGMENT_HEADER.unpack_from(data, HEADER.size)
+        chunk = memoryview(data)[HEADER.size + FRAGMENT_HEADER.size:]
+        return {"type": "FRAGMENT", **header, "message_id": message_id,
+                "index": index, "count": count, "chunk": chunk}
     else:
-        return {"type": "UNKNOWN", "raw_data": data}
+        return {"type": "UNKNOWN", "raw_data": bytes(data)}
+
+
+def _json_object(data):
+    """
+    Corpo JSON da mensagem, com uma única cópia (o json.loads aceita bytes
+    diretamente, sem passar por str). Levanta ValueError se não for um objeto.
+    """
+    content = json.loads(bytes(memoryview(data)[HEADER.size:]))
+    if not isinstance(content, dict):
+        raise ValueError(f"Corpo JSON não é um objeto: {type(content).__name__}")
+    return content
     
 # Função para criar uma mensagem ALERTFLOW
-def create_alert_message(report, sequence):
+def create_alert_message(report, sequence, agent_id=0, session=0):
     """
     Cria uma mensagem ALERTFLOW específica.
     """
     message_type = MESSAGE_TYPES["ALERTFLOW"]
-    report_content = create_report_message(report)  # Usa o mesmo formato de relatório
-    return struct.pack("!BB", message_type, sequence) + report_content.encode('utf-8')
+    # JSON, como os restantes ALERTFLOW, para que decode_message o consiga ler
+    report_content = json.dumps(report).encode('utf-8')
+    return pack_header(message_type, sequence, agent_id, session) + report_content
 
-def create_alert_message_metric(result, sequence):
+def create_alert_message_metric(result, sequence, agent_id=0, session=0):
     """
     Cria uma mensagem ALERTFLOW baseada em métricas.
     """
     message_type = MESSAGE_TYPES["ALERTFLOW"]
     alert_content = json.dumps(result).encode('utf-8')
-    return struct.pack("!BB", message_type, sequence) + alert_content
+    return pack_header(message_type, sequence, agent_id, session) + alert_content
 
 def create_report_message(report):
     """
@@ -130,6 +264,12 @@ def create_report_message(report):
                 report_content.append(f"  Usado: {ram.get('used', 'N/A')} GB")
                 report_content.append(f"  Percentual de Uso: {ram.get('percent', 'N/A')}%\n")
 
+            for name, stats in (result.get("interfaces") or {}).items():
+                report_content.append(f" Interface {name}:")
+                report_content.append(f"  RX: {stats.get('rx_bps', 0) / 1e6:.3f} Mbps ({stats.get('rx_pps', 0):.0f} pps)")
+                report_content.append(f"  TX: {stats.get('tx_bps', 0) / 1e6:.3f} Mbps ({stats.get('tx_pps', 0):.0f} pps)")
+                report_content.append(f"  Erros/Descartes: {stats.get('rx_errors')}/{stats.get('rx_drop')} RX, {stats.get('tx_errors')}/{stats.get('tx_drop')} TX\n")
+
         # Adicionar erros (se houver)
         if report.get("status") == "failed":
             report_content.append(f"{' ERRO ':!^50}")
@@ -141,19 +281,438 @@ def create_report_message(report):
         # Combinar tudo em uma string formatada
         return "\r\n".join(report_content)
     except Exception as e:
-        print(f"[ERROR] Falha ao criar a mensagem de relatorio: {e}")
+        registo.error("REPORT", "Falha ao criar a mensagem de relatorio: %s", e)
         return ""
 
 
 
-def create_serialized_report_message(sequence, report):
-        # Obter o tipo de mensagem
-        message_type = MESSAGE_TYPES["REPORT"]
+def _float_or_nan(value):
+    return math.nan if value is None else float(value)
+
+
+def _nan_to_none(value):
+    return None if math.isnan(value) else value
+
+
+def encode_report(report):
+    """
+    Serializa o objeto report no formato binário do REPORT.
+    Valores em falta (None) são codificados como NaN.
+    """
+    results = report.get("results") or []
+    if len(results) > MAX_REPORT_RESULTS:
+        raise ValueError(f"Demasiados resultados num REPORT: {len(results)} (máximo {MAX_REPORT_RESULTS})")
+    task_id = str(report.get("task_id")).encode("utf-8")[:255]
+    parts = [
+        REPORT_HEADER.pack(REPORT_STATUS.get(report.get("status"), 1), len(results), len(task_id)),
+        task_id,
+    ]
+
+    for result in results:
+        ping = result.get("ping")
+        iperf = result.get("iperf")
+        ram = result.get("ram")
+        interfaces = result.get("interfaces")
+        flags = ((FLAG_PING if ping else 0) | (FLAG_IPERF if iperf else 0)
+                 | (FLAG_CPU if result.get("cpu") is not None else 0) | (FLAG_RAM if ram else 0)
+                 | (FLAG_INTERFACES if interfaces else 0))
+        parts.append(RESULT_FLAGS.pack(flags))
+
+        if ping:
+            times = ping.get("times") or []
+            parts.append(PING_STATS.pack(
+                _float_or_nan(ping.get("packet_loss")),
+                _float_or_nan(ping.get("min_time")),
+                _float_or_nan(ping.get("avg_time")),
+                _float_or_nan(ping.get("max_time")),
+                _float_or_nan(ping.get("mdev_time")),
+                len(times),
+            ))
+            parts.append(struct.pack(f"!{len(times)}f", *times))
+        if iperf:
+            parts.append(IPERF_STATS.pack(
+                _float_or_nan(iperf.get("bandwidth_mbps")),
+                _float_or_nan(iperf.get("transfer_mbytes")),
+            ))
+        if flags & FLAG_CPU:
+            parts.append(CPU_STATS.pack(float(result["cpu"])))
+        if ram:
+            parts.append(RAM_STATS.pack(
+                _float_or_nan(ram.get("total")),
+                _float_or_nan(ram.get("available")),
+                _float_or_nan(ram.get("used")),
+                _float_or_nan(ram.get("percent")),
+            ))
+        if interfaces:
+            names = list(interfaces)[:255]
+            parts.append(INTERFACE_COUNT.pack(len(names)))
+            for name in names:
+                encoded = name.encode("utf-8")[:255]
+                stats = interfaces[name]
+                parts.append(INTERFACE_COUNT.pack(len(encoded)))
+                parts.append(encoded)
+                parts.append(INTERFACE_STATS.pack(
+                    *(_float_or_nan(stats.get(field)) for field in INTERFACE_FIELDS[:4]),
+                    *(min(int(stats.get(field) or 0), 0xFFFFFFFF) for field in INTERFACE_FIELDS[4:]),
+                ))
+
+    if report.get("status") == "failed":
+        error = str(report.get("error", "")).encode("utf-8")[:1024]
+        parts.append(ERROR_LENGTH.pack(len(error)))
+        parts.append(error)
+
+    return b"".join(parts)
+
+
+def split_report(report):
+    """
+    Divide um relatório em relatórios com no máximo MAX_REPORT_RESULTS
+    resultados cada, pela ordem original.
+    """
+    results = report.get("results") or []
+    if len(results) <= MAX_REPORT_RESULTS:
+        return [report]
+    return [dict(report, results=results[i:i + MAX_REPORT_RESULTS])
+            for i in range(0, len(results), MAX_REPORT_RESULTS)]
+
+
+def decode_report(data, offset=0):
+    """
+    Reconstrói o objeto report a partir do formato binário, com os campos
+    numéricos já convertidos (sem voltar a interpretar texto).
+    """
+    status, count, task_id_length = REPORT_HEADER.unpack_from(data, offset)
+    offset += REPORT_HEADER.size
+    task_id = bytes(data[offset:offset + task_id_length]).decode("utf-8")
+    offset += task_id_length
+
+    results = []
+    for _ in range(count):
+        (flags,) = RESULT_FLAGS.unpack_from(data, offset)
+        offset += RESULT_FLAGS.size
+        result = {}
+
+        if flags & FLAG_PING:
+            loss, min_time, avg_time, max_time, mdev_time, n_times = PING_STATS.unpack_from(data, offset)
+            offset += PING_STATS.size
+            times = struct.unpack_from(f"!{n_times}f", data, offset)
+            offset += 4 * n_times
+            result["ping"] = {
+                "times": list(times),
+                "packet_loss": _nan_to_none(loss),
+                "min_time": _nan_to_none(min_time),
+                "avg_time": _nan_to_none(avg_time),
+                "max_time": _nan_to_none(max_time),
+                "mdev_time": _nan_to_none(mdev_time),
+            }
+        if flags & FLAG_IPERF:
+            bandwidth, transfer = IPERF_STATS.unpack_from(data, offset)
+            offset += IPERF_STATS.size
+            result["iperf"] = {
+                "bandwidth_mbps": _nan_to_none(bandwidth),
+                "transfer_mbytes": _nan_to_none(transfer),
+            }
+        if flags & FLAG_CPU:
+            (result["cpu"],) = CPU_STATS.unpack_from(data, offset)
+            offset += CPU_STATS.size
+        if flags & FLAG_RAM:
+            total, available, used, percent = RAM_STATS.unpack_from(data, offset)
+            offset += RAM_STATS.size
+            result["ram"] = {
+                "total": _nan_to_none(total),
+                "available": _nan_to_none(available),
+                "used": _nan_to_none(used),
+                "percent": _nan_to_none(percent),
+            }
+        if flags & FLAG_INTERFACES:
+            (n_interfaces,) = INTERFACE_COUNT.unpack_from(data, offset)
+            offset += INTERFACE_COUNT.size
+            result["interfaces"] = {}
+            for _ in range(n_interfaces):
+                (length,) = INTERFACE_COUNT.unpack_from(data, offset)
+                offset += INTERFACE_COUNT.size
+                name = bytes(data[offset:offset + length]).decode("utf-8")
+                offset += length
+                values = INTERFACE_STATS.unpack_from(data, offset)
+                offset += INTERFACE_STATS.size
+                result["interfaces"][name] = {field: _nan_to_none(value) if i < 4 else value
+                                              for i, (field, value) in enumerate(zip(INTERFACE_FIELDS, values))}
+        results.append(result)
+
+    report = {"task_id": task_id, "status": REPORT_STATUS_NAMES.get(status, "failed"), "results": results}
+    if status == REPORT_STATUS["failed"] and offset < len(data):
+        (length,) = ERROR_LENGTH.unpack_from(data, offset)
+        offset += ERROR_LENGTH.size
+        report["error"] = bytes(data[offset:offset + length]).decode("utf-8", "replace")
+    return report
+
+
+def create_serialized_report_message(sequence, report, agent_id=0, session=0):
+    """
+    Cria uma mensagem REPORT no formato binário.
+    A versão em texto (create_report_message) fica apenas para apresentação.
+    """
+    message_type = MESSAGE_TYPES["REPORT"]
+    payload = encode_report(report)
+    registo.debug("REPORT", "Relatório %s serializado: %d bytes", report.get("task_id"), len(payload))
+    return pack_header(message_type, sequence, agent_id, session) + payload
+
+
+def frame_message(message):
+    """
+    Prefixa a mensagem com o seu comprimento, para envio no canal TCP.
+    """
+    return FRAME_HEADER.pack(len(message)) + message
+
+
+class FrameReader:
+    """
+    Separa um fluxo TCP em mensagens delimitadas por comprimento.
+    """
+
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Acrescenta bytes recebidos (bytes ou memoryview sobre um buffer de
+        receção) e devolve as mensagens completas.
+        Sem dados pendentes, as mensagens são copiadas diretamente de `data`
+        e só o resto incompleto passa para o buffer interno.
+        """
+        if self.buffer:
+            self.buffer += data
+            data = self.buffer
+        messages = []
+        offset = 0
+        with memoryview(data) as view:
+            while len(view) - offset >= FRAME_HEADER.size:
+                (length,) = FRAME_HEADER.unpack_from(view, offset)
+                if length > self.max_frame:
+                    raise ValueError(f"Frame demasiado grande: {length} bytes")
+                end = offset + FRAME_HEADER.size + length
+                if len(view) < end:
+                    break
+                messages.append(bytes(view[offset + FRAME_HEADER.size:end]))
+                offset = end
+            if data is not self.buffer:
+                self.buffer += view[offset:]
+        if data is self.buffer:
+            del self.buffer[:offset]
+        return messages
+
+    def pending(self):
+        """
+        Bytes recebidos que ainda não formam uma mensagem completa.
+        """
+        return len(self.buffer)
+
+
+def report_metrics(result):
+    """
+    Extrai os valores numéricos de uma tentativa (resultado de process_task),
+    indexados pelo nome da métrica usado nas alertflow_conditions.
+    """
+    metrics = {}
+    if result.get("ping"):
+        metrics["latency"] = result["ping"].get("avg_time")
+        metrics["packet_loss"] = result["ping"].get("packet_loss")
+    if result.get("iperf"):
+        metrics["bandwidth"] = result["iperf"].get("bandwidth_mbps")
+    if result.get("cpu") is not None:
+        metrics["cpu_usage"] = result["cpu"]
+    if result.get("ram"):
+        metrics["ram_usage"] = result["ram"].get("percent")
+    for name, stats in (result.get("interfaces") or {}).items():
+        for field in INTERFACE_FIELDS[:4]:
+            metrics[f"interface.{name}.{field}"] = stats.get(field)
+    return {name: value for name, value in metrics.items() if value is not None}
+
+
+def _put_varint(out, value):
+    """
+    Acrescenta `value` (inteiro com sinal) a `out` como varint zigzag.
+    """
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data, offset):
+    """
+    Lê um varint zigzag de `data` a partir de `offset`; devolve (valor, novo offset).
+    """
+    result = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), offset
+
+
+class ReportBatchBuilder:
+    """
+    Construtor incremental de um bloco REPORT_BATCH.
+    As amostras são codificadas em delta à medida que chegam, pelo que o
+    tamanho do bloco é sempre conhecido sem voltar a serializar.
+    """
+
+    def __init__(self, base_timestamp):
+        self.base_timestamp = int(base_timestamp)
+        self.series = {}
+
+    def add(self, name, timestamp, value):
+        """
+        Acrescenta uma amostra (timestamp em ms) à série `name`.
+        """
+        series = self.series.get(name)
+        if series is None:
+            if len(self.series) >= 255:
+                raise ValueError("Demasiadas séries num bloco")
+            series = self.series[name] = {"name": name.encode("utf-8")[:255], "count": 0,
+                                          "timestamp": self.base_timestamp, "value": 0,
+                                          "data": bytearray()}
+        timestamp = int(timestamp)
+        scaled = round(value * VALUE_SCALE)
+        _put_varint(series["data"], timestamp - series["timestamp"])
+        _put_varint(series["data"], scaled - series["value"])
+        series["timestamp"], series["value"] = timestamp, scaled
+        series["count"] += 1
+
+    def size(self):
+        """
+        Tamanho do bloco serializado, em bytes.
+        """
+        return BATCH_HEADER.size + sum(
+            SERIES_HEADER.size + len(series["name"]) + len(series["data"])
+            for series in self.series.values()
+        )
+
+    def samples(self):
+        return sum(series["count"] for series in self.series.values())
+
+    def to_bytes(self):
+        parts = [BATCH_HEADER.pack(self.base_timestamp, len(self.series))]
+        for series in self.series.values():
+            parts.append(SERIES_HEADER.pack(len(series["name"]), series["count"]))
+            parts.append(series["name"])
+            parts.append(bytes(series["data"]))
+        return b"".join(parts)
+
+
+def decode_report_batch(data, offset=0):
+    """
+    Descodifica um bloco REPORT_BATCH: {métrica: [(timestamp_ms, valor), ...]}.
+    """
+    base_timestamp, n_series = BATCH_HEADER.unpack_from(data, offset)
+    offset += BATCH_HEADER.size
+    series = {}
+    for _ in range(n_series):
+        name_length, count = SERIES_HEADER.unpack_from(data, offset)
+        offset += SERIES_HEADER.size
+        name = bytes(data[offset:offset + name_length]).decode("utf-8")
+        offset += name_length
+
+        timestamp, value = base_timestamp, 0
+        samples = []
+        for _ in range(count):
+            delta, offset = _get_varint(data, offset)
+            timestamp += delta
+            delta, offset = _get_varint(data, offset)
+            value += delta
+            samples.append((timestamp, value / VALUE_SCALE))
+        series[name] = samples
+    return series
+
+
+def create_report_batch_message(sequence, batch, agent_id=0, session=0):
+    """
+    Cria uma mensagem REPORT_BATCH a partir de um ReportBatchBuilder.
+    """
+    message_type = MESSAGE_TYPES["REPORT_BATCH"]
+    return pack_header(message_type, sequence, agent_id, session) + batch.to_bytes()
+
+
+def split_message(message, next_sequence, agent_id=0, session=0):
+    """
+    Devolve a lista de datagramas a enviar para `message`: a própria mensagem
+    se couber num datagrama, ou fragmentos FRAGMENT com sequências próprias
+    (obtidas de `next_sequence()`), cada um confirmado individualmente para que
+    só os fragmentos perdidos sejam retransmitidos.
+    """
+    if len(message) <= MAX_DATAGRAM:
+        return [message]
+
+    count = -(-len(message) // FRAGMENT_PAYLOAD)
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"Mensagem demasiado grande para fragmentar: {len(message)} bytes")
+
+    message_type = MESSAGE_TYPES["FRAGMENT"]
+    message_id = next_sequence()
+    fragments = []
+    for index in range(count):
+        chunk = message[index * FRAGMENT_PAYLOAD:(index + 1) * FRAGMENT_PAYLOAD]
+        fragments.append(
+            pack_header(message_type, next_sequence(), agent_id, session)
+            + FRAGMENT_HEADER.pack(message_id, index, count)
+            + chunk
+        )
+    return fragments
+
+
+class Reassembler:
+    """
+    Reconstrói mensagens fragmentadas, com buffers limitados:
+    no máximo `max_messages` mensagens incompletas em simultâneo (as mais
+    antigas são descartadas) e cada uma expira ao fim de `timeout` segundos.
+    """
+
+    def __init__(self, max_messages=256, timeout=10.0):
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.partial = {}
+
+    def add(self, peer, decoded, now=None):
+        """
+        Junta um fragmento descodificado. Devolve a mensagem original completa
+        quando chega o último fragmento em falta, ou None.
+        """
+        now = time.monotonic() if now is None else now
+        count, index = decoded["count"], decoded["index"]
+        if not 0 < count <= MAX_FRAGMENTS or index >= count:
+            return None
+
+        self.expire(now)
+        key = (peer, decoded["agent_id"], decoded["session"], decoded["message_id"])
+        entry = self.partial.get(key)
+        if entry is None:
+            if len(self.partial) >= self.max_messages:
+                # Descarta a mensagem incompleta mais antiga (ordem de inserção)
+                del self.partial[next(iter(self.partial))]
+            entry = self.partial[key] = {"created": now, "count": count, "chunks": {}}
+        elif entry["count"] != count:
+            return None
+
+        entry["chunks"][index] = bytes(decoded["chunk"])
+        if len(entry["chunks"]) < count:
+            return None
 
-        # Gerar o conteúdo do relatório como string
-        report_content = create_report_message(report)  # Usa a função existente
+        del self.partial[key]
+        return b"".join(entry["chunks"][i] for i in range(count))
 
-        # Serializar a mensagem combinando tipo, sequência e conteúdo
-        print(f"[REPORT] Relatório enviado: \n {report_content}")
-        return struct.pack("!BB", message_type, sequence) + report_content.encode('utf-8')
-    
\ No newline at end of file
+    def expire(self, now=None):
+        """
+        Descarta mensagens incompletas mais antigas que o timeout.
+        """
+        now = time.monotonic() if now is None else now
+        # A ordem de inserção do dicionário é a ordem de criação
+        for key, entry in list(self.partial.items()):
+            if now - entry["created"] <= self.timeout:
+                break
+            del self.partial[key]
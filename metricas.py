@@ -1,9 +1,40 @@
 import time
+import json
 import psutil
 import subprocess
 import re
+import icmp
+import registo
+from instrumentacao import COLLECTOR_DURATION, timed
 
+@timed(COLLECTOR_DURATION, collector="ping")
 def ping_and_store(host, count):
+    """
+    Latência para `host` com sockets ICMP no próprio processo; se o sistema
+    não permitir sockets ICMP, recorre ao comando ping.
+    """
+    try:
+        data = icmp.ping(host, count)
+    except OSError as e:
+        registo.warning("ICMP", "Sockets ICMP indisponíveis (%s); a usar o comando ping", e)
+        return ping_subprocess(host, count)
+    if data is None:
+        registo.warning("ICMP", "Sem resposta de %s", host)
+    return data
+
+
+def ping_many(hosts, count):
+    """
+    Latência para vários destinos em simultâneo: {host: dados ou None}.
+    """
+    try:
+        return icmp.probe(hosts, count)
+    except OSError as e:
+        registo.warning("ICMP", "Sockets ICMP indisponíveis (%s); a usar o comando ping", e)
+        return {host: ping_subprocess(host, count) for host in hosts}
+
+
+def ping_subprocess(host, count):
     try:
         result = subprocess.run(
             ["ping", host, "-c", str(count)],
@@ -36,7 +67,7 @@ def ping_and_store(host, count):
         return data
     
     except Exception as e:
-        print(f"Erro: {e}")
+        registo.error("ping", "Erro: %s", e)
         return None  # Retorna None em caso de erro para não afetar o fluxo
 
         
@@ -44,59 +75,50 @@ def ping_and_store(host, count):
 import subprocess
 import re
 
+IPERF_BUSY_RETRIES = 2  # Novas tentativas se o servidor iperf3 estiver ocupado com outro cliente
+IPERF_BUSY_WAIT = 1  # Segundos entre tentativas
+
+
+@timed(COLLECTOR_DURATION, collector="iperf")
 def iperf_and_store(server, port, duration):
     try:
-        # Executa o iperf3 no modo cliente
-        result = subprocess.run(
-            ["iperf3", "-c", server, "-p", str(port), "-t", str(duration)],
-            text=True,
-            capture_output=True
-        )
-        
-        if result.returncode != 0:
-            raise Exception(f"Erro ao executar iperf: {result.stderr.strip()}")
-        
-        output = result.stdout
+        for attempt in range(IPERF_BUSY_RETRIES + 1):
+            # Executa o iperf3 no modo cliente, com o resultado em JSON
+            result = subprocess.run(
+                ["iperf3", "-c", server, "-p", str(port), "-t", str(duration), "--json"],
+                text=True,
+                capture_output=True
+            )
+            try:
+                output = json.loads(result.stdout)
+            except ValueError:
+                raise Exception(f"Erro ao executar iperf: {result.stderr.strip() or result.stdout.strip()}")
 
-        # Regex para capturar largura de banda e transferência
-        bandwidth_regex = r"(\d+\.\d+|\d+) (Mbits/sec|Gbits/sec)"
-        transfer_regex = r"(\d+\.\d+|\d+) (MBytes|GBytes)"
+            error = output.get("error")
+            if error and "busy" in error and attempt < IPERF_BUSY_RETRIES:
+                time.sleep(IPERF_BUSY_WAIT)
+                continue
+            if error or result.returncode != 0:
+                raise Exception(f"Erro ao executar iperf: {error or result.stderr.strip()}")
+            break
 
-        # Captura largura de banda (última ocorrência no log)
-        final_stats = re.findall(bandwidth_regex, output)
-        transfers = re.findall(transfer_regex, output)
-        
-        # Processa a largura de banda
-        if final_stats:
-            bandwidth_value, bandwidth_unit = final_stats[-1]
-            bandwidth = float(bandwidth_value)
-            if bandwidth_unit == "Gbits/sec":
-                bandwidth *= 1000  # Converte para Mbits/sec
-        else:
-            bandwidth = 0  # Valor padrão em caso de erro
-
-        # Processa a transferência
-        if transfers:
-            transfer_value, transfer_unit = transfers[-1]
-            transfer = float(transfer_value)
-            if transfer_unit == "GBytes":
-                transfer *= 1000  # Converte para MBytes
-        else:
-            transfer = 0  # Valor padrão em caso de erro
+        # Totais do teste: bits/s medidos no recetor (TCP) ou a soma (UDP)
+        end = output.get("end", {})
+        summary = end.get("sum_received") or end.get("sum") or end.get("sum_sent") or {}
 
         # Dados processados
         data = {
             "server": server,
             "port": port,
             "duration": duration,
-            "bandwidth_mbps": bandwidth,
-            "transfer_mbytes": transfer
+            "bandwidth_mbps": summary.get("bits_per_second", 0) / 1e6,
+            "transfer_mbytes": summary.get("bytes", 0) / (1024 ** 2)
         }
         
         return data
 
     except Exception as e:
-        print(f"[iperf_and_store] Erro: {e}")
+        registo.error("iperf_and_store", "Erro: %s", e)
         # Retorna um dicionário com informações mínimas
         return {
             "server": server,
@@ -133,7 +155,7 @@ def get_ram_usage():
         }
         return ram_usage  # Retornar o dicionário com as informações de RAM
     except Exception as e:
-        print(f"Erro ao obter o uso da RAM: {e}")
+        registo.error("RAM", "Erro ao obter o uso da RAM: %s", e)
         ram_usage = {
             "total": 0,
             "available": 0,
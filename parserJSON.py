@@ -1,4 +1,10 @@
+import hashlib
 import json
+import marshal
+import os
+import struct
+
+import registo
 
 # Caminho para o ficheiro JSON
 caminho_ficheiro = "teste.json"
@@ -62,20 +68,203 @@ def processar_tarefas(dados):
                 print(f"  - {condition.replace('_', ' ').capitalize()}: {threshold}")
 
 
-# Carregar e processar o ficheiro JSON
-dados = carregar_json(caminho_ficheiro)
-if dados:
-    processar_tarefas(dados)
+def _numero(valor, positivo=True):
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool) and (valor > 0 or not positivo)
+
+
+def _validar_dispositivo(device):
+    """
+    Devolve a lista de erros de uma entrada de dispositivo (vazia se for válida).
+    """
+    erros = []
+    if not isinstance(device, dict):
+        return ["entrada de dispositivo não é um objeto"]
+    if not isinstance(device.get("device_id"), (str, int)) or isinstance(device.get("device_id"), bool):
+        erros.append("device_id em falta ou inválido")
+
+    metrics = device.get("device_metrics", {})
+    if not isinstance(metrics, dict):
+        erros.append("device_metrics não é um objeto")
+    else:
+        for campo in ("cpu_usage", "ram_usage"):
+            if not isinstance(metrics.get(campo, False), bool):
+                erros.append(f"device_metrics.{campo} não é booleano")
+        interfaces = metrics.get("interface_stats", [])
+        if not isinstance(interfaces, list) or not all(isinstance(i, str) for i in interfaces):
+            erros.append("device_metrics.interface_stats não é uma lista de nomes")
+
+    link = device.get("link_metrics", {})
+    if not isinstance(link, dict):
+        erros.append("link_metrics não é um objeto")
+        link = {}
+    ping = link.get("latency", {}).get("ping") if isinstance(link.get("latency"), dict) else None
+    if "latency" in link:
+        if not isinstance(ping, dict) or not isinstance(ping.get("destination"), str):
+            erros.append("link_metrics.latency.ping.destination em falta")
+        elif not isinstance(ping.get("count"), int) or ping["count"] <= 0:
+            erros.append("link_metrics.latency.ping.count inválido")
+        elif "frequency" in ping and not _numero(ping["frequency"]):
+            erros.append("link_metrics.latency.ping.frequency inválida")
+    iperf = link.get("bandwidth", {}).get("iperf") if isinstance(link.get("bandwidth"), dict) else None
+    if "bandwidth" in link:
+        if not isinstance(iperf, dict) or not isinstance(iperf.get("server"), str):
+            erros.append("link_metrics.bandwidth.iperf.server em falta")
+        elif not _numero(iperf.get("duration")):
+            erros.append("link_metrics.bandwidth.iperf.duration inválida")
+        elif "frequency" in iperf and not _numero(iperf["frequency"]):
+            erros.append("link_metrics.bandwidth.iperf.frequency inválida")
+
+    condicoes = device.get("alertflow_conditions", {})
+    if not isinstance(condicoes, dict):
+        erros.append("alertflow_conditions não é um objeto")
+    else:
+        for nome, condicao in condicoes.items():
+            limiar = condicao.get("threshold") if isinstance(condicao, dict) else condicao
+            if not _numero(limiar, positivo=False):
+                erros.append(f"alertflow_conditions.{nome} sem limiar numérico")
+    return erros
+
+
+def validar_tarefas(dados):
+    """
+    Valida o JSON de tarefas e devolve (dispositivos válidos, erros).
+    As entradas inválidas são descartadas; as restantes ficam normalizadas
+    (device_id em texto, secções em falta preenchidas com objetos vazios),
+    para que o resto do servidor não precise de voltar a verificá-las.
+    """
+    if not isinstance(dados, dict) or not isinstance(dados.get("tasks"), list):
+        return [], ["o ficheiro não tem uma lista 'tasks'"]
+
+    dispositivos, erros = [], []
+    for i, task in enumerate(dados["tasks"]):
+        if not isinstance(task, dict) or not isinstance(task.get("devices"), list):
+            erros.append(f"tasks[{i}]: sem lista 'devices'")
+            continue
+        if "frequency" in task and not _numero(task["frequency"]):
+            erros.append(f"tasks[{i}]: frequency inválida")
+            continue
+        for j, device in enumerate(task["devices"]):
+            problemas = _validar_dispositivo(device)
+            if problemas:
+                erros.extend(f"tasks[{i}].devices[{j}]: {problema}" for problema in problemas)
+                continue
+            device = dict(device, device_id=str(device["device_id"]))
+            for secao in ("device_metrics", "link_metrics", "alertflow_conditions"):
+                device.setdefault(secao, {})
+            device.setdefault("task_id", task.get("task_id"))
+            device.setdefault("frequency", task.get("frequency"))
+            dispositivos.append(device)
+    return dispositivos, erros
+
+
+# Cache compilada: magic, mtime (ns), tamanho e SHA-256 do JSON, seguidos
+# dos dispositivos já validados (e dos erros encontrados) serializados com marshal
+CACHE_HEADER = struct.Struct("<4sQQ32s")
+CACHE_MAGIC = b"TSK1"
+CACHE_SUFFIX = ".cache"
+
+
+def _ler_cache(caminho_cache):
+    try:
+        with open(caminho_cache, "rb") as f:
+            dados = f.read()
+        magic, mtime, tamanho, resumo = CACHE_HEADER.unpack_from(dados)
+        if magic != CACHE_MAGIC:
+            return None
+        return mtime, tamanho, resumo, dados[CACHE_HEADER.size:]
+    except (OSError, struct.error):
+        return None
+
+
+def _gravar_cache(caminho_cache, mtime, tamanho, resumo, compilado):
+    temporario = f"{caminho_cache}.{os.getpid()}.tmp"
+    try:
+        with open(temporario, "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, mtime, tamanho, resumo))
+            f.write(marshal.dumps(compilado))
+        os.replace(temporario, caminho_cache)
+    except OSError as e:
+        registo.warning("Catálogo", "Não foi possível gravar a cache de tarefas: %s", e)
+
+
+def carregar_configuracao(caminho_ficheiro, usar_cache=True):
+    """
+    Carrega, valida e normaliza as tarefas do JSON; devolve a lista de
+    dispositivos, ou None se o ficheiro não puder ser lido.
+    O resultado é compilado para <ficheiro>.cache; nos arranques seguintes,
+    se o mtime e o tamanho (ou, se o mtime mudou, o SHA-256) coincidirem,
+    os dispositivos vêm diretamente da cache, sem interpretar nem validar o JSON.
+    """
+    caminho_cache = caminho_ficheiro + CACHE_SUFFIX
+    try:
+        stat = os.stat(caminho_ficheiro)
+    except OSError as e:
+        registo.error("Catálogo", "Ficheiro '%s' não encontrado: %s", caminho_ficheiro, e)
+        return None
+
+    compilado = None
+    cache = _ler_cache(caminho_cache) if usar_cache else None
+    if cache is not None and cache[:2] == (stat.st_mtime_ns, stat.st_size):
+        compilado = _descompilar(cache[3])
+    if compilado is None:
+        compilado = _compilar(caminho_ficheiro, caminho_cache, stat, cache, usar_cache)
+        if compilado is None:
+            return None
+
+    dispositivos, erros = compilado
+    for erro in erros:
+        registo.error("Catálogo", "Tarefa inválida ignorada: %s", erro)
+    return dispositivos
+
+
+def _descompilar(dados):
+    try:
+        dispositivos, erros = marshal.loads(dados)
+        return dispositivos, erros
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def _compilar(caminho_ficheiro, caminho_cache, stat, cache, usar_cache):
+    """
+    Lê, valida e grava na cache o JSON; devolve (dispositivos, erros) ou None.
+    """
+    try:
+        with open(caminho_ficheiro, "rb") as f:
+            conteudo = f.read()
+    except OSError as e:
+        registo.error("Catálogo", "Erro ao ler '%s': %s", caminho_ficheiro, e)
+        return None
+    resumo = hashlib.sha256(conteudo).digest()
+
+    if cache is not None and cache[2] == resumo:
+        # Só o mtime mudou (ficheiro tocado ou copiado): a compilação continua válida
+        compilado = _descompilar(cache[3])
+        if compilado is not None:
+            _gravar_cache(caminho_cache, stat.st_mtime_ns, len(conteudo), resumo, compilado)
+            return compilado
+
+    try:
+        dados = json.loads(conteudo)
+    except ValueError as e:
+        registo.error("Catálogo", "Erro ao decodificar o JSON de '%s': %s", caminho_ficheiro, e)
+        return None
+
+    compilado = validar_tarefas(dados)
+    if usar_cache:
+        _gravar_cache(caminho_cache, stat.st_mtime_ns, len(conteudo), resumo, compilado)
+    return compilado
+
 
 def carregar_tarefas(caminho_ficheiro):
     """
     Carrega as tarefas do arquivo JSON.
     """
-    try:
-        with open(caminho_ficheiro, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data.get("tasks", [])[0]["devices"]
-    except Exception as e:
-        print(f"[Erro] Falha ao carregar o JSON: {e}")
-        return []
-    
\ No newline at end of file
+    return carregar_configuracao(caminho_ficheiro) or []
+
+
+if __name__ == "__main__":
+    # Carregar e processar o ficheiro JSON
+    dados = carregar_json(caminho_ficheiro)
+    if dados:
+        processar_tarefas(dados)
@@ -0,0 +1,125 @@
+import ctypes
+import socket
+import struct
+
+import mensagens
+import registo
+from instrumentacao import FORWARDED
+
+# Valor Linux de SO_ATTACH_REUSEPORT_CBPF (o módulo socket nem sempre o expõe)
+SO_ATTACH_REUSEPORT_CBPF = getattr(socket, "SO_ATTACH_REUSEPORT_CBPF", 51)
+AGENT_ID_OFFSET = 6  # Posição do agent_id no cabeçalho (!BBIII)
+
+FORWARD_HEADER = struct.Struct("!4sH")  # IPv4 e porta do agente, antes do datagrama reencaminhado
+FORWARD_BUFFER = 4 * 1024 * 1024  # Buffer dos canais entre workers (absorve rajadas)
+
+
+class _SockFilter(ctypes.Structure):
+    _fields_ = [("code", ctypes.c_ushort), ("jt", ctypes.c_ubyte), ("jf", ctypes.c_ubyte), ("k", ctypes.c_uint32)]
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.POINTER(_SockFilter))]
+
+
+def reuseport_socket(kind, port):
+    """
+    Socket IPv4 ligado a `port` com SO_REUSEPORT: vários processos
+    partilham a porta e o kernel distribui o tráfego entre eles.
+    """
+    sock = socket.socket(socket.AF_INET, kind)
+    if kind == socket.SOCK_STREAM:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('0.0.0.0', port))
+    return sock
+
+
+def attach_agent_filter(sock, workers):
+    """
+    Instala no grupo SO_REUSEPORT do socket um programa BPF clássico que
+    escolhe o socket de destino pelo agent_id do cabeçalho (agent_id %
+    workers), em vez do hash do endereço de origem. O índice é a ordem
+    de bind dos sockets no grupo.
+    Devolve False se o kernel não o suportar; nesse caso os datagramas
+    chegam ao worker errado e são reencaminhados pelo Shard.
+    """
+    program = (_SockFilter * 3)(
+        _SockFilter(0x20, 0, 0, AGENT_ID_OFFSET),  # ld [6]: A = agent_id (32 bits, ordem de rede)
+        _SockFilter(0x94, 0, 0, workers),  # mod #workers
+        _SockFilter(0x16, 0, 0, 0),  # ret A: índice do socket no grupo
+    )
+    fprog = _SockFprog(len(program), program)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, bytes(fprog))
+    except OSError as e:
+        registo.warning("Workers", "Filtro BPF de SO_REUSEPORT indisponível (%s); a reencaminhar entre workers", e)
+        return False
+    return True
+
+
+def create_channels(workers):
+    """
+    Um par de sockets Unix (datagrama) por worker: o worker lê do
+    primeiro e os restantes escrevem no segundo. Criados antes do fork
+    para que todos os processos herdem os descritores.
+    """
+    channels = []
+    for _ in range(workers):
+        pair = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        for sock in pair:
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, FORWARD_BUFFER)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, FORWARD_BUFFER)
+        channels.append(pair)
+    return channels
+
+
+class Shard:
+    """
+    Posição de um worker na partição dos agentes: cada agente pertence ao
+    worker agent_id % count, que guarda o seu registo, sessão, sequências
+    e séries. Datagramas entregues pelo kernel a outro worker (sem filtro
+    BPF, ou com o grupo alterado) são-lhe reencaminhados com o endereço
+    de origem, para que a resposta saia pela porta partilhada como se
+    tivesse sido recebida diretamente.
+    """
+
+    def __init__(self, index, count, channels):
+        self.index = index
+        self.count = count
+        self.inbox = channels[index][0]
+        self.outboxes = [pair[1] for pair in channels]
+        self.buffer = bytearray(FORWARD_HEADER.size + mensagens.RECV_BUFFER)
+        # Os descritores herdados que este worker não usa são fechados na sua cópia
+        for other, (inbox, outbox) in enumerate(channels):
+            if other != index:
+                inbox.close()
+        self.outboxes[index].close()
+
+    def owner(self, data):
+        """
+        Worker responsável pela mensagem; as inválidas ficam com quem as recebeu.
+        """
+        header = mensagens.decode_header(data)
+        return self.index if header is None else header[2] % self.count
+
+    def forward(self, worker, data, addr):
+        try:
+            self.outboxes[worker].sendmsg([FORWARD_HEADER.pack(socket.inet_aton(addr[0]), addr[1]), data])
+            FORWARDED.inc(result="ok")
+        except (BlockingIOError, InterruptedError):
+            # Canal cheio: perde-se como um datagrama UDP, o agente retransmite
+            FORWARDED.inc(result="dropped")
+
+    def receive(self):
+        """
+        Próximo datagrama reencaminhado: (endereço do agente, memoryview), ou None.
+        A vista só é válida até à chamada seguinte.
+        """
+        try:
+            nbytes = self.inbox.recv_into(self.buffer)
+        except (BlockingIOError, InterruptedError):
+            return None
+        ip, port = FORWARD_HEADER.unpack_from(self.buffer)
+        return (socket.inet_ntoa(ip), port), memoryview(self.buffer)[FORWARD_HEADER.size:nbytes]
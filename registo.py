@@ -0,0 +1,239 @@
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "AVISO", ERROR: "ERRO"}
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "aviso": WARNING, "error": ERROR, "erro": ERROR}
+
+QUEUE_SIZE = 10000  # Registos em espera; acima disto são descartados (e contados)
+DEFAULT_RATE = 200  # Registos por segundo, por categoria (abaixo de ERRO)
+DEFAULT_BURST = 400
+SUPPRESSED_REPORT_INTERVAL = 5.0  # Segundos entre avisos de registos suprimidos
+
+
+class Category:
+    """
+    Configuração e estado de uma categoria (a etiqueta entre parêntesis
+    retos, ex.: "UDP"): nível mínimo, amostragem dos registos abaixo de
+    AVISO e limite de débito (token bucket).
+    """
+
+    def __init__(self, name, level, rate=DEFAULT_RATE, burst=DEFAULT_BURST, sample=1.0):
+        self.name = name
+        self.level = level
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.tokens = burst
+        self.refilled = time.monotonic()
+        self.suppressed = 0
+
+    def admit(self, level):
+        if level < WARNING and self.sample < 1.0 and random.random() >= self.sample:
+            return False
+        if level >= ERROR or not self.rate:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Logger:
+    """
+    Registo estruturado assíncrono: quem regista só verifica o nível e coloca
+    o registo (ainda por formatar) numa fila; a formatação e a escrita são
+    feitas por uma thread própria. Nunca bloqueia: com a fila cheia, o
+    registo é descartado e contado.
+    """
+
+    def __init__(self, stream=None, level=INFO, fmt="text", queue_size=QUEUE_SIZE):
+        self.stream = stream
+        self.level = level
+        self.format = fmt
+        self.categories = {}
+        self.context = {}  # Campos acrescentados a todos os registos (ex.: worker=2)
+        self.queue_size = queue_size
+        self.start()
+
+    def start(self):
+        """
+        Cria a fila e a thread de escrita. Também usado no processo filho
+        após um fork, onde a thread do pai já não existe.
+        """
+        self.queue = queue.Queue(self.queue_size)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="registo")
+        self.thread.start()
+
+    def category(self, name):
+        category = self.categories.get(name)
+        if category is None:
+            with self.lock:
+                category = self.categories.setdefault(name, Category(name, self.level))
+        return category
+
+    def configure(self, category=None, level=None, rate=None, burst=None, sample=None):
+        """
+        Altera o nível/limites de uma categoria, ou de todas (category=None).
+        """
+        if category is None:
+            if level is not None:
+                self.level = level
+            targets = list(self.categories.values())
+        else:
+            targets = [self.category(category)]
+        for target in targets:
+            if level is not None:
+                target.level = level
+            if rate is not None:
+                target.rate = rate
+            if burst is not None:
+                target.burst = target.tokens = burst
+            if sample is not None:
+                target.sample = sample
+
+    def enabled(self, level, category):
+        return level >= self.category(category).level
+
+    def log(self, level, category, message, *args, **fields):
+        target = self.categories.get(category) or self.category(category)
+        if level < target.level or not target.admit(level):
+            return
+        try:
+            self.queue.put_nowait((time.time(), level, category, message, args, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=1.0):
+        """
+        Espera (no máximo `timeout` segundos) que os registos em fila sejam escritos.
+        """
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _run(self):
+        last_report = time.monotonic()
+        while True:
+            records = [self.queue.get()]
+            # Escreve de uma vez tudo o que estiver em fila
+            while len(records) < 512:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            markers = []
+            for record in records:
+                if isinstance(record, threading.Event):
+                    markers.append(record)
+                else:
+                    lines.append(self._format(*record))
+
+            now = time.monotonic()
+            if now - last_report >= SUPPRESSED_REPORT_INTERVAL:
+                last_report = now
+                lines.extend(self._suppressed_report())
+
+            if lines:
+                stream = self.stream or sys.stdout
+                try:
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass
+            for marker in markers:
+                marker.set()
+
+    def _suppressed_report(self):
+        lines = []
+        for category in list(self.categories.values()):
+            if category.suppressed:
+                count, category.suppressed = category.suppressed, 0
+                lines.append(self._format(time.time(), WARNING, "Registo",
+                                          "%d registos de [%s] suprimidos pelo limite de débito",
+                                          (count, category.name), {}))
+        if self.dropped:
+            count, self.dropped = self.dropped, 0
+            lines.append(self._format(time.time(), WARNING, "Registo",
+                                      "%d registos descartados (fila cheia)", (count,), {}))
+        return lines
+
+    def _format(self, timestamp, level, category, message, args, fields):
+        try:
+            text = message % args if args else str(message)
+        except (TypeError, ValueError):
+            text = f"{message} {args}"
+        if self.context:
+            fields = {**self.context, **fields}
+        if self.format == "json":
+            return json.dumps({"ts": round(timestamp, 3), "level": LEVEL_NAMES.get(level, level),
+                               "category": category, "msg": text, **fields}, default=str)
+        clock = time.strftime("%H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp * 1000) % 1000:03d}"
+        extra = "".join(f" {key}={value}" for key, value in fields.items())
+        return f"{clock} {LEVEL_NAMES.get(level, level):<5} [{category}] {text}{extra}"
+
+
+# Registo do processo; nível e formato configuráveis por CC_LOG_LEVEL e CC_LOG_FORMAT
+LOGGER = Logger(level=LEVELS.get(os.environ.get("CC_LOG_LEVEL", "info").lower(), INFO),
+                fmt=os.environ.get("CC_LOG_FORMAT", "text"))
+atexit.register(LOGGER.flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=LOGGER.start)
+
+
+def debug(category, message, *args, **fields):
+    LOGGER.log(DEBUG, category, message, *args, **fields)
+
+
+def info(category, message, *args, **fields):
+    LOGGER.log(INFO, category, message, *args, **fields)
+
+
+def warning(category, message, *args, **fields):
+    LOGGER.log(WARNING, category, message, *args, **fields)
+
+
+def error(category, message, *args, **fields):
+    LOGGER.log(ERROR, category, message, *args, **fields)
+
+
+def enabled(level, category):
+    """
+    Permite evitar trabalho caro (ex.: formatar um relatório) quando o nível está desativado.
+    """
+    return LOGGER.enabled(level, category)
+
+
+def bind(**fields):
+    """
+    Acrescenta campos a todos os registos seguintes deste processo.
+    """
+    LOGGER.context.update(fields)
+
+
+def configure(category=None, level=None, rate=None, burst=None, sample=None):
+    LOGGER.configure(category, level, rate, burst, sample)
+
+
+def flush(timeout=1.0):
+    return LOGGER.flush(timeout)
@@ -0,0 +1,168 @@
+import math
+import threading
+from collections import deque
+
+import registo
+
+# Sentido por omissão de cada condição: a largura de banda alerta quando
+# desce abaixo do limiar, as restantes métricas quando o excedem
+DEFAULT_OPERATORS = {"bandwidth": "<"}
+
+OPERATORS = {
+    ">": lambda value, threshold: value > threshold,
+    ">=": lambda value, threshold: value >= threshold,
+    "<": lambda value, threshold: value < threshold,
+    "<=": lambda value, threshold: value <= threshold,
+}
+
+
+def _percentile(q):
+    def aggregate(values):
+        ordered = sorted(values)
+        # Método nearest-rank
+        return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+    return aggregate
+
+
+AGGREGATES = {
+    "avg": lambda values: sum(values) / len(values),
+    "min": min,
+    "max": max,
+    "count": len,
+    "p50": _percentile(50),
+    "p90": _percentile(90),
+    "p95": _percentile(95),
+    "p99": _percentile(99),
+}
+
+
+class Rule:
+    """
+    Condição compilada sobre uma métrica.
+    Sem janela, é avaliada sobre cada lote de amostras recebido (basta o
+    máximo ou o mínimo do lote, conforme o sentido da comparação); com
+    janela, sobre o agregado das amostras dos últimos `window` segundos.
+    """
+
+    def __init__(self, metric, threshold, operator=None, aggregate=None, window=0):
+        self.metric = metric
+        self.threshold = float(threshold)
+        self.operator = operator or DEFAULT_OPERATORS.get(metric, ">")
+        self.compare = OPERATORS[self.operator]
+        self.window = float(window or 0)
+        self.aggregate = aggregate or ("avg" if self.window else None)
+        if self.aggregate is not None and self.aggregate not in AGGREGATES:
+            raise ValueError(f"Agregado desconhecido: {self.aggregate}")
+        # Pior valor do lote no sentido da comparação
+        self.extreme = min if self.operator.startswith("<") else max
+
+    def describe(self):
+        if self.window:
+            return f"{self.aggregate}({self.metric}, {self.window:g}s) {self.operator} {self.threshold:g}"
+        return f"{self.metric} {self.operator} {self.threshold:g}"
+
+
+def compile_conditions(conditions):
+    """
+    Compila as alertflow_conditions de um dispositivo.
+    Cada condição é um limiar numérico ({"latency": 1}) ou um dicionário
+    {"threshold": 50, "operator": ">", "aggregate": "p95", "window": 300}.
+    Condições inválidas são ignoradas (com aviso).
+    """
+    rules = []
+    for metric, condition in (conditions or {}).items():
+        try:
+            if isinstance(condition, dict):
+                rules.append(Rule(metric, condition["threshold"], condition.get("operator"),
+                                  condition.get("aggregate"), condition.get("window", 0)))
+            else:
+                rules.append(Rule(metric, condition))
+        except (KeyError, TypeError, ValueError) as e:
+            registo.warning("Regras", "Condição inválida para '%s': %s (%s)", metric, condition, e)
+    return rules
+
+
+def _clean(samples):
+    """
+    Descarta amostras sem valor numérico (None, NaN, texto).
+    """
+    clean = []
+    for timestamp, value in samples:
+        if isinstance(value, (int, float)) and not math.isnan(value):
+            clean.append((timestamp, float(value)))
+    return clean
+
+
+class RuleEngine:
+    """
+    Avaliação contínua, no servidor, das condições de alerta de cada dispositivo.
+    Um alerta é emitido quando uma regra passa a ser verdadeira e só volta a
+    ser emitido depois de a condição deixar de se verificar.
+    """
+
+    def __init__(self):
+        self.rules = {}  # device_id -> [Rule]
+        self.windows = {}  # (agent_id, métrica, janela) -> deque de (timestamp_ms, valor)
+        self.firing = set()  # (agent_id, descrição da regra) atualmente em alerta
+        self.lock = threading.Lock()
+
+    def load(self, devices):
+        """
+        Compila as regras a partir das entradas de dispositivo do ficheiro de tarefas.
+        """
+        rules = {}
+        for device in devices:
+            # Um dispositivo com várias tarefas junta as condições de todas
+            rules.setdefault(str(device["device_id"]), []).extend(
+                compile_conditions(device.get("alertflow_conditions")))
+        with self.lock:
+            self.rules = rules
+        registo.info("Regras", "%d regras carregadas para %d dispositivos",
+                     sum(len(r) for r in rules.values()), len(rules))
+
+    def evaluate(self, agent_id, series):
+        """
+        Avalia as regras do agente sobre um lote {métrica: [(timestamp_ms, valor)]}.
+        Devolve a lista de alertas novos.
+        """
+        alerts = []
+        updated = set()  # Janelas já atualizadas com este lote (partilhadas entre regras)
+        with self.lock:
+            for rule in self.rules.get(str(agent_id), []):
+                samples = _clean(series.get(rule.metric, []))
+                if rule.window:
+                    value, timestamp = self._window_value(agent_id, rule, samples, updated)
+                elif samples:
+                    value = rule.extreme(v for _, v in samples)
+                    timestamp = samples[-1][0]
+                else:
+                    continue
+
+                if value is None:
+                    continue
+                key = (str(agent_id), rule.describe())
+                if rule.compare(value, rule.threshold):
+                    if key not in self.firing:
+                        self.firing.add(key)
+                        alerts.append({"agent_id": agent_id, "metric": rule.metric, "rule": rule.describe(),
+                                       "value": value, "threshold": rule.threshold, "timestamp": timestamp})
+                else:
+                    self.firing.discard(key)
+        return alerts
+
+    def _window_value(self, agent_id, rule, samples, updated):
+        key = (str(agent_id), rule.metric, rule.window)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = deque()
+        if key not in updated:
+            window.extend(samples)
+            updated.add(key)
+        if not window:
+            return None, None
+
+        latest = window[-1][0]
+        limit = latest - rule.window * 1000
+        while window and window[0][0] <= limit:
+            window.popleft()
+        return AGGREGATES[rule.aggregate]([v for _, v in window]), latest
@@ -1,125 +1,177 @@
+import argparse
+import os
+import signal
 import socket
-import json
-from threading import Thread
+import itertools
+import selectors
+from threading import Lock, Thread
 import mensagens
-from parserJSON import carregar_tarefas
+import instrumentacao
+import particoes
+import registo
+from fiabilidade import DuplicateFilter, ReliableSender
+from armazenamento import SeriesStore
+from agregados import Rollups
+from regras import RuleEngine
+from iperf import IperfPool
+from catalogo import TaskCatalogue
+from parserJSON import carregar_configuracao
 import time
 
-import metricas
-
-AGENTS = {}  # Dicionário para armazenar agentes registrados e seus IPs
-TASKS = []  # Lista de tarefas carregadas do JSON
-
-
-import subprocess
-
-def initialize_server():
+AGENTS = {}  # agent_id -> {"addr": (ip, porta), "session": nonce do registo}
+CATALOGUE = None  # Tarefas do JSON indexadas por device_id (recarregadas quando o ficheiro muda)
+SENDER = None  # Camada de fiabilidade (ACKs pendentes) do socket UDP principal
+DUPLICATES = DuplicateFilter()  # Sequências de REPORT já recebidas por (agent_id, sessão)
+SEQUENCES = itertools.count(1)  # Sequências das mensagens enviadas pelo servidor
+REASSEMBLER = mensagens.Reassembler()  # Mensagens fragmentadas recebidas dos agentes
+STORE = None  # Séries temporais das métricas recebidas (aberto em initialize_server)
+ROLLUPS = None  # Agregados por minuto/hora, atualizados a cada amostra recebida
+RULES = RuleEngine()  # Condições de alerta (alertflow_conditions) avaliadas no servidor
+IPERF = None  # Servidores iperf3 e janelas de teste de largura de banda dos agentes
+TASK_CACHE = {}  # (device_id, task_id) -> corpo da TASK já serializado para esse agente
+TASK_GENERATION = 0  # Incrementada em cada invalidação da cache de TASK
+# Protege TASK_CACHE, TASK_GENERATION e o IP do servidor, usados pela thread UDP
+# (registos) e pela thread que vigia o catálogo (alterações)
+TASK_LOCK = Lock()
+SERVER_IP = None  # IP do servidor colocado nas tarefas (ver server_ip)
+SERVER_IP_CHECKED = 0.0  # Instante (monotonic) da última verificação do IP
+SHARD = None  # Partição dos agentes deste worker (modo --workers); None num único processo
+
+DATA_PATH = "dados"  # Diretório do armazenamento de séries temporais
+IPERF_PORTS = range(5201, 5209)  # Portas dos servidores iperf3 (fora da porta UDP de controlo)
+
+UDP_BURST = 256  # Máximo de datagramas lidos de seguida por cada evento de leitura
+# Buffers de receção reutilizados (um por ciclo de eventos): cada datagrama ou
+# leitura TCP é descodificado no sítio, sem alocar um bytes por receção
+UDP_BUFFER = bytearray(mensagens.RECV_BUFFER)
+TCP_BUFFER = bytearray(65536)
+
+TCP_BACKLOG = 1024  # Fila de ligações pendentes no listen()
+TCP_MAX_CONNECTIONS = 4096  # Acima disto deixa de aceitar (as ligações esperam no backlog)
+TCP_IDLE_TIMEOUT = 300.0  # Segundos sem dados antes de fechar um canal de alertas
+TCP_READ_TIMEOUT = 10.0  # Prazo para completar uma mensagem começada
+TCP_MAX_OUTPUT = 64 * 1024  # Com mais ACKs por enviar do que isto, deixa de ler da ligação
+
+STATS_PORT = 9200  # Endpoint local das métricas internas (formato Prometheus)
+
+SERVER_IP_TTL = 60.0  # Segundos durante os quais o IP do servidor é reutilizado sem voltar a verificar
+
+
+def initialize_server(udp_port=33333, tcp_port=44444, json_path="teste.json", data_path=DATA_PATH,
+                      iperf_ports=IPERF_PORTS):
     """
-    Solicita ao usuário a porta UDP e o caminho do JSON para configurar o servidor e inicia o servidor iperf.
+    Carrega as tarefas do JSON, abre o armazenamento e inicia os servidores iperf.
+    Devolve as portas UDP e TCP a usar.
     """
-    udp_port = 33333
-    tcp_port = 44444
-    json_path = "teste.json"
-
-    # Carregar tarefas do JSON
-    global TASKS
-    TASKS = carregar_tarefas(json_path)
-    print(f"[Servidor] Tarefas carregadas: {TASKS}")
 
-    # Inicializar o servidor iperf
-    try:
-        subprocess.Popen(
-            ["iperf3", "-s", "-p 33333"],  # Inicia o iperf no modo servidor
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        print("[Servidor] Servidor iperf iniciado com sucesso.")
-    except Exception as e:
-        print(f"[Erro] Não foi possível iniciar o servidor iperf: {e}")
+    # Carregar tarefas do JSON e vigiar o ficheiro
+    global CATALOGUE
+    CATALOGUE = TaskCatalogue(json_path, on_change=push_task_changes)
+    CATALOGUE.load()
+    registo.info("Servidor", "Tarefas carregadas: %d entradas de dispositivo", len(CATALOGUE.devices()))
+    RULES.load(CATALOGUE.devices())
+    CATALOGUE.watch()
+
+    # Abrir o armazenamento de séries temporais
+    global STORE, ROLLUPS
+    STORE = SeriesStore(data_path)
+    ROLLUPS = Rollups(store=STORE)
+    registo.info("Servidor", "Armazenamento de métricas em '%s'", data_path)
+
+    # Inicializar os servidores iperf (uma instância por porta do conjunto)
+    global IPERF
+    IPERF = IperfPool(iperf_ports)
+    if not IPERF.start():
+        registo.warning("Servidor", "Nem todas as portas iperf têm servidor; são reiniciadas quando forem atribuídas.")
 
     return udp_port, tcp_port
 
 
 
-def send_with_ack(sock, message, destination, max_attempts=3):
+def report_series(report, timestamp):
     """
-    Envia uma mensagem e aguarda o ACK.
+    Converte as tentativas de um REPORT em séries {métrica: [(timestamp_ms, valor)]}.
+    As tentativas não trazem timestamp; usa-se o instante de receção.
     """
-    attempt = 0
-    sequence = mensagens.decode_message(message).get("sequence", None)
+    series = {}
+    for result in report.get("results", []):
+        for metric, value in mensagens.report_metrics(result).items():
+            series.setdefault(metric, []).append((timestamp, value))
+    return series
 
-    sock.settimeout(3)  # Define timeout enquanto aguarda o ACK
-    while attempt < max_attempts:
-        try:
-            sock.sendto(message, destination)
-            print(f"[UDP] Mensagem enviada para {destination} (Tentativa {attempt + 1})")
 
-            response, _ = sock.recvfrom(1024)
-            decoded = mensagens.decode_message(response)
-            print(f"[DEBUG] Resposta decodificada: {decoded}")
+def ingest_samples(agent_id, series):
+    """
+    Guarda as amostras recebidas de um agente no armazenamento de séries
+    temporais e atualiza os respetivos agregados.
+    """
+    if STORE is not None:
+        for metric, samples in series.items():
+            STORE.append_many(agent_id, metric, samples)
+    if ROLLUPS is not None:
+        ROLLUPS.add_series(agent_id, series)
 
-            if decoded["type"] == "ACK" and decoded["sequence"] == sequence:
-                print("[UDP] ACK recebido. Comunicação confirmada.")
-                return True
-        except socket.timeout:
-            print(f"[UDP] Timeout aguardando ACK (Tentativa {attempt + 1}).")
-        attempt += 1
-        time.sleep(3)
+    for alert in RULES.evaluate(agent_id, series):
+        registo.warning("ALERTA", "Agente %s: %s (valor %g)", agent_id, alert["rule"], alert["value"],
+                        agent_id=agent_id, metric=alert["metric"])
 
-    print("[UDP] Número máximo de tentativas atingido.")
-    return False
 
 def process_report(sock, addr, decoded):
     """
     Processa mensagens do tipo REPORT:
-    - Dá print no conteúdo recebido.
-    - Envia um ACK com até 3 tentativas.
+    - Envia o ACK (também para duplicados, cujo ACK original se pode ter perdido).
+    - Dá print no conteúdo recebido, se não for um duplicado.
     """
     try:
-        # Print da mensagem recebida
-        print(f"[NetTask] Relatório recebido de {addr}:")
-        print(json.dumps(decoded, indent=2))
+        sequence = decoded["sequence"]
+        agent_id = decoded["agent_id"]
+        session = decoded["session"]
 
-        # Obtém o número de sequência da mensagem
-        sequence = decoded.get("sequence")
-        if sequence is None:
-            print(f"[NetTask] Mensagem REPORT sem sequência: {decoded}")
+        # Criação do ACK
+        ack_message = mensagens.create_ack_message(sequence, agent_id, session)
+        send_datagram(sock, ack_message, addr)
+        registo.debug("NetTask", "Ack enviado")
+
+        if DUPLICATES.seen(agent_id, session, sequence):
+            registo.debug("NetTask", "Relatório duplicado de %s ignorado (sequência %d)", addr, sequence)
+            instrumentacao.DUPLICATES.inc(type="REPORT")
             return
 
-        # Criação do ACK
-        ack_message = mensagens.create_ack_message(sequence)
-        sock.sendto(ack_message, addr)
-        print(f"[NetTask] Ack enviado")
+        ingest_samples(agent_id, report_series(decoded["report"], int(time.time() * 1000)))
+
+        # Print da mensagem recebida (o texto é só apresentação; os valores já vêm numéricos)
+        if registo.enabled(registo.DEBUG, "NetTask"):
+            registo.debug("NetTask", "Relatório recebido de %s:\n%s", addr, mensagens.create_report_message(decoded["report"]))
 
     except Exception as e:
-        print(f"[NetTask] Erro ao processar relatório de {addr}: {e}")
+        registo.error("NetTask", "Erro ao processar relatório de %s: %s", addr, e)
 
-def udp_server(udp_port):
+def process_report_batch(sock, addr, decoded):
     """
-    Servidor UDP que recebe mensagens de agentes e processa.
+    Processa blocos REPORT_BATCH (vários ciclos de recolha codificados em delta):
+    confirma o bloco e, se não for duplicado, mostra um resumo das séries.
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('0.0.0.0', udp_port))
-    print(f"[UDP] Servidor ouvindo na porta UDP {udp_port}")
+    try:
+        sequence = decoded["sequence"]
+        agent_id = decoded["agent_id"]
+        session = decoded["session"]
 
-    while True:
-        try:
-            msg, addr = sock.recvfrom(8192)
-            decoded = mensagens.decode_message(msg)
-            print(f"[UDP] Mensagem recebida de {addr}: {decoded}")
-
-            if decoded["type"] == "ATIVA":
-                process_registration(sock, addr, decoded)
-            elif decoded["type"] == "ACK":
-                print(f"[NetTask] ACK recebido do agente em {addr}.")
-            elif decoded["type"] == "REPORT":
-                process_report(sock, addr, decoded)
-            else:
-                print(f"[UDP] Tipo de mensagem desconhecido de {addr}: {decoded}")
-        except Exception as e:
-            print("")
-        time.sleep(0.1)
+        ack_message = mensagens.create_ack_message(sequence, agent_id, session)
+        send_datagram(sock, ack_message, addr)
+
+        if DUPLICATES.seen(agent_id, session, sequence):
+            registo.debug("NetTask", "Bloco duplicado de %s ignorado (sequência %d)", addr, sequence)
+            instrumentacao.DUPLICATES.inc(type="REPORT_BATCH")
+            return
+
+        ingest_samples(agent_id, decoded["series"])
+
+        if registo.enabled(registo.DEBUG, "NetTask"):
+            for metric, samples in decoded["series"].items():
+                registo.debug("NetTask", "Agente %s - %s: %d amostras, última %s", agent_id, metric, len(samples), samples[-1][1])
 
+    except Exception as e:
+        registo.error("NetTask", "Erro ao processar bloco de relatórios de %s: %s", addr, e)
 
 def process_registration(sock, addr, decoded):
     """
@@ -128,37 +180,191 @@ def process_registration(sock, addr, decoded):
     try:
         agent_id = decoded.get("agent_id")
         sequence = decoded.get("sequence")
+        session = decoded.get("session")
 
-        if agent_id is None or sequence is None:
-            print(f"[NetTask] Mensagem de registro incompleta de {addr}: {decoded}")
+        if agent_id is None or sequence is None or session is None:
+            registo.warning("NetTask", "Mensagem de registro incompleta de %s: %s", addr, decoded)
             return
 
-        if agent_id not in AGENTS:
-            AGENTS[agent_id] = addr
-            print(f"[NetTask] Agente registrado: ID {agent_id} em {addr}")
+        previous = AGENTS.get(agent_id)
+        if previous is None:
+            registo.info("NetTask", "Agente registrado: ID %s em %s", agent_id, addr)
+        elif previous["session"] != session:
+            # Nova sessão: o agente reiniciou, esquece as sequências da anterior
+            DUPLICATES.forget(agent_id, previous["session"])
+            registo.info("NetTask", "Agente %s registrado com nova sessão em %s", agent_id, addr)
         else:
-            print(f"[NetTask] Agente {agent_id} já registrado em {AGENTS[agent_id]}")
+            registo.info("NetTask", "Agente %s já registrado em %s", agent_id, previous["addr"])
+        AGENTS[agent_id] = {"addr": addr, "session": session}
 
-        ack_message = mensagens.create_ack_message(sequence)
-        sock.sendto(ack_message, addr)
-        print(f"[UDP] ACK enviado para {addr}")
+        ack_message = mensagens.create_ack_message(sequence, agent_id, session)
+        send_datagram(sock, ack_message, addr)
+        registo.debug("UDP", "ACK enviado para %s", addr)
 
-        send_task_to_agent(sock, agent_id)
+        send_task_to_agent(agent_id)
 
     except Exception as e:
-        print(f"[UDP] Erro ao processar registro de {addr}: {e}")
+        registo.error("UDP", "Erro ao processar registro de %s: %s", addr, e)
+
+def process_fragment(sock, addr, decoded):
+    """
+    Confirma um fragmento e, quando a mensagem original fica completa,
+    processa-a como se tivesse chegado num único datagrama.
+    """
+    ack_message = mensagens.create_ack_message(decoded["sequence"], decoded["agent_id"], decoded["session"])
+    send_datagram(sock, ack_message, addr)
+
+    message = REASSEMBLER.add(addr, decoded)
+    if message is not None:
+        registo.debug("UDP", "Mensagem de %d bytes reconstruída a partir de %d fragmentos", len(message), decoded["count"])
+        dispatch_datagram(sock, addr, message)
+
+
+def next_sequence():
+    """
+    Devolve um número de sequência novo para uma mensagem do servidor.
+    """
+    return next(SEQUENCES) % mensagens.SEQUENCE_MODULO
+
+
+def send_datagram(sock, message, addr):
+    """
+    Envio direto (sem esperar ACK), contabilizado por tipo de mensagem.
+    """
+    sock.sendto(message, addr)
+    instrumentacao.MESSAGES_SENT.inc(type=mensagens.message_type_name(message))
+
+
+def send_reliable(message, addr, agent_id, session):
+    """
+    Envia uma mensagem pela camada de fiabilidade, fragmentando-a se não
+    couber num datagrama.
+    """
+    for datagram in mensagens.split_message(message, next_sequence, agent_id, session):
+        SENDER.send(datagram, addr)
+
+
+def process_ack(sock, addr, decoded):
+    """
+    Entrega os ACKs recebidos no socket principal à tabela de mensagens pendentes.
+    """
+    if SENDER.handle_ack(addr, decoded.get("sequence")):
+        registo.debug("NetTask", "ACK recebido do agente em %s.", addr)
+    else:
+        registo.debug("NetTask", "ACK sem mensagem pendente de %s: %s", addr, decoded)
+
+
+# Tabela de despacho: tipo de mensagem -> handler (sock, addr, decoded)
+UDP_HANDLERS = {
+    "ATIVA": process_registration,
+    "ACK": process_ack,
+    "REPORT": process_report,
+    "REPORT_BATCH": process_report_batch,
+    "FRAGMENT": process_fragment,
+}
+
+
+def dispatch_datagram(sock, addr, msg):
+    """
+    Descodifica um datagrama e entrega-o ao handler do respetivo tipo.
+    """
+    try:
+        decoded = mensagens.decode_message(msg)
+        instrumentacao.MESSAGES_RECEIVED.inc(type=decoded["type"])
+        registo.debug("UDP", "Mensagem recebida de %s: %s", addr, decoded)
+
+        handler = UDP_HANDLERS.get(decoded["type"])
+        if handler is None:
+            registo.warning("UDP", "Tipo de mensagem desconhecido de %s: %s", addr, decoded)
+            return
+        handler(sock, addr, decoded)
+    except Exception as e:
+        registo.error("UDP", "Erro ao processar datagrama de %s: %s", addr, e)
+
+
+def drain_udp(sock):
+    """
+    Lê em rajada todos os datagramas pendentes no socket (não bloqueante),
+    até esvaziar o buffer do kernel ou atingir UDP_BURST. Cada datagrama é
+    lido para UDP_BUFFER e tratado antes do seguinte o reutilizar.
+    Com vários workers, os datagramas de agentes de outro worker são-lhe
+    reencaminhados.
+    """
+    view = memoryview(UDP_BUFFER)
+    for _ in range(UDP_BURST):
+        try:
+            nbytes, addr = sock.recvfrom_into(UDP_BUFFER)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError as e:
+            # ICMP port unreachable de um envio anterior; não afeta o socket
+            registo.debug("UDP", "Erro de ligação ignorado: %s", e)
+            continue
+        if SHARD is not None:
+            owner = SHARD.owner(view[:nbytes])
+            if owner != SHARD.index:
+                SHARD.forward(owner, view[:nbytes], addr)
+                continue
+        dispatch_datagram(sock, addr, view[:nbytes])
+
+
+def drain_forwarded(sock):
+    """
+    Trata os datagramas reencaminhados por outros workers como se tivessem
+    chegado ao socket UDP `sock` (as respostas saem pela porta partilhada).
+    """
+    for _ in range(UDP_BURST):
+        received = SHARD.receive()
+        if received is None:
+            return
+        addr, data = received
+        dispatch_datagram(sock, addr, data)
+
+
+def udp_server(udp_port, sock=None):
+    """
+    Servidor UDP orientado a eventos: espera com um selector que o socket
+    fique legível e despacha as mensagens para handlers não bloqueantes.
+    `sock` é um socket já ligado (o do worker, no grupo SO_REUSEPORT).
+    """
+    if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('0.0.0.0', udp_port))
+    sock.setblocking(False)
+    registo.info("UDP", "Servidor ouvindo na porta UDP %d", udp_port)
+
+    global SENDER
+    SENDER = ReliableSender(sock)
+    instrumentacao.PENDING.track(lambda: len(SENDER.pending), queue="udp_unacked")
+    instrumentacao.PENDING.track(lambda: sum(len(p.queue) for p in list(SENDER.peers.values())), queue="udp_window_wait")
+    instrumentacao.PENDING.track(lambda: len(REASSEMBLER.partial), queue="reassembly")
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ, drain_udp)
+    if SHARD is not None:
+        selector.register(SHARD.inbox, selectors.EVENT_READ, lambda inbox: drain_forwarded(sock))
+
+    try:
+        while True:
+            # Acorda a tempo de disparar as retransmissões pendentes
+            for key, _ in selector.select(SENDER.next_timeout()):
+                key.data(key.fileobj)
+            SENDER.poll()
+    finally:
+        selector.close()
+        sock.close()
+
 
 def replace_ip(obj, server_ip):
-        if isinstance(obj, dict):
-            for key, value in obj.items():
-                if key in ["server", "destination"]:
-                    obj[key] = server_ip
-                elif isinstance(value, (dict, list)):
-                    value = replace_ip(value, server_ip)
-        elif isinstance(obj, list):
-            for item in obj:
-                obj = replace_ip(item,server_ip)
-        return obj
+    """
+    Devolve uma cópia de obj com 'server' e 'destination' substituídos pelo IP do servidor.
+    """
+    if isinstance(obj, dict):
+        return {key: server_ip if key in ("server", "destination") else replace_ip(value, server_ip)
+                for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [replace_ip(item, server_ip) for item in obj]
+    return obj
 
 def get_server_ip():
     """
@@ -172,107 +378,429 @@ def get_server_ip():
             ip_address = s.getsockname()[0]
         return ip_address
     except Exception as e:
-        print(f"Erro ao obter o endereço IP do servidor: {e}")
+        registo.error("Servidor", "Erro ao obter o endereço IP do servidor: %s", e)
         return "127.0.0.1"  # Retorna localhost como fallback
 
 
-def send_task_to_agent(sock, agent_id):
+def send_task_to_agent(agent_id, task_ids=None):
     """
-    Envia as tarefas associadas ao agente com base no JSON.
+    Envia ao agente as suas tarefas do catálogo (todas, ou só `task_ids`).
+    Uma tarefa que deixou de existir é enviada vazia, para o agente a remover.
+    O envio não bloqueia: o ACK é tratado pelo ciclo de eventos principal.
     """
-    task = next((t for t in TASKS if str(t["device_id"]) == str(agent_id)), None)
+    tasks = CATALOGUE.tasks(agent_id)
 
-    if not task:
-        print(f"[NetTask] Nenhuma tarefa encontrada para o agente ID {agent_id}.")
+    if not tasks and task_ids is None:
+        registo.warning("NetTask", "Nenhuma tarefa encontrada para o agente ID %s.", agent_id)
         return
 
-    try:
-        # Obtém o IP do servidor
-        server_ip = get_server_ip()  # Obtém o IP local do servidor
-        # Substituir 'server' e 'destination' pelo IP do servidor
-        print(server_ip)
-        task = replace_ip(task,server_ip)  # Aplica a substituição no task
-
-        task_message = mensagens.create_task_message(
-            sequence=1,
+    for task_id in (tasks if task_ids is None else task_ids):
+        try:
+            send_task(agent_id, task_id, tasks.get(task_id))
+        except Exception as e:
+            registo.error("NetTask", "Erro ao enviar tarefa %s para o agente %s: %s", task_id, agent_id, e)
+
+
+def server_ip():
+    """
+    IP do servidor a colocar nas tarefas, verificado no máximo a cada
+    SERVER_IP_TTL segundos; se mudar, as TASK em cache deixam de servir.
+    """
+    global SERVER_IP, SERVER_IP_CHECKED, TASK_GENERATION
+    with TASK_LOCK:
+        now = time.monotonic()
+        if SERVER_IP is None or now - SERVER_IP_CHECKED >= SERVER_IP_TTL:
+            address = get_server_ip()
+            SERVER_IP_CHECKED = now
+            if address != SERVER_IP:
+                if SERVER_IP is not None:
+                    registo.info("Servidor", "IP do servidor mudou para %s; tarefas em cache invalidadas", address)
+                TASK_CACHE.clear()
+                TASK_GENERATION += 1
+                SERVER_IP = address
+        return SERVER_IP
+
+
+def task_payload(agent_id, task_id, task):
+    """
+    Corpo serializado da TASK do agente, calculado uma vez e reutilizado até
+    a tarefa ou o IP do servidor mudarem.
+    """
+    with TASK_LOCK:
+        generation = TASK_GENERATION
+    address = server_ip()
+    key = (str(agent_id), task_id)
+    with TASK_LOCK:
+        payload = TASK_CACHE.get(key)
+    if payload is None:
+        # Substituir 'server' e 'destination' pelo IP do servidor (numa cópia; o catálogo não muda)
+        task = replace_ip(task, address)
+        payload = mensagens.encode_task_payload(
             metrics=task["device_metrics"],
-            link_metrics=task["link_metrics"],
-            alert_conditions=task["alertflow_conditions"]
+            link_metrics=IPERF.link_metrics(key, task["link_metrics"], task.get("frequency")),
+            alert_conditions=task["alertflow_conditions"],
+            task_id=task_id,
+            frequency=task.get("frequency")
         )
-        print(f"[DEBUG] Tamanho da mensagem de tarefa: {len(task_message)}")
+        with TASK_LOCK:
+            # Se a cache foi invalidada durante o cálculo, `task` pode ser de um
+            # catálogo anterior: o corpo é enviado, mas não fica em cache
+            if TASK_GENERATION == generation:
+                TASK_CACHE[key] = payload
+    return payload
 
-        agent_addr = AGENTS[agent_id]
-        send_with_ack(sock, task_message, agent_addr)
-    except Exception as e:
-        print(f"[NetTask] Erro ao enviar tarefa para o agente {agent_id}: {e}")
 
-def process_alertflow(conn, addr):
+def send_task(agent_id, task_id, task):
+    agent = AGENTS[agent_id]
+    if task is None:
+        IPERF.release((str(agent_id), task_id))
+        payload = mensagens.encode_task_payload({}, {}, {}, task_id)
+    else:
+        payload = task_payload(agent_id, task_id, task)
+    task_message = mensagens.create_task_message_from_payload(next_sequence(), payload, agent_id, agent["session"])
+
+    agent_addr = agent["addr"]
+    send_reliable(task_message, agent_addr, agent_id, agent["session"])
+    registo.debug("UDP", "Tarefa %s enviada para %s", task_id, agent_addr)
+
+
+def push_task_changes(changed):
     """
-    Processa mensagens ALERTFLOW recebidas via TCP, semelhante ao REPORT.
+    Chamado quando o ficheiro de tarefas muda: recompila as regras e reenvia
+    aos agentes registados apenas as tarefas que mudaram.
     """
-    try:
-        print(f"[TCP] Conexão recebida de {addr}")
-        message = conn.recv(1024)
-        if not message:
-            print(f"[TCP] Nenhuma mensagem recebida de {addr}")
-            return
+    global TASK_GENERATION
+    RULES.load(CATALOGUE.devices())
+    with TASK_LOCK:
+        TASK_GENERATION += 1
+        for device_id, task_ids in changed.items():
+            for task_id in task_ids:
+                TASK_CACHE.pop((device_id, task_id), None)
+    for device_id, task_ids in changed.items():
+        tasks = CATALOGUE.tasks(device_id)
+        for task_id in task_ids:
+            if task_id not in tasks:
+                # Tarefa removida: a janela iperf fica livre mesmo que o agente não esteja registado
+                IPERF.release((device_id, task_id))
+    for agent_id in list(AGENTS):
+        task_ids = changed.get(str(agent_id))
+        if task_ids:
+            send_task_to_agent(agent_id, task_ids)
+
+def handle_alert(addr, message):
+    """
+    Processa uma mensagem ALERTFLOW recebida no canal TCP.
+    Devolve o ACK a enviar ao agente, ou None.
+    """
+    decoded = mensagens.decode_message(message)
+    instrumentacao.MESSAGES_RECEIVED.inc(type=decoded["type"])
+
+    if decoded["type"] == "ALERTFLOW":
+        registo.info("TCP", "Mensagem ALERTFLOW recebida: %s", decoded)
+        instrumentacao.MESSAGES_SENT.inc(type="ACK")
+        return mensagens.create_ack_message(
+            decoded["sequence"], decoded["agent_id"], decoded["session"]
+        )
+    registo.warning("TCP", "Mensagem de tipo inesperado recebida: %s", decoded)
+    return None
 
-        # Decodificar mensagem usando o formato REPORT
-        decoded = mensagens.decode_message(message)
-
-        if decoded["type"] == "ALERTFLOW":
-            print(f"[TCP] Mensagem ALERTFLOW recebida: {decoded}")
-            # Envia ACK como resposta
-            if "sequence" in decoded:
-                ack_message = mensagens.create_ack_message(decoded["sequence"])
-                conn.sendall(ack_message)
-                print(f"[TCP] ACK enviado para {addr}")
-            else:
-                print("[TCP] Mensagem ALERTFLOW sem sequência válida.")
-        else:
-            print(f"[TCP] Mensagem de tipo inesperado recebida: {decoded}")
 
-    except Exception as e:
-        print(f"[TCP] Erro ao processar mensagem ALERTFLOW de {addr}: {e}")
-    finally:
-        conn.close()
-        print(f"[TCP] Conexão encerrada com {addr}")
+def open_alert_connection(selector, connections, listener):
+    """
+    Aceita as ligações pendentes (não bloqueante) até esvaziar o backlog
+    ou atingir TCP_MAX_CONNECTIONS.
+    """
+    while len(connections) < TCP_MAX_CONNECTIONS:
+        try:
+            conn, addr = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            registo.error("TCP", "Erro ao aceitar conexão: %s", e)
+            return
 
-def tcp_server(tcp_port):
+        conn.setblocking(False)
+        state = {
+            "sock": conn,
+            "addr": addr,
+            "reader": mensagens.FrameReader(),
+            "output": bytearray(),
+            "last_read": time.monotonic(),
+            "partial_since": None,
+        }
+        connections[conn] = state
+        selector.register(conn, selectors.EVENT_READ, state)
+        registo.debug("TCP", "Conexão recebida de %s", addr)
+
+
+def close_alert_connection(selector, connections, state, reason=""):
+    conn = state["sock"]
+    selector.unregister(conn)
+    del connections[conn]
+    conn.close()
+    registo.debug("TCP", "Conexão encerrada com %s%s", state["addr"], reason)
+
+
+def read_alert_connection(selector, connections, state):
     """
-    Servidor TCP que processa mensagens ALERTFLOW.
+    Lê o que estiver disponível numa ligação e trata as mensagens completas.
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.bind(('0.0.0.0', tcp_port))
-    sock.listen(5)  # Aceita até 5 conexões simultâneas
-    print(f"[TCP] Servidor ouvindo na porta TCP {tcp_port}")
+    try:
+        nbytes = state["sock"].recv_into(TCP_BUFFER)
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError as e:
+        close_alert_connection(selector, connections, state, f" ({e})")
+        return
+    if not nbytes:
+        close_alert_connection(selector, connections, state)
+        return
 
-    while True:
+    now = time.monotonic()
+    state["last_read"] = now
+    try:
+        messages = state["reader"].feed(memoryview(TCP_BUFFER)[:nbytes])
+    except ValueError as e:
+        close_alert_connection(selector, connections, state, f" ({e})")
+        return
+
+    for message in messages:
         try:
-            conn, addr = sock.accept()
-            Thread(target=process_alertflow, args=(conn, addr), daemon=True).start()
-        except Exception as e:
-            print(f"[TCP] Erro ao aceitar conexão: {e}")
+            ack_message = handle_alert(state["addr"], message)
+        except (ValueError, KeyError) as e:
+            registo.warning("TCP", "Mensagem ALERTFLOW inválida de %s: %s", state["addr"], e)
+            continue
+        if ack_message is not None:
+            state["output"] += mensagens.frame_message(ack_message)
 
+    if state["reader"].pending():
+        state["partial_since"] = state["partial_since"] or now
+    else:
+        state["partial_since"] = None
+    write_alert_connection(selector, connections, state)
 
 
-if __name__ == "__main__":
-    udp_port, tcp_port = initialize_server()
+def write_alert_connection(selector, connections, state):
+    """
+    Envia os ACKs em buffer sem bloquear e ajusta os eventos a vigiar:
+    escrita enquanto houver dados por enviar e leitura só enquanto o
+    buffer de saída não exceder TCP_MAX_OUTPUT (backpressure).
+    """
+    if state["output"]:
+        try:
+            sent = state["sock"].send(state["output"])
+            del state["output"][:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            close_alert_connection(selector, connections, state, f" ({e})")
+            return
+
+    events = selectors.EVENT_WRITE if state["output"] else 0
+    if len(state["output"]) <= TCP_MAX_OUTPUT:
+        events |= selectors.EVENT_READ
+    selector.modify(state["sock"], events, state)
+
 
+def expire_alert_connections(selector, connections, now):
+    """
+    Fecha as ligações inativas ou com uma mensagem incompleta há demasiado tempo.
+    """
+    for state in list(connections.values()):
+        if now - state["last_read"] > TCP_IDLE_TIMEOUT:
+            close_alert_connection(selector, connections, state, " (inativa)")
+        elif state["partial_since"] and now - state["partial_since"] > TCP_READ_TIMEOUT:
+            close_alert_connection(selector, connections, state, " (mensagem incompleta)")
+
+
+def tcp_server(tcp_port, backlog=TCP_BACKLOG, reuse_port=False):
+    """
+    Servidor TCP que processa mensagens ALERTFLOW.
+    Todas as ligações são tratadas num único ciclo de eventos não bloqueante;
+    ao atingir TCP_MAX_CONNECTIONS deixa de aceitar e as novas ligações
+    aguardam no backlog do kernel.
+    Com `reuse_port`, cada worker tem o seu listener na mesma porta e o
+    kernel distribui as ligações (os ALERTFLOW não dependem do worker).
+    """
+    if reuse_port:
+        listener = particoes.reuseport_socket(socket.SOCK_STREAM, tcp_port)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('0.0.0.0', tcp_port))
+    listener.listen(backlog)
+    listener.setblocking(False)
+    registo.info("TCP", "Servidor ouvindo na porta TCP %d", tcp_port)
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, None)
+    accepting = True
+    connections = {}
+    last_expiry = time.monotonic()
+    instrumentacao.PENDING.track(lambda: len(connections), queue="tcp_connections")
+
+    while True:
+        for key, mask in selector.select(timeout=1.0):
+            if key.data is None:
+                open_alert_connection(selector, connections, listener)
+                continue
+            state = key.data
+            try:
+                if mask & selectors.EVENT_READ:
+                    read_alert_connection(selector, connections, state)
+                if mask & selectors.EVENT_WRITE and state["sock"] in connections:
+                    write_alert_connection(selector, connections, state)
+            except Exception as e:
+                # Um erro inesperado numa ligação só fecha essa ligação, não o ciclo de eventos
+                registo.error("TCP", "Erro ao tratar a ligação de %s: %s", state["addr"], e)
+                if state["sock"] in connections:
+                    close_alert_connection(selector, connections, state, f" ({e})")
+
+        # Backpressure: o listener só é vigiado enquanto houver capacidade
+        if accepting and len(connections) >= TCP_MAX_CONNECTIONS:
+            selector.unregister(listener)
+            accepting = False
+            registo.warning("TCP", "Limite de ligações atingido; aceitação suspensa.")
+        elif not accepting and len(connections) < TCP_MAX_CONNECTIONS:
+            selector.register(listener, selectors.EVENT_READ, None)
+            accepting = True
+
+        now = time.monotonic()
+        if now - last_expiry >= 1.0:
+            expire_alert_connections(selector, connections, now)
+            last_expiry = now
+
+
+
+def serve(udp_port, tcp_port, udp_socket=None, reuse_port=False, parent=None):
+    """
+    Corre os servidores UDP e TCP até Ctrl+C (ou, num worker, até o
+    processo principal `parent` desaparecer) e fecha o armazenamento.
+    """
     # Inicia o servidor UDP
-    udp_server_thread = Thread(target=udp_server, args=(udp_port,), daemon=True)
+    udp_server_thread = Thread(target=udp_server, args=(udp_port, udp_socket), daemon=True)
     udp_server_thread.start()
 
     # Inicia o servidor TCP
-    tcp_server_thread = Thread(target=tcp_server, args=(tcp_port,), daemon=True)
+    tcp_server_thread = Thread(target=tcp_server, args=(tcp_port, TCP_BACKLOG, reuse_port), daemon=True)
     tcp_server_thread.start()
 
     time.sleep(0.1)
 
-    print("Servidor rodando. Pressione Ctrl+C para encerrar.")
-
     try:
-        while True:
+        while parent is None or os.getppid() == parent:
             time.sleep(0.1)
+        registo.error("Workers", "Processo principal terminou; a encerrar")
     except KeyboardInterrupt:
-        print("\nServidor encerrado.")
\ No newline at end of file
+        pass
+
+    # Um segundo Ctrl+C (ou o reenviado pelo processo principal) não interrompe o fecho
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ROLLUPS.flush()
+    STORE.close()
+    IPERF.stop()
+    CATALOGUE.stop()
+
+
+def worker_iperf_ports(index, workers, ports=IPERF_PORTS):
+    """
+    Portas iperf do worker `index`: cada worker atribui janelas só nas suas.
+    Com mais workers do que portas, o intervalo é alargado (a partir da
+    primeira porta) para que nenhum par de workers partilhe uma porta.
+    """
+    ports = range(ports.start, ports.start + max(len(ports), workers))
+    return list(ports[index::workers])
+
+
+def run_workers(args):
+    """
+    Modo multi-processo: `args.workers` processos partilham as portas UDP e
+    TCP com SO_REUSEPORT. Os agentes são repartidos por agent_id (ver
+    particoes.Shard); cada worker guarda o registo, as sessões e as séries
+    dos seus agentes, carrega e vigia o catálogo de tarefas (compilado uma
+    vez aqui, antes do fork, e partilhado pela cache em disco) e expõe as
+    suas métricas em stats_port + índice.
+    """
+    carregar_configuracao(args.tasks)
+
+    # Os sockets UDP são ligados por ordem antes do fork: o índice no grupo é o do worker
+    udp_sockets = [particoes.reuseport_socket(socket.SOCK_DGRAM, args.udp_port) for _ in range(args.workers)]
+    particoes.attach_agent_filter(udp_sockets[0], args.workers)
+    channels = particoes.create_channels(args.workers)
+
+    parent = os.getpid()
+    children = {}
+    for index in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                for other, sock in enumerate(udp_sockets):
+                    if other != index:
+                        sock.close()
+                global SHARD
+                SHARD = particoes.Shard(index, args.workers, channels)
+                registo.bind(worker=index)
+                iperf_ports = worker_iperf_ports(index, args.workers)
+                udp_port, tcp_port = initialize_server(args.udp_port, args.tcp_port, args.tasks, args.data,
+                                                       iperf_ports)
+                instrumentacao.start_http_server(args.stats_port + index)
+                serve(udp_port, tcp_port, udp_sockets[index], reuse_port=True, parent=parent)
+            except Exception as e:
+                registo.error("Workers", "Worker %d terminou com erro: %s", index, e)
+                status = 1
+            finally:
+                registo.flush()
+                os._exit(status)
+        children[pid] = index
+
+    for sock in udp_sockets:
+        sock.close()
+    for pair in channels:
+        for sock in pair:
+            sock.close()
+    print(f"Servidor rodando com {args.workers} workers. Pressione Ctrl+C para encerrar.")
+
+    try:
+        pid, status = os.wait()
+        registo.error("Workers", "Worker %d terminou (estado %d); a encerrar os restantes", children.pop(pid), status)
+    except KeyboardInterrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGINT)
+        except ProcessLookupError:
+            pass
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Servidor NMS: registo de agentes, tarefas, relatórios e alertas.")
+    parser.add_argument("--udp-port", type=int, default=33333, help="porta UDP (registo, TASK, REPORT)")
+    parser.add_argument("--tcp-port", type=int, default=44444, help="porta TCP (ALERTFLOW)")
+    parser.add_argument("--tasks", default="teste.json", help="ficheiro JSON das tarefas")
+    parser.add_argument("--data", default=DATA_PATH, help="diretório das séries temporais")
+    parser.add_argument("--stats-port", type=int, default=STATS_PORT,
+                        help="porta do endpoint /metrics (com workers, a do worker 0; os seguintes usam as portas seguintes)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processos a partilhar as portas com SO_REUSEPORT, com os agentes repartidos por agent_id")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.workers > 1:
+        run_workers(args)
+        print("\nServidor encerrado.")
+        registo.flush()
+    else:
+        udp_port, tcp_port = initialize_server(args.udp_port, args.tcp_port, args.tasks, args.data)
+        instrumentacao.start_http_server(args.stats_port)
+        print("Servidor rodando. Pressione Ctrl+C para encerrar.")
+        serve(udp_port, tcp_port)
+        print("\nServidor encerrado.")
+        registo.flush()
@@ -0,0 +1,44 @@
+import unittest
+from unittest import mock
+
+import agent
+
+RESULT = {
+    "ping": {"avg_time": 12.5, "packet_loss": 0.0},
+    "iperf": {"bandwidth_mbps": 40.0},
+    "cpu": 91.0,
+    "ram": {"percent": 50.0},
+}
+
+
+class CheckAlertsTest(unittest.TestCase):
+    def check(self, conditions, result=RESULT):
+        with mock.patch.object(agent, "send_alertflow_metric") as send:
+            count = agent.check_alerts(None, None, result, conditions, 0)
+        return count, [(call.args[2], call.args[3]) for call in send.call_args_list]
+
+    def test_plain_thresholds(self):
+        count, sent = self.check({"latency": 10, "bandwidth": 50, "cpu_usage": 95, "ram_usage": 80})
+        self.assertEqual(count, 2)
+        self.assertEqual(sent, [(12.5, 10), (40.0, 50)])
+
+    def test_dict_condition_uses_threshold_and_operator(self):
+        count, sent = self.check({"cpu_usage": {"threshold": 90}, "ram_usage": {"threshold": 60, "operator": "<"}})
+        self.assertEqual(count, 2)
+        self.assertEqual(sent, [(91.0, 90), (50.0, 60)])
+
+    def test_windowed_and_aggregate_rules_are_left_to_the_server(self):
+        count, sent = self.check({
+            "cpu_usage": {"threshold": 10, "aggregate": "p95", "window": 300},
+            "latency": {"threshold": 1, "window": 60},
+        })
+        self.assertEqual((count, sent), (0, []))
+
+    def test_missing_metrics_and_invalid_conditions_are_ignored(self):
+        count, _ = self.check({"latency": 1, "cpu_usage": "alto", "ram_usage": {"operator": ">"}},
+                              result={"cpu": 99.0})
+        self.assertEqual(count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
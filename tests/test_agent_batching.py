@@ -0,0 +1,83 @@
+import shutil
+import socket
+import tempfile
+import unittest
+from threading import Event, Lock
+from unittest import mock
+
+import agent
+import mensagens
+import server
+from armazenamento import SeriesStore
+from fiabilidade import DuplicateFilter, ReliableSender
+from lotes import ReportBatcher
+
+TASK = {"task_id": "t1", "frequency": 10, "metrics": {"cpu_usage": True}, "alert_conditions": {}}
+
+
+class ReportBatchingTest(unittest.TestCase):
+    """
+    Com REPORT_BATCHING ativo, os ciclos recolhidos pelo agente chegam ao
+    servidor num único REPORT_BATCH, ficam no armazenamento e são confirmados.
+    """
+
+    def setUp(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server_socket.bind(("127.0.0.1", 0))
+        self.server_socket.settimeout(2)
+        self.addCleanup(self.server_socket.close)
+        self.agent_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.agent_socket.bind(("127.0.0.1", 0))
+        self.agent_socket.settimeout(2)
+        self.addCleanup(self.agent_socket.close)
+
+        directory = tempfile.mkdtemp(prefix="cc-batching-")
+        self.addCleanup(shutil.rmtree, directory)
+        self.store = SeriesStore(directory)
+        self.addCleanup(self.store.close)
+
+        sampler = mock.Mock()
+        sampler.cpu.side_effect = [10.0, 20.0, 30.0]
+        patches = [
+            mock.patch.object(agent, "REPORT_BATCHING", True),
+            mock.patch.object(agent, "BATCHER", ReportBatcher(max_age=3600)),
+            mock.patch.object(agent, "SAMPLER", sampler),
+            mock.patch.object(agent, "AGENT_ID", 7),
+            mock.patch.object(agent, "SESSION", 99),
+            mock.patch.object(server, "STORE", self.store),
+            mock.patch.object(server, "ROLLUPS", None),
+            mock.patch.object(server, "DUPLICATES", DuplicateFilter()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_cycles_are_sent_as_one_batch_and_stored(self):
+        sender = ReliableSender(self.agent_socket)
+        server_address = self.server_socket.getsockname()
+        task_state = {"stop": Event(), "lock": Lock(), "alertflow_count": 0,
+                      "progress": {"t1": {"results": [], "errors": []}}}
+
+        for _ in range(3):
+            agent.run_collection(sender, server_address, TASK, 0, task_state, TASK["metrics"], {})
+        self.assertEqual(sender.pending, {})  # O bloco ainda está aberto
+
+        agent.BATCHER.max_age = 0
+        agent.send_task_report(sender, server_address, TASK, 0, task_state)
+        self.assertEqual(len(sender.pending), 1)
+
+        data, addr = self.server_socket.recvfrom(mensagens.RECV_BUFFER)
+        self.assertEqual(mensagens.message_type_name(data), "REPORT_BATCH")
+        server.dispatch_datagram(self.server_socket, addr, data)
+
+        timestamps, values = self.store.scan(7, "cpu_usage")
+        self.assertEqual(list(values), [10.0, 20.0, 30.0])
+
+        ack, _ = self.agent_socket.recvfrom(mensagens.RECV_BUFFER)
+        decoded = mensagens.decode_message(ack)
+        self.assertEqual(decoded["type"], "ACK")
+        self.assertTrue(sender.handle_ack(server_address, decoded["sequence"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
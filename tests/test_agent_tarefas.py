@@ -0,0 +1,51 @@
+import unittest
+from threading import Event, Lock
+from unittest import mock
+
+import agent
+import mensagens
+
+SERVER = ("127.0.0.1", 33333)
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append(data)
+
+
+class DuplicateTaskTest(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(agent, "SESSION", 99)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.sock = FakeSocket()
+        self.task_state = {"pending": {}, "updated": Event(), "lock": Lock(), "applied": {}}
+
+    def receive(self, sequence, cpu=True):
+        message = mensagens.create_task_message(sequence, {"cpu_usage": cpu}, {}, {}, 7, 99, task_id="t1")
+        agent.handle_server_message(self.sock, None, self.task_state, None, mensagens.decode_message(message), SERVER)
+
+    def take_pending(self):
+        pending, self.task_state["pending"] = self.task_state["pending"], {}
+        return [task["sequence"] for task in pending.values()]
+
+    def test_retransmitted_task_is_acked_but_not_rescheduled(self):
+        self.receive(5)
+        self.assertEqual(self.take_pending(), [5])
+        self.receive(5)  # O ACK anterior perdeu-se e o servidor retransmitiu
+        self.assertEqual(self.take_pending(), [])
+        self.assertEqual(len(self.sock.sent), 2)
+        self.assertTrue(all(mensagens.decode_message(ack)["sequence"] == 5 for ack in self.sock.sent))
+
+    def test_new_task_for_the_same_task_id_is_scheduled(self):
+        self.receive(5)
+        self.take_pending()
+        self.receive(6, cpu=False)
+        self.assertEqual(self.take_pending(), [6])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+import unittest
+
+from agregados import Rollups
+from armazenamento import SeriesStore
+
+MINUTE = 60_000
+TIERS = {"1m": (MINUTE, 5)}
+
+
+class RollupsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="cc-rollups-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = SeriesStore(self.directory)
+        self.addCleanup(self.store.close)
+        self.rollups = Rollups(TIERS, store=self.store)
+
+    def test_only_open_buckets_stay_in_memory(self):
+        for minute in range(100):
+            self.rollups.add(1, "cpu_usage", minute * MINUTE, minute)
+        self.assertEqual(list(self.rollups.buckets[("1", "cpu_usage", "1m")]), [98 * MINUTE, 99 * MINUTE])
+        rows = self.rollups.query(1, "cpu_usage", "1m")
+        self.assertEqual([row["start"] for row in rows], [minute * MINUTE for minute in range(100)])
+
+    def test_late_sample_rewrites_the_persisted_bucket(self):
+        self.rollups.add(1, "cpu_usage", 0, 10)
+        self.rollups.add(1, "cpu_usage", 5 * MINUTE, 1)
+        self.assertNotIn(0, self.rollups.buckets[("1", "cpu_usage", "1m")])
+        self.rollups.add(1, "cpu_usage", 30_000, 30)
+        first = self.rollups.query(1, "cpu_usage", "1m", 0, MINUTE)
+        self.assertEqual(first, [{"start": 0, "min": 10, "max": 30, "avg": 20, "count": 2}])
+
+    def test_flush_persists_open_buckets(self):
+        self.rollups.add(1, "cpu_usage", 0, 4)
+        self.rollups.flush()
+        self.assertEqual(self.rollups.buckets[("1", "cpu_usage", "1m")], {})
+        self.assertEqual(self.rollups.query(1, "cpu_usage", "1m")[0]["count"], 1)
+
+    def test_restart_merges_with_the_flushed_bucket(self):
+        tiers = {"1m": (MINUTE, 5), "1h": (60 * MINUTE, 5)}
+        rollups = Rollups(tiers, store=self.store)
+        for second in range(10):
+            rollups.add(1, "cpu_usage", second * 1000, 10.0)
+        rollups.flush()
+        self.store.close()
+
+        store = SeriesStore(self.directory)
+        self.addCleanup(store.close)
+        restarted = Rollups(tiers, store=store)
+        restarted.add(1, "cpu_usage", 20_000, 54.0)
+        restarted.flush()
+        for tier in tiers:
+            [row] = restarted.query(1, "cpu_usage", tier)
+            self.assertEqual((row["count"], row["avg"], row["min"], row["max"]), (11, 14.0, 10.0, 54.0))
+
+    def test_without_store_late_samples_outside_retention_are_rejected(self):
+        rollups = Rollups(TIERS)
+        for minute in range(10):
+            rollups.add(1, "cpu_usage", minute * MINUTE, minute)
+        self.assertEqual(len(rollups.query(1, "cpu_usage", "1m")), 5)
+        rollups.add(1, "cpu_usage", 6 * MINUTE, 100)
+        rollups.add(1, "cpu_usage", 0, 100)
+        self.assertEqual(rollups.query(1, "cpu_usage", "1m", 6 * MINUTE, 7 * MINUTE)[0]["max"], 100)
+        self.assertEqual(rollups.rejected, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+
+import mensagens
+import server
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def send_alert(sock, payload, sequence):
+    message = mensagens.pack_header(mensagens.MESSAGE_TYPES["ALERTFLOW"], sequence, 1, 1) + payload
+    sock.sendall(mensagens.frame_message(message))
+
+
+def read_ack(sock):
+    reader = mensagens.FrameReader()
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            return None
+        messages = reader.feed(data)
+        if messages:
+            return mensagens.decode_message(messages[0])
+
+
+class DecodeMessageTest(unittest.TestCase):
+    def test_alertflow_body_must_be_object(self):
+        message = mensagens.pack_header(mensagens.MESSAGE_TYPES["ALERTFLOW"], 1, 1, 1) + b"5"
+        with self.assertRaises(ValueError):
+            mensagens.decode_message(message)
+
+    def test_task_body_must_be_object(self):
+        message = mensagens.pack_header(mensagens.MESSAGE_TYPES["TASK"], 1, 1, 1) + b"[1, 2]"
+        with self.assertRaises(ValueError):
+            mensagens.decode_message(message)
+
+
+class AlertServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        threading.Thread(target=server.tcp_server, args=(cls.port,), daemon=True).start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", cls.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("servidor TCP não arrancou")
+
+    def connect(self):
+        sock = socket.create_connection(("127.0.0.1", self.port), timeout=5)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_malformed_alert_is_skipped(self):
+        sock = self.connect()
+        send_alert(sock, b'{"cpu": 97}', 1)
+        self.assertEqual(read_ack(sock)["sequence"], 1)
+
+        send_alert(sock, b"5", 2)  # Corpo JSON que não é um objeto: ignorado, sem ACK
+        send_alert(sock, b'{"cpu": 98}', 3)
+        self.assertEqual(read_ack(sock)["sequence"], 3)
+
+    def test_unexpected_error_only_closes_its_connection(self):
+        original = server.handle_alert
+
+        def failing(addr, message):
+            raise TypeError("falha inesperada")
+
+        server.handle_alert = failing
+        try:
+            bad = self.connect()
+            send_alert(bad, b'{"cpu": 97}', 1)
+            self.assertIsNone(read_ack(bad))  # Ligação fechada pelo servidor
+        finally:
+            server.handle_alert = original
+
+        good = self.connect()
+        send_alert(good, b'{"cpu": 98}', 2)
+        self.assertEqual(read_ack(good)["sequence"], 2)
+
+    def test_oversized_frame_closes_connection(self):
+        sock = self.connect()
+        sock.sendall(struct.pack("!I", mensagens.MAX_FRAME + 1))
+        self.assertIsNone(read_ack(sock))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+from unittest import mock
+
+import agent
+import amostragem
+from amostragem import DeviceSampler
+
+
+class DeviceSamplerCpuTest(unittest.TestCase):
+    def test_cpu_is_none_until_a_delta_exists(self):
+        sampler = DeviceSampler()
+        with mock.patch.object(amostragem, "read_cpu_times", side_effect=[(10, 100), (40, 200)]):
+            sampler.sample()
+            self.assertIsNone(sampler.cpu())
+            sampler.sample()
+        self.assertEqual(sampler.cpu(), 30.0)
+
+    def test_cycle_without_cpu_delta_leaves_the_metric_out(self):
+        with mock.patch.object(agent, "SAMPLER", DeviceSampler()):
+            self.assertEqual(agent.collect_cycle({"cpu_usage": True}, {}), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
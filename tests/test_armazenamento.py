@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from armazenamento import FLAG_UNSORTED, Segment, SeriesStore
+
+
+class SeriesStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="cc-store-")
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open(self, **kwargs):
+        store = SeriesStore(self.directory, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def segments(self, agent_id, metric):
+        path = os.path.join(self.directory, str(agent_id), metric)
+        return sorted(name for name in os.listdir(path) if name.endswith(".seg"))
+
+    def test_range_scan_is_half_open(self):
+        store = self.open()
+        store.append_many(1, "cpu_usage", [(t, t / 10) for t in range(0, 100, 10)])
+        timestamps, values = store.scan(1, "cpu_usage", 20, 50)
+        self.assertEqual((list(timestamps), list(values)), ([20, 30, 40], [2.0, 3.0, 4.0]))
+        self.assertEqual(len(store.scan(1, "desconhecida")[0]), 0)
+
+    def test_segment_rollover(self):
+        store = self.open(segment_capacity=4)
+        store.append_many(1, "cpu_usage", [(t, t) for t in range(10)])
+        self.assertEqual(self.segments(1, "cpu_usage"), ["00000000.seg", "00000001.seg", "00000002.seg"])
+        self.assertEqual(list(store.scan(1, "cpu_usage", 3, 9)[0]), [3, 4, 5, 6, 7, 8])
+
+    def test_unsorted_segment_scan(self):
+        store = self.open(segment_capacity=8)
+        store.append_many(1, "cpu_usage", [(30, 3.0), (10, 1.0), (20, 2.0), (40, 4.0)])
+        timestamps, values = store.scan(1, "cpu_usage", 10, 31)
+        self.assertEqual((list(timestamps), list(values)), ([30, 10, 20], [3.0, 1.0, 2.0]))
+        store.close()
+        segment = Segment(os.path.join(self.directory, "1", "cpu_usage", "00000000.seg"))
+        try:
+            self.assertTrue(segment.flags & FLAG_UNSORTED)
+        finally:
+            segment.close()
+
+    def test_evicted_series_stay_readable_and_writable(self):
+        store = self.open(max_open=2)
+        for metric in ("a", "b", "c"):
+            store.append(1, metric, 1, 1.0)
+        self.assertEqual(len(store.series), 2)
+        store.append(1, "a", 2, 2.0)  # Reaberta depois de sair da lista de séries abertas
+        self.assertEqual(list(store.scan(1, "a")[1]), [1.0, 2.0])
+
+    def test_data_survives_reopening(self):
+        store = self.open(segment_capacity=4)
+        store.append_many(7, "latency", [(t, t * 2) for t in range(6)])
+        store.close()
+        reopened = self.open(segment_capacity=4)
+        reopened.append(7, "latency", 6, 12)
+        self.assertEqual(list(reopened.scan(7, "latency")[1]), [t * 2 for t in range(7)])
+        self.assertEqual(reopened.agents(), ["7"])
+        self.assertEqual(reopened.metrics(7), ["latency"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import time
+import unittest
+from unittest import mock
+
+import alertas
+import mensagens
+from alertas import AlertChannel
+
+
+class FakeSocket:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = bytearray()
+
+    def setsockopt(self, *args):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def sendall(self, data):
+        if self.fail:
+            raise ConnectionResetError("ligação reposta")
+        self.sent += data
+
+    def close(self):
+        pass
+
+
+class AlertChannelReconnectTest(unittest.TestCase):
+    def test_failed_resend_on_reconnect_keeps_the_channel_alive(self):
+        # 1.ª ligação: o envio falha; 2.ª: o reenvio após ligar falha; 3.ª: entrega
+        sockets = [FakeSocket(fail=True), FakeSocket(fail=True), FakeSocket()]
+        message = mensagens.create_alert_message_metric({"cpu": 99}, 5, 1, 1)
+        with mock.patch.object(alertas.socket, "create_connection", side_effect=sockets + [FakeSocket()] * 10), \
+                mock.patch.object(alertas.select, "select", return_value=([], [], [])):
+            channel = AlertChannel("127.0.0.1", 1)
+            channel.send(message)
+            deadline = time.monotonic() + 5
+            while not sockets[2].sent and time.monotonic() < deadline:
+                time.sleep(0.05)
+            alive = channel.thread.is_alive()
+            channel.close()
+
+        self.assertTrue(alive)
+        self.assertEqual(bytes(sockets[2].sent), mensagens.frame_message(message))
+        self.assertIn(5, channel.unacked)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import time
+import unittest
+from unittest import mock
+
+import mensagens
+from fiabilidade import DuplicateFilter, ReliableSender
+from instrumentacao import QUEUE_DROPS
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, destination):
+        self.sent.append((data, destination))
+
+
+PEER = ("127.0.0.1", 1)
+
+
+class ReliableSenderTest(unittest.TestCase):
+    def test_lost_window_backs_off_once(self):
+        sender = ReliableSender(FakeSocket(), window=8, initial_rto=0.02, tick=0.01)
+        for sequence in range(8):
+            sender.send(b"x", PEER, sequence=sequence)
+        start = min(entry.sent_at for entry in sender.pending.values())
+        sender.poll(start + 0.1)
+        self.assertEqual(sender.rto(PEER), 0.04)
+        self.assertTrue(all(entry.attempts == 2 for entry in sender.pending.values()))
+
+    def test_sequence_is_read_from_the_header(self):
+        sender = ReliableSender(FakeSocket())
+        message = mensagens.create_task_message(42, {"cpu_usage": True}, {}, {}, 7, 1)
+        with mock.patch.object(mensagens, "decode_message", side_effect=AssertionError("corpo descodificado")):
+            entry = sender.send(message, PEER)
+        self.assertEqual(entry.key, (PEER, 42))
+        with self.assertRaises(ValueError):
+            sender.send(b"\x00", PEER)
+
+    def test_queue_is_capped_dropping_the_oldest(self):
+        results = []
+        sender = ReliableSender(FakeSocket(), window=1, max_queue=2)
+        dropped = QUEUE_DROPS.value()
+        for sequence in range(4):
+            sender.send(b"x", PEER, sequence=sequence, callback=lambda acked, s=sequence: results.append((s, acked)))
+        queue = sender.peers[PEER].queue
+        self.assertEqual([entry.key[1] for entry in queue], [2, 3])
+        self.assertEqual(results, [(1, False)])
+        self.assertEqual(QUEUE_DROPS.value(), dropped + 1)
+
+
+
+class DuplicateFilterTest(unittest.TestCase):
+    def test_in_window_sequences(self):
+        duplicates = DuplicateFilter(window=64)
+        self.assertFalse(duplicates.seen(1, 1, 10))
+        self.assertFalse(duplicates.seen(1, 1, 12))
+        self.assertFalse(duplicates.seen(1, 1, 11))  # Fora de ordem, mas nova
+        self.assertTrue(duplicates.seen(1, 1, 11))
+        self.assertTrue(duplicates.seen(1, 1, 12))
+
+    def test_too_old_sequence_is_a_duplicate(self):
+        duplicates = DuplicateFilter(window=64)
+        duplicates.seen(1, 1, 1000)
+        self.assertTrue(duplicates.seen(1, 1, 1000 - 64))
+        self.assertFalse(duplicates.seen(1, 1, 1000 - 63))
+
+    def test_huge_jump_resets_the_window_cheaply(self):
+        duplicates = DuplicateFilter()
+        duplicates.seen(1, 1, 1)
+        jump = mensagens.SEQUENCE_MODULO // 2 - 1
+        start = time.perf_counter()
+        self.assertFalse(duplicates.seen(1, 1, 1 + jump))
+        self.assertLess(time.perf_counter() - start, 0.05)
+        self.assertEqual(duplicates.state[(1, 1)], [1 + jump, 1])
+        self.assertTrue(duplicates.seen(1, 1, 1 + jump))
+        self.assertTrue(duplicates.seen(1, 1, 1))  # A sequência antiga ficou fora da janela
+
+
+if __name__ == "__main__":
+    unittest.main()
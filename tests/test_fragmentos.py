@@ -0,0 +1,81 @@
+import itertools
+import random
+import unittest
+
+import mensagens
+from mensagens import Reassembler
+
+PEER = ("127.0.0.1", 1)
+
+
+def fragments(message, start=1):
+    sequences = itertools.count(start)
+    datagrams = mensagens.split_message(message, lambda: next(sequences), 7, 99)
+    return [mensagens.decode_message(datagram) for datagram in datagrams]
+
+
+class SplitMessageTest(unittest.TestCase):
+    def setUp(self):
+        self.message = bytes(random.Random(1).getrandbits(8) for _ in range(5000))
+
+    def test_small_message_is_not_fragmented(self):
+        self.assertEqual(mensagens.split_message(b"x" * 100, lambda: 1), [b"x" * 100])
+
+    def test_fragments_fit_a_datagram_and_have_their_own_sequences(self):
+        datagrams = mensagens.split_message(self.message, iter(range(1, 100)).__next__, 7, 99)
+        self.assertTrue(all(len(datagram) <= mensagens.MAX_DATAGRAM for datagram in datagrams))
+        decoded = [mensagens.decode_message(datagram) for datagram in datagrams]
+        self.assertEqual(len({fragment["sequence"] for fragment in decoded}), len(decoded))
+        self.assertEqual({fragment["message_id"] for fragment in decoded}, {1})
+
+    def test_too_many_fragments_is_rejected(self):
+        size = mensagens.FRAGMENT_PAYLOAD * mensagens.MAX_FRAGMENTS + 1
+        with self.assertRaises(ValueError):
+            mensagens.split_message(b"x" * size, lambda: 1)
+
+    def test_round_trip_in_order(self):
+        reassembler = Reassembler()
+        results = [reassembler.add(PEER, fragment, now=0) for fragment in fragments(self.message)]
+        self.assertEqual(results[-1], self.message)
+        self.assertTrue(all(result is None for result in results[:-1]))
+        self.assertEqual(reassembler.partial, {})
+
+    def test_out_of_order_and_duplicated_fragments(self):
+        parts = fragments(self.message)
+        shuffled = parts[::-1] + [parts[0]]
+        reassembler = Reassembler()
+        results = [reassembler.add(PEER, fragment, now=0) for fragment in [parts[1]] + shuffled]
+        self.assertEqual([result for result in results if result is not None], [self.message])
+
+    def test_lost_fragment_leaves_the_message_incomplete(self):
+        parts = fragments(self.message)
+        reassembler = Reassembler()
+        for fragment in parts[:1] + parts[2:]:
+            self.assertIsNone(reassembler.add(PEER, fragment, now=0))
+        self.assertEqual(len(reassembler.partial), 1)
+        # A retransmissão do fragmento em falta completa a mensagem
+        self.assertEqual(reassembler.add(PEER, parts[1], now=1), self.message)
+
+    def test_incomplete_messages_expire(self):
+        parts = fragments(self.message)
+        reassembler = Reassembler(timeout=10)
+        reassembler.add(PEER, parts[0], now=0)
+        reassembler.expire(now=11)
+        self.assertEqual(reassembler.partial, {})
+        # Os restantes fragmentos já não completam a mensagem expirada
+        self.assertTrue(all(reassembler.add(PEER, fragment, now=11) is None for fragment in parts[1:]))
+
+    def test_oldest_incomplete_message_is_dropped_at_the_limit(self):
+        reassembler = Reassembler(max_messages=2)
+        first, second, third = (fragments(self.message, start)[0] for start in (1, 100, 200))
+        for fragment in (first, second, third):
+            reassembler.add(PEER, fragment, now=0)
+        self.assertEqual([key[3] for key in reassembler.partial], [100, 200])
+
+    def test_invalid_fragment_headers_are_ignored(self):
+        fragment = dict(fragments(self.message)[0], index=9, count=4)
+        self.assertIsNone(Reassembler().add(PEER, fragment, now=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from unittest import mock
+
+import iperf
+import server
+from iperf import IperfPool
+
+TASK = {
+    "device_metrics": {},
+    "link_metrics": {"bandwidth": {"iperf": {"duration": 5, "frequency": 60}}},
+    "alertflow_conditions": {},
+}
+
+
+class FakeProcess:
+    def __init__(self, command, **kwargs):
+        self.port = int(command[-1])
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+
+
+class WorkerPortsTest(unittest.TestCase):
+    def test_ports_are_disjoint_and_never_empty(self):
+        for workers in (1, 3, 8, 12):
+            assigned = [server.worker_iperf_ports(index, workers) for index in range(workers)]
+            ports = [port for worker in assigned for port in worker]
+            self.assertTrue(all(assigned))
+            self.assertEqual(len(ports), len(set(ports)))
+            self.assertEqual(len(ports), max(workers, len(server.IPERF_PORTS)))
+
+
+class IperfReleaseTest(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.object(iperf.subprocess, "Popen", FakeProcess),
+            mock.patch.object(server, "IPERF", IperfPool()),
+            mock.patch.object(server, "AGENTS", {7: {"addr": ("127.0.0.1", 1), "session": 1}}),
+            mock.patch.object(server, "TASK_CACHE", {}),
+            mock.patch.object(server, "send_reliable"),
+            mock.patch.object(server, "server_ip", return_value="127.0.0.1"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_empty_task_releases_the_slot(self):
+        server.send_task(7, "t1", TASK)
+        self.assertIn(("7", "t1"), server.IPERF.slots)
+        server.send_task(7, "t1", None)
+        self.assertEqual(server.IPERF.slots, {})
+
+    def test_removed_task_releases_the_slot_of_an_unregistered_agent(self):
+        server.send_task(7, "t1", TASK)
+        server.AGENTS.clear()
+        catalogue = mock.Mock()
+        catalogue.tasks.return_value = {}
+        with mock.patch.object(server, "CATALOGUE", catalogue), mock.patch.object(server, "RULES"):
+            server.push_task_changes({"7": ["t1"]})
+        self.assertEqual(server.IPERF.slots, {})
+
+
+
+class IperfPoolTest(unittest.TestCase):
+    def popen(self, failing=()):
+        def start(command, **kwargs):
+            if int(command[-1]) in failing:
+                raise OSError("iperf3 indisponível")
+            return FakeProcess(command)
+        return mock.patch.object(iperf.subprocess, "Popen", side_effect=start)
+
+    def test_start_tries_every_port(self):
+        pool = IperfPool([5201, 5202, 5203])
+        with self.popen(failing={5201}):
+            self.assertFalse(pool.start())
+        self.assertEqual(sorted(pool.processes), [5202, 5203])
+
+    def test_dead_server_is_restarted_when_its_slot_is_handed_out(self):
+        pool = IperfPool([5201])
+        with self.popen():
+            pool.start()
+            slot = pool.assign("a", 5, 60)
+            dead = pool.processes[5201]
+            dead.returncode = 1
+            self.assertIs(pool.assign("a", 5, 60), slot)
+        self.assertIsNot(pool.processes[5201], dead)
+
+    def test_ports_without_a_server_are_not_handed_out(self):
+        pool = IperfPool([5201, 5202])
+        with self.popen(failing={5201}):
+            pool.start()
+            self.assertEqual(pool.assign("a", 5, 60).port, 5202)
+
+
+if __name__ == "__main__":
+    unittest.main()
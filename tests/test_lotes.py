@@ -0,0 +1,66 @@
+import unittest
+
+import mensagens
+from lotes import ReportBatcher
+
+
+class VarintTest(unittest.TestCase):
+    def test_zigzag_round_trip(self):
+        values = [0, 1, -1, 63, -64, 64, -65, 300, -300, 2 ** 31, -2 ** 31, 2 ** 62, -2 ** 63, 2 ** 63 - 1]
+        data = bytearray()
+        for value in values:
+            mensagens._put_varint(data, value)
+        offset, decoded = 0, []
+        for _ in values:
+            value, offset = mensagens._get_varint(data, offset)
+            decoded.append(value)
+        self.assertEqual(decoded, values)
+        self.assertEqual(offset, len(data))
+
+    def test_small_negative_deltas_stay_small(self):
+        for value, size in ((-1, 1), (-64, 1), (-65, 2)):
+            data = bytearray()
+            mensagens._put_varint(data, value)
+            self.assertEqual(len(data), size)
+
+
+class ReportBatchTest(unittest.TestCase):
+    def test_round_trip_with_negative_deltas(self):
+        builder = mensagens.ReportBatchBuilder(1_000_000)
+        samples = [(1_000_000, 50.0), (1_001_000, 12.5), (999_500, -3.25), (1_005_000, 0.001)]
+        for timestamp, value in samples:
+            builder.add("cpu_usage", timestamp, value)
+        builder.add("latency", 1_000_000, 7.0)
+        self.assertEqual(mensagens.decode_report_batch(builder.to_bytes()),
+                         {"cpu_usage": samples, "latency": [(1_000_000, 7.0)]})
+        self.assertEqual(builder.size(), len(builder.to_bytes()))
+
+    def test_message_round_trip(self):
+        builder = mensagens.ReportBatchBuilder(0)
+        builder.add("ram_usage", 0, 42.0)
+        decoded = mensagens.decode_message(mensagens.create_report_batch_message(5, builder, 7, 99))
+        self.assertEqual((decoded["type"], decoded["sequence"], decoded["agent_id"]), ("REPORT_BATCH", 5, 7))
+        self.assertEqual(decoded["series"], {"ram_usage": [(0, 42.0)]})
+
+
+class ReportBatcherLimitsTest(unittest.TestCase):
+    def test_batches_close_before_exceeding_max_bytes(self):
+        batcher = ReportBatcher(max_bytes=200, max_age=3600)
+        batches = []
+        for i in range(100):
+            batches.extend(batcher.add({"cpu_usage": i * 1.5, "ram_usage": -i}, timestamp=i))
+        batches.extend(batcher.flush())
+        self.assertGreater(len(batches), 1)
+        self.assertTrue(all(batch.size() <= 200 for batch in batches))
+        self.assertEqual(sum(batch.samples() for batch in batches), 200)
+
+    def test_batch_closes_at_max_age(self):
+        batcher = ReportBatcher(max_age=60)
+        self.assertEqual(batcher.add({"cpu_usage": 1.0}), [])
+        self.assertEqual(batcher.poll(now=batcher.opened_at + 59), [])
+        self.assertEqual(len(batcher.poll(now=batcher.opened_at + 60)), 1)
+        self.assertEqual(batcher.flush(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import parserJSON
+from parserJSON import CACHE_SUFFIX, carregar_configuracao
+
+
+def tasks(device_id="1"):
+    return {"tasks": [{"task_id": "t1", "frequency": 10, "devices": [
+        {"device_id": device_id, "device_metrics": {"cpu_usage": True}}]}]}
+
+
+class ConfigurationCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="cc-parser-")
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "tarefas.json")
+        self.write(tasks())
+
+    def write(self, data, mtime_ns=None):
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def load(self):
+        """
+        Carrega a configuração e indica se o JSON foi validado (cache não usada).
+        """
+        with mock.patch.object(parserJSON, "validar_tarefas", wraps=parserJSON.validar_tarefas) as validar:
+            devices = carregar_configuracao(self.path)
+        return devices, validar.called
+
+    def test_second_load_comes_from_the_cache(self):
+        devices, compiled = self.load()
+        self.assertTrue(compiled)
+        self.assertTrue(os.path.exists(self.path + CACHE_SUFFIX))
+        self.assertEqual(self.load(), (devices, False))
+
+    def test_size_change_recompiles(self):
+        self.write(tasks(), mtime_ns=1_000_000_000)
+        self.load()
+        self.write(tasks(device_id="12345"), mtime_ns=1_000_000_000)
+        devices, compiled = self.load()
+        self.assertTrue(compiled)
+        self.assertEqual(devices[0]["device_id"], "12345")
+
+    def test_mtime_change_with_new_content_recompiles(self):
+        self.write(tasks(device_id="1"), mtime_ns=1_000_000_000)
+        self.load()
+        self.write(tasks(device_id="2"), mtime_ns=2_000_000_000)  # Mesmo tamanho, conteúdo diferente
+        self.assertEqual(os.path.getsize(self.path), len(json.dumps(tasks())))
+        devices, compiled = self.load()
+        self.assertTrue(compiled)
+        self.assertEqual(devices[0]["device_id"], "2")
+
+    def test_touched_file_reuses_the_compilation(self):
+        self.write(tasks(), mtime_ns=1_000_000_000)
+        devices, _ = self.load()
+        os.utime(self.path, ns=(3_000_000_000, 3_000_000_000))
+        self.assertEqual(self.load(), (devices, False))
+        # A cache passa a ter o novo mtime: a carga seguinte nem calcula o SHA-256
+        with mock.patch.object(parserJSON.hashlib, "sha256", side_effect=AssertionError("SHA calculado")):
+            self.assertEqual(carregar_configuracao(self.path), devices)
+
+    def test_corrupt_cache_is_ignored(self):
+        self.load()
+        with open(self.path + CACHE_SUFFIX, "wb") as f:
+            f.write(b"lixo")
+        devices, compiled = self.load()
+        self.assertTrue(compiled)
+        self.assertEqual(len(devices), 1)
+
+    def test_cache_can_be_disabled(self):
+        carregar_configuracao(self.path, usar_cache=False)
+        self.assertFalse(os.path.exists(self.path + CACHE_SUFFIX))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import math
+import unittest
+
+from regras import AGGREGATES, Rule, RuleEngine, compile_conditions
+
+SECOND = 1000
+
+
+def engine(conditions):
+    rules = RuleEngine()
+    rules.load([{"device_id": 1, "alertflow_conditions": conditions}])
+    return rules
+
+
+class AggregateTest(unittest.TestCase):
+    def test_nearest_rank_percentiles(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(AGGREGATES["p95"](values), 95)
+        self.assertEqual(AGGREGATES["p50"](values), 50)
+        self.assertEqual(AGGREGATES["p99"]([7.0]), 7.0)
+
+
+class CompileConditionsTest(unittest.TestCase):
+    def test_forms_and_defaults(self):
+        plain, bandwidth, windowed = compile_conditions({
+            "latency": 5, "bandwidth": {"threshold": 10}, "cpu_usage": {"threshold": 80, "window": 60},
+        })
+        self.assertEqual((plain.operator, plain.window, plain.aggregate), (">", 0, None))
+        self.assertEqual(bandwidth.operator, "<")
+        self.assertEqual((windowed.aggregate, windowed.describe()), ("avg", "avg(cpu_usage, 60s) > 80"))
+
+    def test_invalid_conditions_are_skipped(self):
+        rules = compile_conditions({"a": "alto", "b": {"operator": ">"}, "c": {"threshold": 1, "aggregate": "p42"},
+                                    "d": {"threshold": 1, "operator": "!="}, "e": 3})
+        self.assertEqual([rule.metric for rule in rules], ["e"])
+
+
+class RuleEngineTest(unittest.TestCase):
+    def test_p95_over_a_window(self):
+        rules = engine({"latency": {"threshold": 90, "aggregate": "p95", "window": 100}})
+        # 100 amostras, uma por segundo, de 1 a 100: p95 = 95
+        batch = [(i * SECOND, float(i)) for i in range(1, 101)]
+        [alert] = rules.evaluate(1, {"latency": batch})
+        self.assertEqual((alert["value"], alert["rule"]), (95.0, "p95(latency, 100s) > 90"))
+
+    def test_old_samples_leave_the_window(self):
+        rules = engine({"latency": {"threshold": 50, "aggregate": "max", "window": 10}})
+        self.assertEqual(len(rules.evaluate(1, {"latency": [(0, 100.0)]})), 1)
+        # 10 s depois, a amostra alta saiu da janela e a regra deixa de se verificar
+        self.assertEqual(rules.evaluate(1, {"latency": [(10 * SECOND, 1.0)]}), [])
+        [alert] = rules.evaluate(1, {"latency": [(11 * SECOND, 60.0)]})
+        self.assertEqual(alert["value"], 60.0)
+
+    def test_alert_fires_once_until_the_condition_clears(self):
+        rules = engine({"cpu_usage": 80})
+        self.assertEqual(len(rules.evaluate(1, {"cpu_usage": [(0, 90.0)]})), 1)
+        self.assertEqual(rules.evaluate(1, {"cpu_usage": [(1, 95.0)]}), [])
+        self.assertEqual(rules.evaluate(1, {"cpu_usage": [(2, 10.0)]}), [])
+        self.assertEqual(len(rules.evaluate(1, {"cpu_usage": [(3, 85.0)]})), 1)
+
+    def test_batch_uses_the_worst_value_in_the_comparison_direction(self):
+        rules = engine({"bandwidth": 10})
+        [alert] = rules.evaluate(1, {"bandwidth": [(0, 50.0), (1, 5.0), (2, 40.0)]})
+        self.assertEqual(alert["value"], 5.0)
+
+    def test_missing_and_invalid_values_are_ignored(self):
+        rules = engine({"latency": 1, "cpu_usage": {"threshold": 1, "window": 60}})
+        self.assertEqual(rules.evaluate(1, {"latency": [(0, None), (1, math.nan)]}), [])
+        self.assertEqual(rules.evaluate(2, {"latency": [(0, 100.0)]}), [])  # Sem regras para o agente 2
+
+    def test_window_is_shared_by_rules_on_the_same_metric(self):
+        rules = engine({"latency": {"threshold": 0, "aggregate": "count", "window": 60}})
+        rules.rules["1"].append(Rule("latency", 100, aggregate="max", window=60))
+        alerts = rules.evaluate(1, {"latency": [(0, 1.0), (SECOND, 2.0)]})
+        self.assertEqual([alert["value"] for alert in alerts], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import threading
+import unittest
+
+import mensagens
+from lotes import ReportBatcher
+
+RESULT = {"cpu": 10.0, "ram": {"total": 8.0, "available": 2.5, "used": 5.5, "percent": 68.75}}
+
+
+class SplitReportTest(unittest.TestCase):
+    def test_large_report_is_split_into_decodable_chunks(self):
+        report = {"task_id": "t1", "status": "success", "results": [dict(RESULT, cpu=float(i)) for i in range(600)]}
+        parts = mensagens.split_report(report)
+        self.assertEqual([len(part["results"]) for part in parts], [255, 255, 90])
+        cpus = []
+        for part in parts:
+            decoded = mensagens.decode_report(mensagens.encode_report(part))
+            self.assertEqual(decoded["task_id"], "t1")
+            cpus.extend(result["cpu"] for result in decoded["results"])
+            self.assertTrue(all(result["ram"] == RESULT["ram"] for result in decoded["results"]))
+        self.assertEqual(cpus, [float(i) for i in range(600)])
+
+    def test_encode_rejects_too_many_results(self):
+        with self.assertRaises(ValueError):
+            mensagens.encode_report({"task_id": "t1", "status": "success", "results": [RESULT] * 256})
+
+
+class ReportBatcherTest(unittest.TestCase):
+    def test_concurrent_adds_keep_every_sample(self):
+        batcher = ReportBatcher()
+        batches = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(200):
+                ready = batcher.add({"cpu_usage": 1.0, "ram_usage": 2.0})
+                with lock:
+                    batches.extend(ready)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batches.extend(batcher.flush())
+        self.assertEqual(sum(batch.samples() for batch in batches), 8 * 200 * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+import server
+from iperf import IperfPool
+
+TASK = {"device_metrics": {"cpu_usage": True}, "link_metrics": {}, "alertflow_conditions": {}}
+
+
+class TaskCacheTest(unittest.TestCase):
+    def setUp(self):
+        catalogue = mock.Mock()
+        catalogue.tasks.return_value = {"t1": TASK}
+        patches = [
+            mock.patch.object(server, "IPERF", IperfPool()),
+            mock.patch.object(server, "AGENTS", {}),
+            mock.patch.object(server, "TASK_CACHE", {}),
+            mock.patch.object(server, "CATALOGUE", catalogue),
+            mock.patch.object(server, "RULES"),
+            mock.patch.object(server, "SERVER_IP", "10.0.0.1"),
+            mock.patch.object(server, "SERVER_IP_CHECKED", float("inf")),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_payload_is_cached(self):
+        payload = server.task_payload(7, "t1", TASK)
+        self.assertIs(server.TASK_CACHE[("7", "t1")], payload)
+        self.assertIs(server.task_payload(7, "t1", TASK), payload)
+
+    def test_payload_built_during_a_reload_is_not_cached(self):
+        replace_ip = server.replace_ip
+
+        def reload_midway(task, address):
+            server.push_task_changes({"7": ["t1"]})  # Thread do catálogo, a meio do cálculo
+            return replace_ip(task, address)
+
+        with mock.patch.object(server, "replace_ip", side_effect=reload_midway):
+            server.task_payload(7, "t1", TASK)
+        self.assertNotIn(("7", "t1"), server.TASK_CACHE)
+
+    def test_server_ip_change_invalidates_the_cache(self):
+        server.task_payload(7, "t1", TASK)
+        server.SERVER_IP_CHECKED = float("-inf")
+        with mock.patch.object(server, "get_server_ip", return_value="10.0.0.2"):
+            self.assertEqual(server.server_ip(), "10.0.0.2")
+        self.assertEqual(server.TASK_CACHE, {})
+
+
+if __name__ == "__main__":
+    unittest.main()